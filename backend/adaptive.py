@@ -0,0 +1,171 @@
+"""
+Deadline-aware quality control for video analysis: trade sampling rate, resolution and weather cadence for speed
+"""
+
+import time
+from typing import Dict, List, Optional
+
+
+# Quality ladder, best first: sample every `stride`-th frame of the fps grid, detect at
+# `scale` x resolution, classify weather at 1/`weatherEvery` of the usual cadence
+QUALITY_LEVELS = (
+    {'stride': 1, 'scale': 1.0, 'weatherEvery': 1},
+    {'stride': 1, 'scale': 0.75, 'weatherEvery': 2},
+    {'stride': 2, 'scale': 0.75, 'weatherEvery': 2},
+    {'stride': 2, 'scale': 0.5, 'weatherEvery': 4},
+    {'stride': 4, 'scale': 0.5, 'weatherEvery': 4},
+    {'stride': 8, 'scale': 0.5, 'weatherEvery': 8},
+)
+
+# Share of the per-frame time that does not shrink with the inference resolution (decode, quality, saving)
+FIXED_COST_SHARE = 0.3
+
+
+class QualityController:
+    """Pick the best quality level that still meets a completion target, from measured latency
+
+    The target is either a deadline (deadlineSeconds for the whole analysis) or a
+    throughput (processingFps source frames per wall-clock second; the source fps
+    means real time). After every `window` analysed frames the controller predicts
+    the wall time per source frame of each level from the measured latency
+    (observed levels use their own EWMA, others are extrapolated from the current
+    one by pixel count) and switches to the best level that fits. Moving back up
+    needs a `headroom` margin so the level does not oscillate.
+    """
+
+    def __init__(
+        self,
+        total_frames: int,
+        frame_interval: int,
+        deadline_seconds: Optional[float] = None,
+        processing_fps: Optional[float] = None,
+        window: int = 5,
+        headroom: float = 0.8,
+        max_level: int = len(QUALITY_LEVELS) - 1
+    ):
+        self.total_frames = max(1, total_frames)
+        self.frame_interval = max(1, frame_interval)
+        self.deadline_seconds = deadline_seconds
+        self.processing_fps = processing_fps
+        self.window = max(1, window)
+        self.headroom = headroom
+        self.max_level = min(max(0, max_level), len(QUALITY_LEVELS) - 1)
+        # Work after the frame loop (statistics, charts) comes out of the deadline
+        self.reserve_seconds = min(10.0, 0.1 * deadline_seconds) if deadline_seconds else 0.0
+
+        self.level = 0
+        self.latency: Dict[int, float] = {}
+        self.frames_per_level = [0] * len(QUALITY_LEVELS)
+        self.changes: List[Dict] = []
+        self.started = time.monotonic()
+        self._last_tick: Optional[float] = None
+        self._since_update = 0
+        self._position = 0
+
+    @classmethod
+    def from_settings(cls, settings: Dict, total_frames: int, frame_interval: int) -> Optional['QualityController']:
+        """Controller for deadlineSeconds / processingFps, or None when neither is set"""
+        deadline = settings.get('deadlineSeconds')
+        processing_fps = settings.get('processingFps')
+        if not deadline and not processing_fps:
+            return None
+        return cls(
+            total_frames,
+            frame_interval,
+            deadline_seconds=float(deadline) if deadline else None,
+            processing_fps=float(processing_fps) if processing_fps else None,
+            window=int(settings.get('adaptiveWindow', 5)),
+            max_level=int(settings.get('adaptiveMaxLevel', len(QUALITY_LEVELS) - 1)),
+        )
+
+    @property
+    def settings(self) -> Dict:
+        return QUALITY_LEVELS[self.level]
+
+    @property
+    def scale(self) -> float:
+        return QUALITY_LEVELS[self.level]['scale']
+
+    @property
+    def weather_every(self) -> int:
+        return QUALITY_LEVELS[self.level]['weatherEvery']
+
+    def should_analyse(self, frame_idx: int) -> bool:
+        """Whether this frame of the fps grid is analysed at the current sampling stride"""
+        self._position = frame_idx
+        return (frame_idx // self.frame_interval) % QUALITY_LEVELS[self.level]['stride'] == 0
+
+    def tick(self):
+        """Mark the end of an analysed frame; the time since the previous one is its latency
+
+        Frames skipped by the stride are decoded in between, so their cost lands on
+        the next analysed frame, which is what the level really costs.
+        """
+        now = time.monotonic()
+        if self._last_tick is not None:
+            latency = now - self._last_tick
+            previous = self.latency.get(self.level)
+            self.latency[self.level] = latency if previous is None else 0.7 * previous + 0.3 * latency
+        self._last_tick = now
+        self.frames_per_level[self.level] += 1
+        self._since_update += 1
+        if self._since_update >= self.window and self.level in self.latency:
+            self._since_update = 0
+            self._update()
+
+    def _predicted_latency(self, level: int) -> float:
+        if level in self.latency:
+            return self.latency[level]
+        current = self.latency[self.level]
+        ratio = (QUALITY_LEVELS[level]['scale'] / QUALITY_LEVELS[self.level]['scale']) ** 2
+        return current * (FIXED_COST_SHARE + (1.0 - FIXED_COST_SHARE) * ratio)
+
+    def _seconds_per_source_frame(self, level: int) -> float:
+        return self._predicted_latency(level) / (self.frame_interval * QUALITY_LEVELS[level]['stride'])
+
+    def _budget_per_source_frame(self) -> float:
+        budgets = []
+        if self.processing_fps:
+            budgets.append(1.0 / self.processing_fps)
+        if self.deadline_seconds:
+            remaining_time = self.deadline_seconds - self.reserve_seconds - (time.monotonic() - self.started)
+            remaining_frames = max(1, self.total_frames - self._position)
+            budgets.append(max(0.0, remaining_time) / remaining_frames)
+        return min(budgets)
+
+    def _update(self):
+        budget = self._budget_per_source_frame()
+        chosen = self.max_level
+        for level in range(self.max_level + 1):
+            # Levels better than the current one must fit with headroom to switch back up
+            limit = budget * self.headroom if level < self.level else budget
+            if self._seconds_per_source_frame(level) <= limit:
+                chosen = level
+                break
+        if chosen != self.level:
+            print(f"[Adaptive] Frame {self._position}: quality level {self.level} -> {chosen} "
+                  f"({self._seconds_per_source_frame(self.level) * 1000:.1f} ms/source frame, budget {budget * 1000:.1f} ms)")
+            self.changes.append({
+                'frame': self._position,
+                'elapsed': round(time.monotonic() - self.started, 3),
+                'from': self.level,
+                'to': chosen,
+                **QUALITY_LEVELS[chosen],
+            })
+            self.level = chosen
+
+    def summary(self) -> Dict:
+        """What the controller chose, for the result metadata"""
+        elapsed = time.monotonic() - self.started
+        return {
+            'deadlineSeconds': self.deadline_seconds,
+            'processingFps': self.processing_fps,
+            'levels': [dict(level) for level in QUALITY_LEVELS[:self.max_level + 1]],
+            'finalLevel': self.level,
+            'final': dict(QUALITY_LEVELS[self.level]),
+            'framesPerLevel': self.frames_per_level[:self.max_level + 1],
+            'latencyMs': {str(level): round(latency * 1000, 2) for level, latency in sorted(self.latency.items())},
+            'changes': self.changes,
+            'loopSeconds': round(elapsed, 3),
+            'metDeadline': elapsed <= self.deadline_seconds - self.reserve_seconds if self.deadline_seconds else None,
+        }
@@ -17,42 +17,101 @@ import matplotlib
 matplotlib.use('Agg')  # Use non-interactive backend
 import matplotlib.pyplot as plt
 
+from adaptive import QualityController
+from checkpoint import VideoCheckpoint
+from costs import LoopTimer, cost_key, node_costs
+from decoders import decoded_frame_size, fit_size, open_decoder, parse_image_size
+from metrics import frames_meter
+from encoding import AnnotatedVideoWriter
+from detectors import DEFAULT_DETECTION_MODEL, Detections, create_detector, detector_backend_from_settings
+from progressive import PARTIAL_FIELDS, FrameSlots, plan_passes, validate_progressive
+from regions import SKY_FRACTION, inference_regions, inside_polygons, validate_regions
+from sampling import FrameChangeDetector
+from serialization import per_frame_rows
+from quantization import load_quantized, quantization_from_settings
+from tracking import MultiObjectTracker
+from training_export import TrainingExporter
+from weather import WeatherTimeline, map_weather_label, weather_thumbnail
+
 
 class VideoAnalyzer:
     """Analyze video files with detection models"""
     
-    def __init__(self, detection_model_name: str = 'facebook/detr-resnet-50', weather_model_name: Optional[str] = None):
-        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    def __init__(
+        self,
+        detection_model_name: str = DEFAULT_DETECTION_MODEL,
+        weather_model_name: Optional[str] = None,
+        detector_backend: str = 'detr',
+        detector_options: Optional[Dict] = None,
+        quantization: Optional[str] = None
+    ):
+        # Dynamic int8 quantization only has CPU kernels
+        self.device = torch.device('cuda' if torch.cuda.is_available() and not quantization else 'cpu')
+        self.quantization = quantization
         self.detection_model_name = detection_model_name
         self.weather_model_name = weather_model_name
+        self.detector_backend = detector_backend
+        self.detector_options = detector_options or {}
+        self.detector = None
         self.detection_model = None
         self.weather_model = None
+        self.key = None
         self._load_models()
     
+    # Settings that select which models are loaded (and so require a new analyzer when they change)
+    MODEL_SETTINGS = ('detectionModel', 'weatherModel', 'detectorBackend', 'onnxModelPath',
+                      'onnxIntraOpThreads', 'onnxInterOpThreads')
+    
+    @staticmethod
+    def model_key(settings: Dict) -> Tuple:
+        """Identity of the models requested by settings"""
+        return (
+            settings.get('detectionModel') or DEFAULT_DETECTION_MODEL,
+            settings.get('weatherModel') or None,
+            detector_backend_from_settings(settings),
+            quantization_from_settings(settings),
+        ) + tuple(settings.get(k) for k in VideoAnalyzer.MODEL_SETTINGS[3:])
+    
+    @classmethod
+    def from_settings(cls, settings: Dict) -> 'VideoAnalyzer':
+        """Create an analyzer for the models requested by settings"""
+        analyzer = cls(
+            detection_model_name=settings.get('detectionModel') or DEFAULT_DETECTION_MODEL,
+            weather_model_name=settings.get('weatherModel') or None,
+            detector_backend=detector_backend_from_settings(settings),
+            detector_options={k: settings[k] for k in cls.MODEL_SETTINGS[3:] if k in settings},
+            quantization=quantization_from_settings(settings),
+        )
+        analyzer.key = cls.model_key(settings)
+        return analyzer
+    
     def _load_models(self):
         """Load detection and weather models"""
         try:
-            from transformers import DetrImageProcessor, DetrForObjectDetection
             from transformers import AutoImageProcessor, AutoModelForImageClassification
             
-            # Load detection model
-            print(f"Loading detection model: {self.detection_model_name}")
-            self.processor = DetrImageProcessor.from_pretrained(self.detection_model_name)
-            self.detection_model = DetrForObjectDetection.from_pretrained(self.detection_model_name)
-            self.detection_model.to(self.device)
-            self.detection_model.eval()
+            # Load detection model through the selected backend
+            print(f"Loading detection model: {self.detection_model_name} (backend: {self.detector_backend}, quantization: {self.quantization or 'none'})")
+            self.detector = create_detector(
+                self.detector_backend, self.detection_model_name, self.device, self.detector_options, self.quantization
+            )
+            self.detection_model = self.detector.model
             print(f"Detection model loaded on {self.device}")
             
             # Load weather model if specified
             if self.weather_model_name:
                 print(f"Loading weather model: {self.weather_model_name}")
                 self.weather_processor = AutoImageProcessor.from_pretrained(self.weather_model_name, use_fast=True)
-                self.weather_model = AutoModelForImageClassification.from_pretrained(self.weather_model_name)
+                load_fp32 = lambda: AutoModelForImageClassification.from_pretrained(self.weather_model_name)
+                if self.quantization:
+                    self.weather_model = load_quantized(f'weather-{self.weather_model_name}', load_fp32, self.quantization)
+                else:
+                    self.weather_model = load_fp32()
                 self.weather_model.to(self.device)
                 self.weather_model.eval()
                 print(f"Weather model loaded on {self.device}")
-        except ImportError:
-            print("Warning: transformers not installed. Install with: pip install transformers")
+        except ImportError as e:
+            print(f"Warning: model dependencies not installed ({e}). Install with: pip install transformers")
         except Exception as e:
             print(f"Error loading models: {e}")
     
@@ -61,68 +120,179 @@ class VideoAnalyzer:
         video_path: str,
         settings: Dict,
         output_dir: Path,
-        progress_callback=None
+        progress_callback=None,
+        partial_callback=None
     ) -> Dict:
         """Analyze video file and return results"""
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            raise ValueError(f"Could not open video: {video_path}")
-        
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        duration = total_frames / fps if fps > 0 else 0
+        if settings.get('progressive', False):
+            return self._analyze_video_progressive(video_path, settings, output_dir, progress_callback, partial_callback)
+        
+        decoder = open_decoder(video_path, settings)
+        video_info = decoder.info
+        try:
+            validate_regions(settings, *decoded_frame_size(video_info, settings))
+        except ValueError:
+            decoder.close()
+            raise
+        
+        fps = video_info['fps']
+        total_frames = video_info['frameCount']
         
         # Extract frames based on settings
         extract_fps = settings.get('fps', 1.0)
-        frame_interval = int(fps / extract_fps) if fps > 0 else 1
+        frame_interval = max(1, int(fps / extract_fps)) if fps > 0 else 1
         
         frames = []
         frame_images = []
         vehicle_counts = []
         human_counts = []
         confidences = []
-        weather_conditions = []
         brightness_values = []
         contrast_values = []
         
-        frame_idx = 0
+        inferred_flags = []
+        
+        # Optional scene-change gate for static footage
+        change_detector = FrameChangeDetector.from_settings(settings) if settings.get('skipStaticFrames', False) else None
+        last_detections = Detections.empty()
+        
+        # Weather is sampled (and batched) on its own schedule; labels are resolved after the loop.
+        # The model gets thumbnails, the image heuristic keeps full frames (its edge thresholds are scale-dependent)
+        weather_timeline = WeatherTimeline.from_settings(
+            settings,
+            lambda images: self._analyze_weather_batch(images, settings),
+            thumb_size=int(settings.get('weatherThumbSize', 384)) if self.weather_model else None
+        )
+        
+        # Multi-object tracker for unique counts
+        tracker = MultiObjectTracker.from_settings(settings, frame_interval / fps if fps > 0 else 1.0)
+        
+        # deadlineSeconds / processingFps: sampling, resolution and weather cadence adapt to measured latency
+        controller = QualityController.from_settings(settings, total_frames, frame_interval)
+        weather_every = 1
+        
+        # Periodic checkpoints of everything accumulated so far; a rerun in the same job directory resumes
+        checkpoint = VideoCheckpoint.from_settings(settings, output_dir, video_path)
+        resume_state = checkpoint.load() if checkpoint is not None else None
+        
+        # saveForTraining: frames and detections appended to dataset shards as the video is read
+        exporter = TrainingExporter.from_settings(
+            settings, output_dir, self.detector.id2label if self.detector else {}, Path(video_path).name,
+            resume=resume_state['trainingExport'] if resume_state else None
+        )
+        
         extracted_count = 0
+        start_frame = 0
         total_frames_to_process = int(total_frames / frame_interval) if frame_interval > 0 else total_frames
         
+        if resume_state:
+            start_frame = resume_state['nextFrame']
+            extracted_count = resume_state['extractedCount']
+            frame_images = resume_state['frameImages']
+            vehicle_counts = resume_state['vehicleCounts']
+            human_counts = resume_state['humanCounts']
+            confidences = resume_state['confidences']
+            brightness_values = resume_state['brightnessValues']
+            contrast_values = resume_state['contrastValues']
+            inferred_flags = resume_state['inferredFlags']
+            last_detections = Detections.from_state(resume_state['lastDetections'])
+            if tracker is not None:
+                tracker.restore(resume_state['tracker'])
+            if change_detector is not None:
+                change_detector.restore(resume_state['changeDetector'])
+            weather_timeline.restore(resume_state['weather'])
+            print(f"[Checkpoint] Resuming {Path(video_path).name} at frame {start_frame} ({extracted_count} frames already analysed)")
+        
+        def save_checkpoint(next_frame: int):
+            # frame_images is appended to its own file; only the new frames are written
+            checkpoint.save({
+                'nextFrame': next_frame,
+                'extractedCount': extracted_count,
+                'vehicleCounts': vehicle_counts,
+                'humanCounts': human_counts,
+                'confidences': confidences,
+                'brightnessValues': brightness_values,
+                'contrastValues': contrast_values,
+                'inferredFlags': inferred_flags,
+                'lastDetections': last_detections.to_state(),
+                'tracker': tracker.snapshot() if tracker is not None else None,
+                'changeDetector': change_detector.snapshot() if change_detector is not None else None,
+                'weather': weather_timeline.snapshot(),
+                'trainingExport': exporter.checkpoint() if exporter is not None else None,
+            }, frame_images)
+        
         if progress_callback:
-            progress_callback(10, 'Extracting frames from video...')
+            if resume_state:
+                progress_callback(10, f'Resuming from frame {extracted_count + 1}/{total_frames_to_process}...')
+            else:
+                progress_callback(10, 'Extracting frames from video...')
         
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            # Extract frame at specified interval
-            if frame_idx % frame_interval == 0:
+        # annotatedVideo: annotated frames go to one MP4/WebM, encoded on a background thread
+        video_writer = AnnotatedVideoWriter.from_settings(
+            settings, output_dir, fps / frame_interval if fps > 0 else 1.0,
+            start_frame=start_frame, frame_interval=frame_interval
+        )
+        
+        # Decode vs. analysis time per frame, folded into the node's cost model for /api/probe
+        timer = LoopTimer()
+        
+        # The decoder only hands back every frame_interval-th frame, already in RGB
+        completed = False
+        try:
+            for frame_idx, frame_rgb in decoder.frames(frame_interval, start_frame=start_frame):
+                timer.frame_ready()
+                if controller is not None:
+                    if not controller.should_analyse(frame_idx):
+                        continue
+                    if controller.weather_every != weather_every:
+                        weather_every = controller.weather_every
+                        weather_timeline.set_cadence(weather_every, frame_interval / fps if fps > 0 else 1.0)
+                
                 # Update progress during frame processing
                 if progress_callback and extracted_count % 5 == 0:
                     progress = 15 + int((extracted_count / max(total_frames_to_process, 1)) * 60)
                     progress_callback(progress, f'Running detection on frame {extracted_count + 1}/{total_frames_to_process}...')
                 
-                # Convert BGR to RGB
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
                 pil_image = Image.fromarray(frame_rgb)
                 
-                # Analyze frame
-                detections = self._detect_objects(pil_image, settings)
-                weather = self._analyze_weather(pil_image, settings)
+                # Analyze frame (static frames reuse the last inferred detections and weather)
+                if change_detector is None or change_detector.should_infer(frame_rgb):
+                    if controller is not None and controller.scale < 1.0:
+                        detections = self._detect_objects_resized(
+                            pil_image, settings, (int(pil_image.width * controller.scale), int(pil_image.height * controller.scale))
+                        )
+                    else:
+                        detections = self._detect_objects(pil_image, settings)
+                    inferred = True
+                else:
+                    detections = last_detections
+                    inferred = False
+                last_detections = detections
+                inferred_flags.append(inferred)
+                weather_timeline.add_frame(frame_rgb, frame_idx / fps if fps > 0 else float(extracted_count), may_sample=inferred)
+                # Static frames that reused detections would only add near-duplicate samples
+                if exporter is not None and inferred:
+                    exporter.add(pil_image, detections, frame_idx, frame_idx / fps if fps > 0 else None)
                 quality = self._analyze_image_quality(frame_rgb)
                 
                 # Count vehicles and humans
-                vehicle_count = sum(1 for d in detections if d['label'] in ['car', 'truck', 'bus', 'motorcycle', 'bicycle'])
-                human_count = sum(1 for d in detections if d['label'] in ['person'])
+                vehicle_count = detections.vehicle_count
+                human_count = detections.person_count
+                
+                # Associate vehicles and people with tracks (timestamp from the source frame index)
+                if tracker is not None:
+                    tracked = detections.select(detections.tracked_mask)
+                    tracker.update(
+                        tracked.boxes,
+                        tracked.labels(),
+                        tracked.category_names(),
+                        tracked.scores,
+                        frame_idx / fps if fps > 0 else float(extracted_count)
+                    )
                 
                 vehicle_counts.append(vehicle_count)
                 human_counts.append(human_count)
-                confidences.append(np.mean([d['score'] for d in detections]) if detections else 0.0)
-                weather_conditions.append(weather)
+                confidences.append(detections.mean_score())
                 brightness_values.append(quality['brightness'])
                 contrast_values.append(quality['contrast'])
                 
@@ -135,21 +305,416 @@ class VideoAnalyzer:
                 
                 # Create annotated frame (always create for display, but only save if saveAnnotated is enabled)
                 annotated = self._annotate_frame(frame_rgb, detections)
-                annotated_pil = Image.fromarray(annotated)
-                save_annotated = settings.get('saveAnnotated', True)
+                if video_writer is not None:
+                    video_writer.add(annotated, (frame_idx - start_frame) // frame_interval)
+                # The annotated video replaces the per-frame JPEGs unless they are asked for explicitly
+                save_annotated = settings.get('saveAnnotated', video_writer is None)
                 if save_annotated:
                     annotated_filename = f"annotated_{extracted_count:04d}.jpg"
                     annotated_path = output_dir / annotated_filename
-                    annotated_pil.save(annotated_path)
+                    Image.fromarray(annotated).save(annotated_path)
                 
-                # Convert to base64 for frontend
-                frame_images.append(self._image_to_base64(pil_image))
+                # Convert to base64 for frontend (batch jobs turn this off)
+                if settings.get('includeImages', True):
+                    frame_images.append(self._image_to_base64(pil_image))
                 
                 extracted_count += 1
+                frames_meter.add()
+                if controller is not None:
+                    controller.tick()
+                timer.frame_done()
+                
+                if checkpoint is not None and checkpoint.due():
+                    save_checkpoint(frame_idx + frame_interval)
+            completed = True
+        finally:
+            decoder.close()
+            if exporter is not None and not completed:
+                # A failed run leaves its finished shards and flushed spools behind for a resume
+                exporter.checkpoint()
+            if video_writer is not None and not completed:
+                video_writer.abort()
+        
+        training_export = exporter.close() if exporter is not None else None
+        annotated_video = video_writer.close() if video_writer is not None else None
+        
+        # Adaptive runs change resolution and stride mid-loop, so their timings would skew the averages
+        if controller is None:
+            self._record_costs(settings, video_info, timer, max(0, total_frames - start_frame))
+        
+        weather_conditions = weather_timeline.labels()
+        
+        result = self._build_video_result(
+            video_path, settings, video_info,
+            vehicle_counts, human_counts, confidences, brightness_values, contrast_values, inferred_flags,
+            weather_conditions,
+            tracker.summary() if tracker is not None else None,
+            frame_images,
+            progress_callback
+        )
+        if controller is not None:
+            result['metadata']['adaptiveQuality'] = controller.summary()
+        result.update({
+            # Frames that ran inference vs. reused the previous results
+            'samplingStats': change_detector.stats() if change_detector else {
+                'method': None,
+                'inferredFrames': extracted_count,
+                'reusedFrames': 0,
+                'reuseRatio': 0.0,
+            },
+            # Weather samples actually classified and label changes before/after smoothing
+            'weatherSampling': weather_timeline.stats(),
+            'trainingExport': training_export,
+            'annotatedVideo': annotated_video,
+            'checkpoints': {
+                'resumedFromFrame': resume_state['nextFrame'] if resume_state else None,
+                'saved': checkpoint.saved if checkpoint is not None else 0,
+            },
+        })
+        if checkpoint is not None:
+            checkpoint.clear()
+        return result
+    
+    def _record_costs(self, settings: Dict, video_info: Dict, timer: LoopTimer, source_frames: int):
+        """Fold a finished frame loop into the node's cost model (never fails the analysis)"""
+        try:
+            frame_size = fit_size(video_info['width'], video_info['height'], parse_image_size(settings.get('imageSize')))
+            node_costs.record_run(
+                settings, self.device.type, timer, frame_size, (video_info['width'], video_info['height']), source_frames
+            )
+        except Exception as e:
+            print(f"[Costs] Could not record frame costs: {e}")
+    
+    def measure_frame_costs(self, video_path: str, settings: Dict, frames: int = 5) -> Dict:
+        """Time a few sampled frames of video_path end to end and record them as calibrated costs
+        
+        The first frame only warms up the models. Decode time covers every source
+        frame read up to the last timed one, like the analyze_video loop.
+        """
+        decoder = open_decoder(video_path, settings)
+        video_info = decoder.info
+        fps = video_info['fps']
+        frame_interval = max(1, int(fps / settings.get('fps', 1.0))) if fps > 0 else 1
+        timer = None
+        first_idx = last_idx = 0
+        try:
+            for frame_idx, frame_rgb in decoder.frames(frame_interval):
+                if timer is not None:
+                    timer.frame_ready()
+                pil_image = Image.fromarray(frame_rgb)
+                detections = self._detect_objects(pil_image, settings)
+                self._analyze_weather(pil_image, settings)
+                self._analyze_image_quality(frame_rgb)
+                self._annotate_frame(frame_rgb, detections)
+                if settings.get('includeImages', True):
+                    self._image_to_base64(pil_image)
+                if timer is None:
+                    timer, first_idx = LoopTimer(), frame_idx
+                    continue
+                timer.frame_done()
+                last_idx = frame_idx
+                if timer.frames >= frames:
+                    break
+        finally:
+            decoder.close()
+        
+        if timer is None or timer.frames == 0:
+            return {'frames': 0}
+        frame_size = fit_size(video_info['width'], video_info['height'], parse_image_size(settings.get('imageSize')))
+        source_frames = last_idx - first_idx
+        frame_mp = frame_size[0] * frame_size[1] / 1e6
+        source_mp = video_info['width'] * video_info['height'] / 1e6
+        analysis = timer.analysis_seconds / timer.frames / max(frame_mp, 1e-3)
+        decode = timer.decode_seconds / max(source_frames, 1) / max(source_mp, 1e-3)
+        node_costs.record(cost_key(settings, self.device.type), analysis, decode, source='calibrated')
+        print(f"[Costs] Calibrated on {timer.frames} frames of {Path(video_path).name}: "
+              f"{analysis:.3f} s/MP analysis, {decode * 1000:.2f} ms/MP decode")
+        return {
+            'frames': timer.frames,
+            'analysisSecondsPerFrame': round(timer.analysis_seconds / timer.frames, 4),
+            'decodeSecondsPerSourceFrame': round(timer.decode_seconds / max(source_frames, 1), 4),
+        }
+    
+    def _analyze_video_progressive(
+        self,
+        video_path: str,
+        settings: Dict,
+        output_dir: Path,
+        progress_callback=None,
+        partial_callback=None
+    ) -> Dict:
+        """Coarse-to-fine analyze_video that publishes provisional aggregates as it goes
+        
+        A preview pass analyses every progressiveStride-th sampled frame on a
+        previewImageSize copy with the image-based weather estimate. Refinement passes
+        then re-detect those frames at full resolution and fill in the frames between
+        them, halving the gap each pass; frames, quality metrics and base64 images from
+        earlier passes are kept. partial_callback receives the aggregates over the
+        frames done so far after every pass and every progressiveUpdateSeconds.
+        Tracking is replayed in time order at the end; static-frame skipping and
+        checkpoints and annotatedVideo do not apply in this mode, and deadlineSeconds /
+        processingFps are rejected (ValueError) since passes are not in time order.
+        
+        Passes whose frames are at least progressiveSeekFrames source frames apart seek
+        to each frame rather than decoding through the gaps. The preview keeps its
+        full-resolution frames (up to progressiveKeepMB) for the upgrade pass, which
+        only decodes the ones that did not fit.
+        """
+        validate_progressive(settings)
+        started = time.perf_counter()
+        if settings.get('annotatedVideo'):
+            print("[Encode] annotatedVideo is not supported with progressive analysis (frames arrive out of order); skipping")
+        decoder = open_decoder(video_path, settings)
+        video_info = decoder.info
+        decoder.close()
+        validate_regions(settings, *decoded_frame_size(video_info, settings))
+        
+        fps = video_info['fps']
+        extract_fps = settings.get('fps', 1.0)
+        frame_interval = max(1, int(fps / extract_fps)) if fps > 0 else 1
+        slots = FrameSlots(int(video_info['frameCount'] / frame_interval))
+        
+        # Preview resolution relative to what the decoder hands out
+        full_size = decoded_frame_size(video_info, settings)
+        preview_size = fit_size(*full_size, parse_image_size(settings.get('previewImageSize', '640x360')))
+        downscaled = preview_size != full_size
+        passes = plan_passes(int(settings.get('progressiveStride', 8)), upgrade=downscaled)
+        
+        # Weather: every weather_stride-th slot is classified (weatherFps, else every frame)
+        weather_fps = settings.get('weatherFps')
+        sample_fps = fps / frame_interval if fps > 0 else 0.0
+        weather_stride = max(1, int(round(sample_fps / float(weather_fps)))) if weather_fps and sample_fps > 0 else 1
+        weather_batch = max(1, int(settings.get('weatherBatchSize', 8)))
+        thumb_size = int(settings.get('weatherThumbSize', 384)) if self.weather_model else None
+        smoothing = (int(settings.get('weatherSmoothing', 1)), int(settings.get('weatherMinDwell', 1)))
+        pending_weather = []
+        
+        exporter = TrainingExporter.from_settings(
+            settings, output_dir, self.detector.id2label if self.detector else {}, Path(video_path).name
+        )
+        save_frames = settings.get('saveFrames', True)
+        save_annotated = settings.get('saveAnnotated', True)
+        include_images = settings.get('includeImages', True)
+        update_seconds = float(settings.get('progressiveUpdateSeconds', 2.0))
+        seek_frames = int(settings.get('progressiveSeekFrames', 120))
+        keep_bytes = int(float(settings.get('progressiveKeepMB', 512)) * 1024 * 1024) if downscaled else 0
+        kept_frames = {}
+        kept_bytes = 0
+        preview_slots = []
+        
+        # Progress is spread over the expected number of frame visits of all passes
+        total_visits = sum(len(range(first, slots.expected, step)) for _, first, step in passes)
+        visits = 0
+        pass_stats = []
+        first_partial = None
+        
+        def flush_weather():
+            if pending_weather:
+                labels = self._analyze_weather_batch([thumb for _, thumb in pending_weather], settings)
+                for (slot, _), label in zip(pending_weather, labels):
+                    slots.put(slot, weather=label)
+                pending_weather.clear()
+        
+        def publish(pass_index: int, kind: str, charts: bool):
+            nonlocal first_partial
+            flush_weather()
+            if partial_callback is None or not len(slots):
+                return
+            aggregates = self._build_video_result(
+                video_path, {**settings, 'generateCharts': charts and settings.get('generateCharts', True), 'resultSchema': 'columnar'},
+                video_info,
+                slots.series('vehicles'), slots.series('humans'), slots.series('confidence'),
+                slots.series('brightness'), slots.series('contrast'), [True] * len(slots),
+                slots.weather_labels(*smoothing), None, []
+            )
+            partial = {field: aggregates[field] for field in PARTIAL_FIELDS}
+            partial['perFrameColumns']['frame_number'] = slots.ordered()
+            if charts:
+                partial['chartImages'] = aggregates['chartImages']
+            partial.update({
+                'pass': pass_index + 1,
+                'passes': len(passes),
+                'passKind': kind,
+                'coverage': slots.coverage,
+                'elapsed': time.perf_counter() - started,
+            })
+            if first_partial is None:
+                first_partial = partial['elapsed']
+            partial_callback(partial)
+        
+        if progress_callback:
+            progress_callback(10, f'Preview pass over every {passes[0][2]}th frame...')
+        
+        for pass_index, (kind, first, step) in enumerate(passes):
+            provisional = kind == 'preview' and downscaled
+            pass_started = time.perf_counter()
+            pass_frames = 0
+            last_publish = time.monotonic()
+            decoder = open_decoder(video_path, settings)
+            if kind == 'upgrade':
+                frames = self._progressive_upgrade_frames(decoder, preview_slots, kept_frames, frame_interval)
+            elif step * frame_interval >= seek_frames > 0 and video_info['frameCount'] > 0:
+                frames = decoder.frames_at(range(first * frame_interval, video_info['frameCount'], step * frame_interval))
+            else:
+                # Frames close together: decode through, starting at the pass's first frame
+                frames = decoder.frames(frame_interval * step, start_frame=first * frame_interval)
+            try:
+                for frame_idx, frame_rgb in frames:
+                    slot = frame_idx // frame_interval
+                    timestamp = frame_idx / fps if fps > 0 else float(slot)
+                    pil_image = Image.fromarray(frame_rgb)
+                    
+                    if provisional:
+                        preview_slots.append(slot)
+                        if kept_bytes + frame_rgb.nbytes <= keep_bytes:
+                            kept_frames[slot] = frame_rgb
+                            kept_bytes += frame_rgb.nbytes
+                        small = pil_image.resize(preview_size, Image.BILINEAR)
+                        detections = self._detect_objects_resized(pil_image, settings, preview_size, resized=small)
+                        slots.put(slot, weather=self._estimate_weather_from_image(small))
+                    else:
+                        detections = self._detect_objects(pil_image, settings)
+                        if slot % weather_stride == 0:
+                            pending_weather.append((slot, weather_thumbnail(frame_rgb, thumb_size)))
+                            if len(pending_weather) >= weather_batch:
+                                flush_weather()
+                        else:
+                            # Drop the preview's heuristic label; the slot takes the latest sample's
+                            slots.put(slot, weather=None)
+                    
+                    slots.put(
+                        slot,
+                        timestamp=timestamp,
+                        vehicles=detections.vehicle_count,
+                        humans=detections.person_count,
+                        confidence=detections.mean_score(),
+                        tracked=detections.select(detections.tracked_mask),
+                    )
+                    
+                    # Frames, quality and images only need the pixels once
+                    if kind != 'upgrade':
+                        quality = self._analyze_image_quality(frame_rgb)
+                        slots.put(slot, brightness=quality['brightness'], contrast=quality['contrast'])
+                        if save_frames:
+                            pil_image.save(output_dir / f"frame_{slot:04d}.jpg")
+                        if include_images:
+                            slots.put(slot, image=self._image_to_base64(pil_image))
+                    
+                    if not provisional:
+                        if save_annotated:
+                            Image.fromarray(self._annotate_frame(frame_rgb, detections)).save(output_dir / f"annotated_{slot:04d}.jpg")
+                        if exporter is not None:
+                            exporter.add(pil_image, detections, frame_idx, timestamp)
+                    
+                    frames_meter.add()
+                    pass_frames += 1
+                    visits += 1
+                    if progress_callback and visits % 5 == 0:
+                        progress = 10 + int(min(visits / max(total_visits, 1), 1.0) * 60)
+                        progress_callback(progress, f'Pass {pass_index + 1}/{len(passes)} ({kind}): {len(slots)}/{slots.expected} frames analysed...')
+                    if update_seconds > 0 and time.monotonic() - last_publish >= update_seconds:
+                        publish(pass_index, kind, charts=False)
+                        last_publish = time.monotonic()
+            finally:
+                frames.close()
+                decoder.close()
             
-            frame_idx += 1
+            pass_stats.append({
+                'kind': kind,
+                'firstFrame': first * frame_interval,
+                'frameStep': step * frame_interval,
+                'frames': pass_frames,
+                'seconds': time.perf_counter() - pass_started,
+            })
+            print(f"[Progressive] Pass {pass_index + 1}/{len(passes)} ({kind}) analysed {pass_frames} frames in {pass_stats[-1]['seconds']:.1f}s")
+            if kind == 'upgrade':
+                kept_frames.clear()
+            publish(pass_index, kind, charts=True)
         
-        cap.release()
+        flush_weather()
+        training_export = exporter.close() if exporter is not None else None
+        
+        tracker = MultiObjectTracker.from_settings(settings, frame_interval / fps if fps > 0 else 1.0)
+        weather_samples = slots.weather_samples()
+        weather_conditions = slots.weather_labels(*smoothing)
+        result = self._build_video_result(
+            video_path, settings, video_info,
+            slots.series('vehicles'), slots.series('humans'), slots.series('confidence'),
+            slots.series('brightness'), slots.series('contrast'), [True] * len(slots),
+            weather_conditions,
+            slots.replay_tracker(tracker),
+            [image for image in slots.series('image') if image],
+            progress_callback
+        )
+        changes = lambda seq: sum(1 for a, b in zip(seq, seq[1:]) if a != b)
+        smoothed_samples = [label for slot, label in zip(slots.ordered(), weather_conditions) if slots.frames[slot].get('weather')]
+        result.update({
+            'samplingStats': {
+                'method': None,
+                'inferredFrames': len(slots),
+                'reusedFrames': 0,
+                'reuseRatio': 0.0,
+            },
+            'weatherSampling': {
+                'weatherFps': float(weather_fps) if weather_fps else None,
+                'samples': len(weather_samples),
+                'frames': len(slots),
+                'batchSize': weather_batch,
+                'smoothingWindow': smoothing[0],
+                'minDwell': smoothing[1],
+                'rawChanges': changes(weather_samples),
+                'smoothedChanges': changes(smoothed_samples),
+            },
+            'trainingExport': training_export,
+            'checkpoints': {'resumedFromFrame': None, 'saved': 0},
+            'progressive': {
+                'coarseStride': passes[0][2],
+                'previewSize': f'{preview_size[0]}x{preview_size[1]}',
+                'passes': pass_stats,
+                'firstPartialSeconds': first_partial,
+            },
+        })
+        return result
+    
+    @staticmethod
+    def _progressive_upgrade_frames(decoder, preview_slots: List[int], kept_frames: Dict, frame_interval: int):
+        """Preview frames in slot order: kept full-resolution arrays first, the rest seeked to"""
+        decoded = decoder.frames_at([slot * frame_interval for slot in preview_slots if slot not in kept_frames])
+        try:
+            for slot in preview_slots:
+                if slot in kept_frames:
+                    yield slot * frame_interval, kept_frames.pop(slot)
+                    continue
+                item = next(decoded, None)
+                if item is None:
+                    return
+                yield item
+        finally:
+            decoded.close()
+    
+    def _build_video_result(
+        self,
+        video_path: str,
+        settings: Dict,
+        video_info: Dict,
+        vehicle_counts: List[int],
+        human_counts: List[int],
+        confidences: List[float],
+        brightness_values: List[float],
+        contrast_values: List[float],
+        inferred_flags: List[bool],
+        weather_conditions: List[str],
+        tracking: Optional[Dict],
+        frame_images: List[str],
+        progress_callback=None
+    ) -> Dict:
+        """Statistics, distributions, per-frame series and charts from a video's per-frame results"""
+        fps = video_info['fps']
+        total_frames = video_info['frameCount']
+        width = video_info['width']
+        height = video_info['height']
+        duration = total_frames / fps if fps > 0 else 0
+        extracted_count = len(vehicle_counts)
         
         if progress_callback:
             progress_callback(70, 'Processing results and metadata...')
@@ -158,6 +723,10 @@ class VideoAnalyzer:
         total_vehicles = sum(vehicle_counts)
         total_humans = sum(human_counts)
         
+        # Unique objects from tracking (sum of per-frame counts double counts parked cars)
+        unique_vehicles = tracking['categories'].get('vehicle', {}).get('uniqueCount', 0) if tracking else None
+        unique_humans = tracking['categories'].get('person', {}).get('uniqueCount', 0) if tracking else None
+        
         # Vehicle stats (like tesla-fish-local)
         vehicle_stats = {
             'median': float(np.median(vehicle_counts)) if vehicle_counts else 0,
@@ -254,31 +823,30 @@ class VideoAnalyzer:
         # Calculate average confidence
         avg_confidence = float(np.mean(confidences)) if confidences else 0.0
         
-        # Prepare per-frame data for charts
-        per_frame_data = []
-        for i in range(len(vehicle_counts)):
-            per_frame_data.append({
-                'frame_number': i,
-                'vehicle_count': vehicle_counts[i],
-                'human_count': human_counts[i] if i < len(human_counts) else 0,
-                'weather_primary': weather_conditions[i] if i < len(weather_conditions) else 'Clear',
-                'brightness_luminance_cd_per_m2': brightness_values[i] * 0.318 if i < len(brightness_values) else 0,
-                'contrast_ratio': contrast_values[i] / 100.0 if i < len(contrast_values) else 0,
-                'image_quality': {
-                    'brightness': brightness_values[i] if i < len(brightness_values) else 0,
-                    'contrast': contrast_values[i] if i < len(contrast_values) else 0,
-                    'brightness_luminance_cd_per_m2': brightness_values[i] * 0.318 if i < len(brightness_values) else 0,
-                    'contrast_ratio': contrast_values[i] / 100.0 if i < len(contrast_values) else 0,
-                },
-                'congestion_level': congestion_levels[i] if i < len(congestion_levels) else 'low',
-            })
+        # Per-frame series as parallel arrays (columnar schema)
+        per_frame_columns = {
+            'frame_number': list(range(len(vehicle_counts))),
+            'vehicle_count': vehicle_counts,
+            'human_count': human_counts,
+            'weather_primary': weather_conditions,
+            'brightness': brightness_values,
+            'contrast': contrast_values,
+            'brightness_luminance_cd_per_m2': [b * 0.318 for b in brightness_values],
+            'contrast_ratio': [c / 100.0 for c in contrast_values],
+            'congestion_level': congestion_levels,
+            'inferred': inferred_flags,
+        }
+        # Legacy row-per-frame view for charts, unless the caller asked for columns only
+        per_frame_data = per_frame_rows(per_frame_columns) if settings.get('resultSchema', 'rows') != 'columnar' else None
         
         # Generate individual matplotlib charts (non-blocking - don't fail if charts fail)
         chart_images = {}
         try:
             print(f"[Analysis] Generating individual charts...")
-            # Only generate charts if we have data
-            if len(vehicle_counts) > 0 or len(human_counts) > 0:
+            # Only generate charts if we have data (and they were asked for)
+            if not settings.get('generateCharts', True):
+                print(f"[Analysis] Skipping chart generation - disabled in settings")
+            elif len(vehicle_counts) > 0 or len(human_counts) > 0:
                 chart_images = self._generate_individual_charts(
                     weather_distribution,
                     congestion_distribution,
@@ -308,16 +876,23 @@ class VideoAnalyzer:
                 'duration': f'{duration:.2f}',
                 'fps': float(fps),
                 'resolution': f'{width}x{height}',
-                'codec': 'H.264',  # Default assumption
+                'codec': video_info['codec'],
+                'decoder': video_info['decoder'],
+                'detector': self.detector_backend,
+                'quantization': self.quantization or 'none',
             },
             'images': frame_images,
-            'statistics': f'Total frames analyzed: {extracted_count}\nVehicles detected: {total_vehicles} (median: {vehicle_stats["median"]:.2f}/frame, mean: {vehicle_stats["mean"]:.2f}/frame)\nHumans detected: {total_humans} (median: {human_stats["median"]:.2f}/frame, mean: {human_stats["mean"]:.2f}/frame)\nWeather: {weather}\nQuality score: {quality_score:.2f}',
+            'statistics': f'Total frames analyzed: {extracted_count}\nVehicles detected: {total_vehicles} (median: {vehicle_stats["median"]:.2f}/frame, mean: {vehicle_stats["mean"]:.2f}/frame)\nHumans detected: {total_humans} (median: {human_stats["median"]:.2f}/frame, mean: {human_stats["mean"]:.2f}/frame)\nWeather: {weather}\nQuality score: {quality_score:.2f}'
+                          + (f'\nUnique vehicles (tracked): {unique_vehicles}\nUnique humans (tracked): {unique_humans}' if tracking else ''),
             'processingTime': time.time(),
             'frames': frame_images,
             'totalFrames': extracted_count,
             'vehicleCount': total_vehicles,
             'humanCount': total_humans,
             'totalHumans': total_humans,
+            'uniqueVehicleCount': unique_vehicles,
+            'uniqueHumanCount': unique_humans,
+            'tracking': tracking,
             'humanStats': human_stats,
             'vehicleStats': vehicle_stats,  # Add vehicle stats
             'imageQuality': image_quality,
@@ -327,13 +902,14 @@ class VideoAnalyzer:
             'weatherDistribution': weather_distribution,
             'congestionDistribution': congestion_distribution,
             'perFrameData': per_frame_data,
+            'perFrameColumns': per_frame_columns,
             'vehicleCountsOverTime': vehicle_counts,
             'humanCountsOverTime': human_counts,
             # Individual chart images (base64 encoded)
             'chartImages': chart_images,
         }
         
-        print(f"[Analysis] Returning result with {len(frame_images)} frames, {total_vehicles} vehicles, {total_humans} humans, {len(chart_images)} charts")
+        print(f"[Analysis] Built result with {len(frame_images)} frames, {total_vehicles} vehicles, {total_humans} humans, {len(chart_images)} charts")
         return result
     
     def analyze_image(
@@ -356,6 +932,7 @@ class VideoAnalyzer:
         
         # Analyze
         detections = self._detect_objects(pil_image, settings)
+        frames_meter.add()
         
         if progress_callback:
             progress_callback(60, 'Analysing weather conditions')
@@ -368,9 +945,9 @@ class VideoAnalyzer:
         quality = self._analyze_image_quality(image_array)
         
         # Count vehicles and humans
-        vehicle_count = sum(1 for d in detections if d['label'] in ['car', 'truck', 'bus', 'motorcycle', 'bicycle'])
-        human_count = sum(1 for d in detections if d['label'] in ['person'])
-        avg_confidence = np.mean([d['score'] for d in detections]) if detections else 0.0
+        vehicle_count = detections.vehicle_count
+        human_count = detections.person_count
+        avg_confidence = detections.mean_score()
         
         if progress_callback:
             progress_callback(85, 'Annotating image')
@@ -387,6 +964,14 @@ class VideoAnalyzer:
             annotated_path = output_dir / 'annotated.jpg'
             annotated_pil.save(annotated_path)
         
+        training_export = None
+        if save_for_training:
+            exporter = TrainingExporter.from_settings(
+                settings, output_dir, self.detector.id2label if self.detector else {}, Path(image_path).name
+            )
+            exporter.add(pil_image, detections)
+            training_export = exporter.close()
+        
         # Progress updates for saving operations
         current_progress = 85
         enabled_operations = sum([save_annotated, save_for_training])
@@ -412,12 +997,101 @@ class VideoAnalyzer:
                 'dimensions': f'{pil_image.width}x{pil_image.height}',
                 'format': 'image/jpeg',
                 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'detector': self.detector_backend,
+                'quantization': self.quantization or 'none',
             },
             'images': [self._image_to_base64(annotated_pil)],
             'statistics': f'Vehicles detected: {vehicle_count}\nHumans detected: {human_count}\nWeather: {weather}\nQuality score: {avg_confidence:.2f}\nBrightness: {quality["brightness"]:.1f} ({quality["brightness_luminance_cd_per_m2"]:.1f} cd/m²)\nContrast: {quality["contrast"]:.1f} (ratio: {quality["contrast_ratio"]:.2f})\nDynamic Range: {quality["dynamicRange"]:.1f}',
             'processingTime': time.time(),
             'annotatedImage': self._image_to_base64(annotated_pil),
             'humanCount': human_count,
+            'trainingExport': training_export,
+            'imageQuality': {
+                'brightness': quality['brightness'],
+                'contrast': quality['contrast'],
+                'dynamicRange': quality['dynamicRange'],
+                'brightness_luminance_cd_per_m2': quality['brightness_luminance_cd_per_m2'],
+                'contrast_ratio': quality['contrast_ratio'],
+            },
+        }
+    
+    def analyze_image_bytes(self, data: bytes, settings: Dict) -> Dict:
+        """Analyse an encoded image held in memory and return a compact result
+        
+        Low-latency path for interactive use: no files, no progress events, one
+        annotated JPEG (or none with includeImage=false) and the detections as plain
+        JSON. Stage timings in milliseconds are reported under `timings`.
+        """
+        timings = {}
+        start = time.perf_counter()
+        
+        pil_image = Image.open(BytesIO(data))
+        pil_image.load()
+        pil_image = pil_image.convert('RGB')
+        image_array = np.asarray(pil_image)
+        timings['decodeMs'] = (time.perf_counter() - start) * 1000.0
+        
+        mark = time.perf_counter()
+        detections = self._detect_objects(pil_image, settings)
+        frames_meter.add()
+        timings['detectMs'] = (time.perf_counter() - mark) * 1000.0
+        
+        weather = None
+        if settings.get('includeWeather', True):
+            mark = time.perf_counter()
+            weather = self._analyze_weather(pil_image, settings)
+            timings['weatherMs'] = (time.perf_counter() - mark) * 1000.0
+        
+        mark = time.perf_counter()
+        quality = self._analyze_image_quality(image_array)
+        timings['qualityMs'] = (time.perf_counter() - mark) * 1000.0
+        
+        mark = time.perf_counter()
+        result = self._compact_image_result(image_array, detections, weather, quality, settings, include_image=True)
+        if settings.get('includeImage', True):
+            timings['encodeMs'] = (time.perf_counter() - mark) * 1000.0
+        result['timings'] = timings
+        return result
+    
+    def analyze_images(self, images: List[Image.Image], settings: Dict) -> List[Dict]:
+        """Compact results for several decoded images, batching detection and weather
+        
+        Used by the bulk endpoint; annotated images are only returned with includeImage=true.
+        """
+        detections = self._detect_objects_batch(images, settings)
+        frames_meter.add(len(images))
+        if settings.get('includeWeather', True):
+            weather = self._analyze_weather_batch(images, settings)
+        else:
+            weather = [None] * len(images)
+        
+        results = []
+        for image, image_detections, image_weather in zip(images, detections, weather):
+            image_array = np.asarray(image)
+            quality = self._analyze_image_quality(image_array)
+            results.append(self._compact_image_result(image_array, image_detections, image_weather, quality, settings, include_image=False))
+        return results
+    
+    def _compact_image_result(
+        self,
+        image_array: np.ndarray,
+        detections: Detections,
+        weather: Optional[str],
+        quality: Dict,
+        settings: Dict,
+        include_image: bool
+    ) -> Dict:
+        """Plain-JSON result for one image (the synchronous and bulk image endpoints)"""
+        annotated_image = None
+        if settings.get('includeImage', include_image):
+            annotated_image = self._image_to_base64(Image.fromarray(self._annotate_frame(image_array, detections)))
+        
+        return {
+            'vehicleCount': detections.vehicle_count,
+            'humanCount': detections.person_count,
+            'confidence': detections.mean_score(),
+            'weather': weather,
+            'detections': detections.to_dicts() if settings.get('includeDetections', True) else None,
             'imageQuality': {
                 'brightness': quality['brightness'],
                 'contrast': quality['contrast'],
@@ -425,77 +1099,148 @@ class VideoAnalyzer:
                 'brightness_luminance_cd_per_m2': quality['brightness_luminance_cd_per_m2'],
                 'contrast_ratio': quality['contrast_ratio'],
             },
+            'annotatedImage': annotated_image,
+            'metadata': {
+                'dimensions': f'{image_array.shape[1]}x{image_array.shape[0]}',
+                'detector': self.detector_backend,
+                'quantization': self.quantization or 'none',
+            },
         }
     
-    def _detect_objects(self, image: Image.Image, settings: Dict) -> List[Dict]:
-        """Detect objects in image using DETR model"""
-        if self.detection_model is None:
-            return []
+    def _detect_objects(self, image: Image.Image, settings: Dict) -> Detections:
+        """Detect objects in image using the configured detector backend
+        
+        Detection runs on the configured regions of interest (whole frame by default),
+        optionally split into overlapping tiles. All crops go through the detector in
+        batches and the boxes are mapped back to frame coordinates and merged with NMS.
+        The result stays array-backed; call to_dicts() only when emitting JSON.
+        """
+        return self._detect_objects_batch([image], settings)[0]
+    
+    def _detect_objects_resized(
+        self,
+        image: Image.Image,
+        settings: Dict,
+        size: Tuple[int, int],
+        resized: Optional[Image.Image] = None
+    ) -> Detections:
+        """Detect on a copy resized to size (cheaper for smaller sizes), boxes in image coordinates
+        
+        ROI and tiles are planned on the full-size image, so pixel roi values and
+        tileSize keep their meaning; the crops are taken from the scaled-down copy.
+        """
+        resized = resized or image.resize(size, Image.BILINEAR)
+        return self._detect_objects_batch([resized], settings, source_sizes=[(image.width, image.height)])[0]
+    
+    def _detect_objects_batch(
+        self,
+        images: List[Image.Image],
+        settings: Dict,
+        source_sizes: Optional[List[Tuple[int, int]]] = None
+    ) -> List[Detections]:
+        """Detections per image, with the crops of all images sharing detector batches
+        
+        With source_sizes, each image is a resized copy of a frame of that size: regions
+        are planned at the source size and boxes come back in source coordinates.
+        """
+        if self.detector is None:
+            return [Detections.empty() for _ in images]
+        
+        # Region planning stays outside the try: a bad roi must fail the analysis, not read as empty frames
+        planned = []
+        for index, image in enumerate(images):
+            width, height = source_sizes[index] if source_sizes else (image.width, image.height)
+            planned.append((width, height, *inference_regions(settings, width, height)))
         
         try:
             confidence_threshold = settings.get('confidenceThreshold', 0.3)
+            batch_size = max(1, int(settings.get('tileBatchSize', 8)))
             
-            inputs = self.processor(images=image, return_tensors="pt")
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
-            
-            with torch.no_grad():
-                outputs = self.detection_model(**inputs)
+            # (image index, crop rectangle in the image, crop) for every crop of every image
+            crops, plans, scales = [], [], []
+            for index, (image, (width, height, regions, polygons)) in enumerate(zip(images, planned)):
+                sx, sy = image.width / width, image.height / height
+                if regions == [(0, 0, width, height)]:
+                    crops.append((index, (0, 0, image.width, image.height), image))
+                else:
+                    for x1, y1, x2, y2 in regions:
+                        x1, y1 = int(round(x1 * sx)), int(round(y1 * sy))
+                        rect = (x1, y1, max(x1 + 1, int(round(x2 * sx))), max(y1 + 1, int(round(y2 * sy))))
+                        crops.append((index, rect, image.crop(rect)))
+                plans.append((len(regions) > 1, polygons))
+                scales.append(np.array([sx, sy, sx, sy], dtype=np.float32))
             
-            # Process outputs
-            results = self.processor.post_process_object_detection(
-                outputs, threshold=confidence_threshold, target_sizes=torch.tensor([image.size[::-1]]).to(self.device)
-            )[0]
+            parts = [([], [], []) for _ in images]
+            for start in range(0, len(crops), batch_size):
+                batch = crops[start:start + batch_size]
+                results = self.detector.detect([crop for _, _, crop in batch], confidence_threshold)
+                for (index, region, _), (crop_boxes, crop_scores, crop_labels) in zip(batch, results):
+                    boxes, scores, labels = parts[index]
+                    # Shift crop-relative boxes back into frame coordinates (and up to the source size)
+                    offset = np.array([region[0], region[1], region[0], region[1]], dtype=crop_boxes.dtype)
+                    boxes.append((crop_boxes + offset) / scales[index].astype(crop_boxes.dtype))
+                    scores.append(crop_scores)
+                    labels.append(crop_labels)
             
             detections = []
-            for score, label, box in zip(results["scores"], results["labels"], results["boxes"]):
-                label_name = self.detection_model.config.id2label[label.item()]
-                detections.append({
-                    'label': label_name.lower(),
-                    'score': float(score.item()),
-                    'box': [float(b) for b in box.tolist()],
-                })
-            
+            for (boxes, scores, labels), (tiled, polygons) in zip(parts, plans):
+                if not boxes:
+                    detections.append(Detections.empty(self.detector.id2label))
+                    continue
+                boxes = np.concatenate(boxes)
+                scores = np.concatenate(scores)
+                labels = np.concatenate(labels)
+                
+                # Overlapping crops see the same object more than once
+                if tiled and len(boxes) > 0:
+                    from torchvision.ops import batched_nms
+                    keep = batched_nms(
+                        torch.from_numpy(boxes).float(), torch.from_numpy(scores).float(), torch.from_numpy(labels),
+                        float(settings.get('tileNmsIou', 0.5))
+                    ).numpy()
+                    boxes, scores, labels = boxes[keep], scores[keep], labels[keep]
+                
+                # Polygon ROIs: drop detections centred outside the polygon
+                if polygons and len(boxes) > 0:
+                    mask = inside_polygons(boxes, polygons)
+                    boxes, scores, labels = boxes[mask], scores[mask], labels[mask]
+                
+                detections.append(Detections.from_raw((boxes, scores, labels), self.detector))
             return detections
         except Exception as e:
             print(f"Error in object detection: {e}")
-            return []
+            return [Detections.empty(self.detector.id2label) for _ in images]
     
     def _analyze_weather(self, image: Image.Image, settings: Dict) -> str:
         """Analyze weather conditions using weather model or image analysis"""
+        return self._analyze_weather_batch([image], settings)[0]
+    
+    def _analyze_weather_batch(self, images: List[Image.Image], settings: Dict) -> List[str]:
+        """Weather label per image, with one weather model forward pass for the whole batch"""
         if self.weather_model and self.weather_model_name:
             try:
-                inputs = self.weather_processor(images=image, return_tensors="pt")
+                inputs = self.weather_processor(images=images, return_tensors="pt")
                 inputs = {k: v.to(self.device) for k, v in inputs.items()}
                 
                 with torch.no_grad():
                     outputs = self.weather_model(**inputs)
                 
-                # Get top prediction
-                predicted_class = outputs.logits.argmax(-1).item()
-                label = self.weather_model.config.id2label[predicted_class]
-                
-                # Map model labels to weather classes (handle cases where model returns wrong labels)
-                label_lower = label.lower()
-                if "clear" in label_lower or "sunny" in label_lower or "day" in label_lower:
-                    return "Clear"
-                elif "cloud" in label_lower or "overcast" in label_lower:
-                    return "Cloudy"
-                elif "rain" in label_lower or "wet" in label_lower or "water" in label_lower:
-                    return "Rainy"
-                elif "fog" in label_lower or "mist" in label_lower:
-                    return "Foggy"
-                elif "snow" in label_lower:
-                    return "Snowy"
-                else:
-                    # If model returns something unexpected (like "car mirror"), use image analysis
-                    print(f"Warning: Weather model returned unexpected label '{label}', using image analysis")
-                    return self._estimate_weather_from_image(image)
+                # Top prediction per image, mapped onto the weather classes
+                labels = []
+                for image, predicted_class in zip(images, outputs.logits.argmax(-1).tolist()):
+                    label = self.weather_model.config.id2label[predicted_class]
+                    weather = map_weather_label(label)
+                    if weather is None:
+                        # If model returns something unexpected (like "car mirror"), use image analysis
+                        print(f"Warning: Weather model returned unexpected label '{label}', using image analysis")
+                        weather = self._estimate_weather_from_image(image)
+                    labels.append(weather)
+                return labels
             except Exception as e:
                 print(f"Error in weather analysis: {e}")
-                return self._estimate_weather_from_image(image)
         
         # Fallback to image analysis
-        return self._estimate_weather_from_image(image)
+        return [self._estimate_weather_from_image(image) for image in images]
     
     def _estimate_weather_from_image(self, image: Image.Image) -> str:
         """Estimate weather using image analysis (like tesla-fish-local)"""
@@ -515,7 +1260,7 @@ class VideoAnalyzer:
         # Color analysis - check for blue sky (clear), gray (cloudy), dark (rainy)
         if len(image_array.shape) == 3:
             # Sky region analysis (top 30% of image)
-            sky_region = image_array[:int(image_array.shape[0] * 0.3), :, :]
+            sky_region = image_array[:int(image_array.shape[0] * SKY_FRACTION), :, :]
             sky_brightness = np.mean(sky_region)
             sky_blue_ratio = np.mean(sky_region[:, :, 2] > 150)  # Blue channel
             sky_gray_ratio = np.mean(np.abs(sky_region[:, :, 0] - sky_region[:, :, 1]) < 20)  # Gray sky
@@ -795,17 +1540,13 @@ class VideoAnalyzer:
         
         return charts
     
-    def _annotate_frame(self, image_array: np.ndarray, detections: List[Dict]) -> np.ndarray:
+    def _annotate_frame(self, image_array: np.ndarray, detections: Detections) -> np.ndarray:
         """Draw bounding boxes on image"""
         annotated = image_array.copy()
         
-        for det in detections:
-            box = det['box']
-            label = det['label']
-            score = det['score']
-            
-            x1, y1, x2, y2 = map(int, box)
-            
+        # One conversion per array rather than per box
+        boxes = detections.boxes.astype(np.int64).tolist()
+        for (x1, y1, x2, y2), label, score in zip(boxes, detections.labels(), detections.scores.tolist()):
             # Draw rectangle
             cv2.rectangle(annotated, (x1, y1), (x2, y2), (0, 0, 0), 3)
             
@@ -823,3 +1564,27 @@ class VideoAnalyzer:
         img_str = base64.b64encode(buffered.getvalue()).decode()
         return f"data:image/jpeg;base64,{img_str}"
 
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point: python -m analysis <command> ..."""
+    import argparse
+    
+    parser = argparse.ArgumentParser(prog='python -m analysis', description='tilda-tesla offline analysis tools')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    from batch import add_batch_arguments
+    add_batch_arguments(subparsers.add_parser('batch', help='Analyse videos listed in a JSONL manifest'))
+    
+    from quantization import add_report_arguments
+    add_report_arguments(subparsers.add_parser('quant-report', help='Compare int8 and fp32 models on reference images'))
+    
+    from worker import add_worker_arguments
+    add_worker_arguments(subparsers.add_parser('worker', help='Run analysis jobs queued on the job broker'))
+    
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
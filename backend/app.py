@@ -3,14 +3,19 @@ tilda-tesla Backend API Server
 Handles video/image analysis with GPU/CUDA acceleration
 """
 
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, send_file, stream_with_context
 from flask_cors import CORS
+from PIL import Image
 import torch
 import os
+import sys
 import json
+import traceback
 import time
 import threading
 import queue
+import shutil
+from io import BytesIO
 from pathlib import Path
 
 # Try to import analysis module, but handle gracefully if it fails
@@ -23,6 +28,22 @@ except ImportError as e:
     ANALYSIS_AVAILABLE = False
     VideoAnalyzer = None
 
+from batching import BatchingDetector, batching_enabled, batching_stats
+from broker import JobBroker
+from bulk import analyze_bulk, iter_archive, iter_uploads
+from checkpoint import VideoCheckpoint, read_job_spec, write_job_spec
+from costs import EtaTracker, analysis_device, node_costs, probe_video
+from decoders import decoded_frame_size
+from metrics import JobCounter, execution_modes, frames_meter, gpu_stats, host_stats, loaded_models
+from progressive import validate_progressive
+from regions import validate_regions
+from resources import ResourceConfig
+from serialization import (ANNOTATED_VIDEO_BASENAME, PARTIAL_FILENAME, RESULT_ENCODINGS, RESULT_FILENAME,
+                           VIDEO_MIMETYPES, choose_encoding, compress, compress_stream, dumps, loads)
+from retention import OutputRetention
+from batch import load_manifest, normalise_items, resolve_input_path, run_batch, write_parquet
+from uploads import INCOMING_DIRNAME, create_job_dir, make_request_class, safe_filename, save_upload, source_path
+
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
@@ -30,8 +51,26 @@ CORS(app)  # Enable CORS for all routes
 OUTPUT_DIR = Path('./output')
 OUTPUT_DIR.mkdir(exist_ok=True)
 
+# Stream multipart uploads straight to disk (hashed on the fly) instead of Werkzeug's buffering
+app.request_class = make_request_class(OUTPUT_DIR / INCOMING_DIRNAME)
+
+# Thread pools, CPU affinity and per-job memory cap for this server process
+resources = ResourceConfig.from_env()
+resources.apply()
+
+# Retention policy for OUTPUT_DIR (age/size quota, LRU eviction in a background sweeper)
+retention = OutputRetention.from_env(OUTPUT_DIR)
+
+# Analyses currently running in this process (SSE jobs by kind)
+active_jobs = JobCounter()
+
+# With JOB_BROKER_DB set, uploads are queued for `python -m analysis worker` processes instead of run here
+broker = JobBroker.from_env()
+BROKER_POLL_SECONDS = float(os.environ.get('BROKER_POLL_SECONDS', 0.5))
+
 # Global analyzer instance (lazy loaded)
 _analyzer = None
+_analyzer_lock = threading.Lock()
 
 def get_analyzer(settings: dict):
     """Get or create analyzer with specified model settings"""
@@ -40,19 +79,21 @@ def get_analyzer(settings: dict):
     if not ANALYSIS_AVAILABLE:
         return None
     
-    detection_model = settings.get('detectionModel', 'facebook/detr-resnet-50')
-    weather_model = settings.get('weatherModel')
-    
-    # Create new analyzer if models changed
-    if _analyzer is None or _analyzer.detection_model_name != detection_model:
-        try:
-            _analyzer = VideoAnalyzer(
-                detection_model_name=detection_model,
-                weather_model_name=weather_model if weather_model else None
-            )
-        except Exception as e:
-            print(f"Error creating analyzer: {e}")
-            return None
+    with _analyzer_lock:
+        # Create new analyzer if models changed (detection/weather model or detector backend)
+        if _analyzer is None or getattr(_analyzer, 'key', None) != VideoAnalyzer.model_key(settings):
+            try:
+                analyzer = VideoAnalyzer.from_settings(settings)
+            except Exception as e:
+                print(f"Error creating analyzer: {e}")
+                return None
+            
+            # Concurrent requests share one detector forward per micro-batch
+            if batching_enabled() and analyzer.detector is not None:
+                analyzer.detector = BatchingDetector.from_env(analyzer.detector)
+            if _analyzer is not None and isinstance(_analyzer.detector, BatchingDetector):
+                _analyzer.detector.close()
+            _analyzer = analyzer
     
     return _analyzer
 
@@ -75,7 +116,41 @@ def get_system_info():
         'gpuName': gpu_name,
         'cudaAvailable': cuda_available,
         'device': device,
-        'torchVersion': torch_version
+        'torchVersion': torch_version,
+        'resources': resources.effective(),
+        'capacity': get_capacity(),
+    }
+
+
+def get_capacity():
+    """Live load of this node, for routers placing jobs on the least-loaded one"""
+    with _batch_jobs_lock:
+        running_batches = [dict(job) for job in _batch_jobs.values() if job['state'] == 'running']
+    active = active_jobs.snapshot()
+    if running_batches:
+        active['batch'] = len(running_batches)
+    batching = batching_stats(_analyzer.detector) if _analyzer is not None else None
+    broker_stats = broker.stats() if broker is not None else None
+    
+    return {
+        'host': host_stats(),
+        'gpu': gpu_stats(),
+        'models': loaded_models(_analyzer),
+        'activeJobs': sum(active.values()),
+        'activeJobsByKind': active,
+        'queueDepth': {
+            # Images waiting for a detector batch, and manifest items not yet analysed
+            'inference': batching['queueDepth'] if batching else 0,
+            'batchItems': sum(max(0, job['total'] - job['skipped'] - job['succeeded'] - job['failed']) for job in running_batches),
+            'brokerJobs': broker_stats['jobs']['queued'] if broker_stats else 0,
+        },
+        'framesPerSecond': frames_meter.rate(),
+        'framesWindowSeconds': frames_meter.window,
+        'framesTotal': frames_meter.total,
+        'executionModes': execution_modes(),
+        'inferenceBatching': batching,
+        # Queue and live workers when jobs are distributed through JOB_BROKER_DB
+        'broker': broker_stats,
     }
 
 
@@ -89,183 +164,337 @@ def system_info():
         return jsonify({'error': str(e)}), 500
 
 
+# Idle SSE streams send a comment line this often so proxies and keep-alive timeouts do not cut them
+SSE_HEARTBEAT_SECONDS = float(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+
+ANALYSIS_UNAVAILABLE_MESSAGE = "Analysis module not available. Install dependencies: pip install transformers pillow opencv-python numpy"
+
+
+def _stream_analysis(run, output_path: Path, label: str, initial_step: str = None, complete_step: str = None,
+                     predicted_seconds: float = None):
+    """Run an analysis in a background thread and yield its progress as SSE events
+    
+    `run` receives a progress callback and a partial-result callback (provisional
+    aggregates, sent as {"partial": ...} events) and returns the result dict. The job
+    directory stays pinned (protected from retention) for as long as the thread runs.
+    Progress events carry an `eta` in seconds, seeded with predicted_seconds if given.
+    """
+    # Create queues for communication between threads
+    progress_queue = queue.Queue()
+    result_queue = queue.Queue()
+    error_queue = queue.Queue()
+    eta = EtaTracker(predicted_seconds)
+    
+    def progress_callback(progress, step):
+        """Callback to send progress updates"""
+        progress_queue.put({'progress': progress, 'step': step, 'eta': eta.update(progress)})
+    
+    def partial_callback(partial):
+        progress_queue.put({'partial': partial})
+    
+    def run_analysis():
+        """Run analysis in a separate thread"""
+        retention.pin(output_path)
+        active_jobs.start(label)
+        try:
+            # JOB_MEMORY_LIMIT_MB aborts the job on a progress update once it is over budget
+            result = run(resources.memory_guard().wrap(progress_callback), partial_callback)
+            
+            # Put result in queue - this must happen
+            print(f"[Backend] Analysis function returned ({label}), result keys: {list(result.keys()) if result else 'None'}")
+            result_queue.put(result)
+            sys.stdout.flush()
+        except Exception as e:
+            error_trace = traceback.format_exc()
+            print(f"Analysis error ({label}): {error_trace}")
+            error_queue.put(e)
+        finally:
+            active_jobs.finish(label)
+            retention.unpin(output_path)
+    
+    # Send initial progress
+    if initial_step:
+        yield f"data: {dumps({'progress': 5, 'step': initial_step})}\n\n"
+        time.sleep(0.1)
+    
+    # Start analysis in background thread
+    analysis_thread = threading.Thread(target=run_analysis)
+    analysis_thread.start()
+    
+    # Stream progress updates while analysis runs
+    result = None
+    last_event = time.time()
+    while True:
+        thread_done = not analysis_thread.is_alive()
+        
+        # Check for progress updates
+        try:
+            while True:
+                event = progress_queue.get_nowait()
+                yield f"data: {dumps(event)}\n\n"
+                last_event = time.time()
+        except queue.Empty:
+            pass
+        
+        if time.time() - last_event >= SSE_HEARTBEAT_SECONDS:
+            yield ": keep-alive\n\n"
+            last_event = time.time()
+        
+        # Check if analysis is done
+        try:
+            result = result_queue.get_nowait()
+            break
+        except queue.Empty:
+            pass
+        
+        # Check for errors
+        try:
+            error = error_queue.get_nowait()
+            raise error
+        except queue.Empty:
+            pass
+        
+        # The thread always queues a result or an error before exiting, so once it
+        # has finished and both queues were drained above there is nothing left to wait for
+        if thread_done:
+            raise Exception("Analysis completed but no result returned")
+        
+        time.sleep(0.1)  # Small delay to avoid busy waiting
+    
+    print(f"[Backend] Final result ready ({label}), keys: {list(result.keys())}")
+    
+    if complete_step:
+        yield f"data: {dumps({'progress': 100, 'step': complete_step})}\n\n"
+        time.sleep(0.1)
+    
+    # Serialise once: the same payload is kept in the job directory for /api/results/<job_id>
+    payload = dumps(result)
+    try:
+        (output_path / RESULT_FILENAME).write_text(payload, encoding='utf-8')
+    except OSError as e:
+        print(f"[Backend] Could not store result for {output_path.name}: {e}")
+    
+    # Send final result
+    yield f"data: {payload}\n\n"
+
+
+def _stream_broker_job(job_id: str, output_path: Path, initial_step: str = None, complete_step: str = None,
+                       predicted_seconds: float = None):
+    """Relay a queued job's progress from the broker as SSE events until a worker finishes it"""
+    if initial_step:
+        yield f"data: {dumps({'progress': 5, 'step': initial_step})}\n\n"
+    
+    # The ETA clock starts when a worker picks the job up, not while it waits in the queue
+    eta = None
+    last_state = None
+    last_partial = None
+    last_event = time.time()
+    partial_path = output_path / PARTIAL_FILENAME
+    while True:
+        job = broker.get(job_id)
+        if job is None:
+            raise Exception(f"Job {job_id} is not known to the broker")
+        
+        state = (job['progress'], job['step'] or ('Queued...' if job['status'] == 'queued' else None))
+        if eta is None and job['status'] == 'running':
+            eta = EtaTracker(predicted_seconds)
+        if state[1] and state != last_state:
+            event = {'progress': state[0], 'step': state[1], 'status': job['status']}
+            if eta is not None:
+                event['eta'] = eta.update(state[0])
+            yield f"data: {dumps(event)}\n\n"
+            last_state = state
+            last_event = time.time()
+        
+        # Provisional aggregates of a progressive analysis, relayed when the worker rewrites them
+        try:
+            partial_mtime = partial_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            partial_mtime = None
+        if partial_mtime is not None and partial_mtime != last_partial:
+            last_partial = partial_mtime
+            yield f"data: {{\"partial\": {partial_path.read_text(encoding='utf-8')}}}\n\n"
+            last_event = time.time()
+        
+        if job['status'] == 'done':
+            break
+        if job['status'] == 'failed':
+            raise Exception(job['error'] or 'Analysis failed')
+        
+        if time.time() - last_event >= SSE_HEARTBEAT_SECONDS:
+            yield ": keep-alive\n\n"
+            last_event = time.time()
+        time.sleep(BROKER_POLL_SECONDS)
+    
+    if complete_step:
+        yield f"data: {dumps({'progress': 100, 'step': complete_step})}\n\n"
+    
+    # The worker stored the result in the (shared) job directory
+    yield f"data: {(output_path / RESULT_FILENAME).read_text(encoding='utf-8')}\n\n"
+
+
+def _enqueue(kind: str, output_path: Path, source_path: Path, settings: dict, upload: dict) -> str:
+    """Queue an analysis on the broker; the job id is the job directory name"""
+    job_id = output_path.name
+    broker.submit(kind, {
+        'jobId': job_id,
+        'path': str(Path(source_path).resolve()),
+        'outputDir': str(output_path.resolve()),
+        'settings': settings,
+        'upload': {key: upload[key] for key in ('filename', 'originalFilename', 'sha256') if key in upload},
+    }, job_id=job_id)
+    return job_id
+
+
+def _sse_response(events, output_path: Path) -> Response:
+    """Wrap an SSE generator, releasing the job directory's creation pin on close"""
+    response = Response(
+        events,
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+    # Release the creation pin once the client is done with the stream
+    response.call_on_close(lambda: retention.unpin(output_path))
+    return response
+
+
+def _run_video(analyzer, video_path: Path, settings: dict, output_path: Path, upload: dict):
+    """The `run` function _stream_analysis calls for a video job"""
+    job_id = output_path.name
+    
+    def run(progress_callback, partial_callback=None):
+        if analyzer is None:
+            raise Exception(ANALYSIS_UNAVAILABLE_MESSAGE)
+        
+        start_time = time.time()
+        result = analyzer.analyze_video(str(video_path), settings, output_path,
+                                        progress_callback=progress_callback, partial_callback=partial_callback)
+        result['processingTime'] = time.time() - start_time
+        
+        # Ensure all required fields are present
+        if 'summary' not in result:
+            result['summary'] = 'Video analysis complete'
+        if 'metadata' not in result:
+            result['metadata'] = {}
+        # The upload is stored as source<ext>; report the client's (sanitised) filename
+        result['metadata']['filename'] = upload['filename']
+        result['metadata']['originalFilename'] = upload.get('originalFilename')
+        result['metadata']['sha256'] = upload.get('sha256')
+        result['jobId'] = job_id
+        if 'frames' not in result:
+            result['frames'] = []
+        if 'images' not in result:
+            result['images'] = []
+        return result
+    
+    return run
+
+
+def _probe(video_path: Path, settings: dict):
+    """Container probe of a video, or None if it fails (the analysis then reports the error)"""
+    try:
+        return probe_video(str(video_path), settings)
+    except Exception as e:
+        print(f"[Costs] Could not probe {Path(video_path).name}: {e}")
+        return None
+
+
+def _predict_seconds(info, settings: dict):
+    """Predicted analysis runtime from a container probe and this node's costs (None without a probe)"""
+    if info is None:
+        return None
+    try:
+        return node_costs.estimate(info, settings, analysis_device(settings))['seconds']
+    except Exception as e:
+        print(f"[Costs] Could not estimate runtime: {e}")
+        return None
+
+
+def _validate_settings(settings: dict, frame_size=None):
+    """Reject settings an analysis would only trip over once running (raises ValueError, sent as 400)
+
+    With the frame (width, height) the ROI is also checked against the frame.
+    """
+    validate_progressive(settings)
+    validate_regions(settings, *(frame_size or (None, None)))
+
+
+def _image_size(source):
+    """(width, height) from an image header, or None if unreadable (decoding reports that later)"""
+    try:
+        with Image.open(source) as image:
+            return image.size
+    except Exception:
+        return None
+
+
+def _read_settings() -> dict:
+    """Parse the optional JSON settings form field"""
+    if 'settings' in request.form:
+        return json.loads(request.form['settings'])
+    return {}
+
+
 @app.route('/api/analyze-video', methods=['POST'])
 def analyze_video():
     """Analyze video file"""
+    output_path = None
     try:
         if 'video' not in request.files:
             return jsonify({'error': 'No video file provided'}), 400
         
         video_file = request.files['video']
-        settings = {}
+        settings = _read_settings()
+        try:
+            _validate_settings(settings)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        if 'settings' in request.form:
-            settings = json.loads(request.form['settings'])
+        # Create a unique output directory for this analysis
+        output_path = create_job_dir(OUTPUT_DIR, 'analysis')
+        job_id = output_path.name
+        retention.pin(output_path)
         
-        # Create output directory for this analysis
-        timestamp = int(time.time())
-        output_path = OUTPUT_DIR / f'analysis_{timestamp}'
-        output_path.mkdir(exist_ok=True)
+        # Save uploaded video (already spooled to disk, this is a rename)
+        upload = save_upload(video_file, output_path, default_name='video')
+        video_path = upload['path']
+        info = _probe(video_path, settings)
+        try:
+            _validate_settings(settings, decoded_frame_size(info, settings) if info else None)
+        except ValueError as e:
+            retention.unpin(output_path)
+            return jsonify({'error': str(e)}), 400
+        write_job_spec(output_path, 'video', settings, upload)
+        predicted_seconds = _predict_seconds(info, settings)
         
-        # Save uploaded video
-        video_path = output_path / video_file.filename
-        video_file.save(str(video_path))
+        if broker is not None:
+            _enqueue('video', output_path, video_path, settings, upload)
+            return _sse_response(
+                _stream_broker_job(job_id, output_path,
+                                   initial_step='Queued video analysis...',
+                                   complete_step='Analysis complete!',
+                                   predicted_seconds=predicted_seconds),
+                output_path
+            )
         
         # Get analyzer with model settings
         analyzer = get_analyzer(settings)
         
-        def generate_progress():
-            """Generate progress updates and perform real analysis"""
-            # Create queues for communication between threads
-            progress_queue = queue.Queue()
-            result_queue = queue.Queue()
-            error_queue = queue.Queue()
-            
-            def progress_callback(progress, step):
-                """Callback to send progress updates"""
-                progress_queue.put((progress, step))
-            
-            def run_analysis():
-                """Run analysis in a separate thread"""
-                try:
-                    if analyzer is None:
-                        raise Exception("Analysis module not available. Install dependencies: pip install transformers pillow opencv-python numpy")
-                    
-                    start_time = time.time()
-                    result = analyzer.analyze_video(str(video_path), settings, output_path, progress_callback=progress_callback)
-                    result['processingTime'] = time.time() - start_time
-                    
-                    # Ensure all required fields are present
-                    if 'summary' not in result:
-                        result['summary'] = 'Video analysis complete'
-                    if 'metadata' not in result:
-                        result['metadata'] = {'filename': video_file.filename}
-                    if 'frames' not in result:
-                        result['frames'] = []
-                    if 'images' not in result:
-                        result['images'] = []
-                    
-                    # Put result in queue - this must happen
-                    print(f"[Backend] Analysis function returned, preparing to put result in queue...")
-                    print(f"[Backend] Result keys: {list(result.keys()) if result else 'None'}")
-                    result_queue.put(result)
-                    print(f"[Backend] Analysis complete, result put in queue. Queue size: {result_queue.qsize()}")
-                    import sys
-                    sys.stdout.flush()
-                except Exception as e:
-                    import traceback
-                    error_trace = traceback.format_exc()
-                    print(f"Analysis error: {error_trace}")
-                    error_queue.put(e)
-                    print(f"[Backend] Error put in error queue. Error queue size: {error_queue.qsize()}")
-            
-            # Send initial progress
-            yield f"data: {json.dumps({'progress': 5, 'step': 'Initialising video analysis...'})}\n\n"
-            time.sleep(0.1)
-            
-            # Start analysis in background thread
-            analysis_thread = threading.Thread(target=run_analysis)
-            analysis_thread.start()
-            
-            # Stream progress updates while analysis runs
-            last_progress = 5
-            result = None
-            while analysis_thread.is_alive() or not progress_queue.empty() or not result_queue.empty():
-                # Check for progress updates
-                try:
-                    while True:
-                        prog, step_msg = progress_queue.get_nowait()
-                        yield f"data: {json.dumps({'progress': prog, 'step': step_msg})}\n\n"
-                        last_progress = prog
-                except queue.Empty:
-                    pass
-                
-                # Check if analysis is done
-                try:
-                    result = result_queue.get_nowait()
-                    print(f"[Backend] Got result from queue in main loop")
-                    break
-                except queue.Empty:
-                    pass
-                
-                # Check for errors
-                try:
-                    error = error_queue.get_nowait()
-                    raise error
-                except queue.Empty:
-                    pass
-                
-                time.sleep(0.1)  # Small delay to avoid busy waiting
-            
-            # Wait for thread to finish (with longer timeout for analysis)
-            analysis_thread.join(timeout=300.0)  # 5 minute timeout for analysis
-            
-            print(f"[Backend] Thread joined. Result is None: {result is None}, Queue size: {result_queue.qsize()}, Error queue size: {error_queue.qsize()}")
-            
-            # If we didn't get result in loop, try to get it now
-            if result is None:
-                # Check for errors first
-                try:
-                    error = error_queue.get_nowait()
-                    print(f"[Backend] Error found in queue: {error}")
-                    raise error
-                except queue.Empty:
-                    pass
-                
-                # Try multiple times in case of race condition
-                for attempt in range(20):  # Increased attempts
-                    try:
-                        result = result_queue.get(timeout=0.5)  # Use blocking get with timeout instead of get_nowait
-                        print(f"[Backend] Got result from queue after thread join (attempt {attempt + 1})")
-                        break
-                    except queue.Empty:
-                        # If thread is still alive, wait a bit
-                        if analysis_thread.is_alive():
-                            print(f"[Backend] Thread still alive, waiting... (attempt {attempt + 1})")
-                            time.sleep(0.2)
-                        else:
-                            # Thread finished but no result - check one more time
-                            if attempt < 19:
-                                print(f"[Backend] Thread finished, retrying queue get... (attempt {attempt + 1})")
-                                time.sleep(0.2)
-                                continue
-                            else:
-                                # Final attempt failed - check error queue one more time
-                                try:
-                                    error = error_queue.get_nowait()
-                                    raise error
-                                except queue.Empty:
-                                    raise Exception(f"Analysis completed but no result returned. Thread finished but result queue is empty after {attempt + 1} attempts.")
-            
-            if result is None:
-                # Last check for errors
-                try:
-                    error = error_queue.get_nowait()
-                    raise error
-                except queue.Empty:
-                    raise Exception("Analysis completed but no result returned")
-            
-            print(f"[Backend] Final result ready, keys: {list(result.keys()) if result else 'None'}")
-            
-            # Final progress is sent by analysis function, just send 100% when done
-            yield f"data: {json.dumps({'progress': 100, 'step': 'Analysis complete!'})}\n\n"
-            time.sleep(0.1)
-            
-            # Send final result
-            yield f"data: {json.dumps(result)}\n\n"
-        
         # Return streaming response with progress
-        return Response(
-            generate_progress(),
-            mimetype='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'X-Accel-Buffering': 'no'
-            }
+        return _sse_response(
+            _stream_analysis(_run_video(analyzer, video_path, settings, output_path, upload), output_path, 'video',
+                             initial_step='Initialising video analysis...',
+                             complete_step='Analysis complete!',
+                             predicted_seconds=predicted_seconds),
+            output_path
         )
         
     except Exception as e:
-        import traceback
+        if output_path is not None:
+            retention.unpin(output_path)
         error_trace = traceback.format_exc()
         print(f"Video analysis error: {error_trace}")
         return jsonify({'error': str(e)}), 500
@@ -274,173 +503,416 @@ def analyze_video():
 @app.route('/api/analyze-image', methods=['POST'])
 def analyze_image():
     """Analyze image file"""
+    output_path = None
     try:
         if 'image' not in request.files:
             return jsonify({'error': 'No image file provided'}), 400
         
         image_file = request.files['image']
-        settings = {}
+        settings = _read_settings()
+        try:
+            _validate_settings(settings)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        if 'settings' in request.form:
-            settings = json.loads(request.form['settings'])
+        # Create a unique output directory for this analysis
+        output_path = create_job_dir(OUTPUT_DIR, 'analysis')
+        job_id = output_path.name
+        retention.pin(output_path)
         
-        # Create output directory for this analysis
-        timestamp = int(time.time())
-        output_path = OUTPUT_DIR / f'analysis_{timestamp}'
-        output_path.mkdir(exist_ok=True)
+        # Save uploaded image (already spooled to disk, this is a rename)
+        upload = save_upload(image_file, output_path, default_name='image')
+        image_path = upload['path']
+        try:
+            _validate_settings(settings, _image_size(image_path))
+        except ValueError as e:
+            retention.unpin(output_path)
+            return jsonify({'error': str(e)}), 400
         
-        # Save uploaded image
-        image_path = output_path / image_file.filename
-        image_file.save(str(image_path))
+        if broker is not None:
+            _enqueue('image', output_path, image_path, settings, upload)
+            return _sse_response(_stream_broker_job(job_id, output_path), output_path)
         
         # Get analyzer with model settings
         analyzer = get_analyzer(settings)
         
-        def generate_progress():
-            """Generate progress updates and perform real analysis"""
-            # Create queues for communication between threads
-            progress_queue = queue.Queue()
-            result_queue = queue.Queue()
-            error_queue = queue.Queue()
-            
-            def progress_callback(progress, step):
-                """Callback to send progress updates"""
-                progress_queue.put((progress, step))
-            
-            def run_analysis():
-                """Run analysis in a separate thread"""
-                try:
-                    if analyzer is None:
-                        raise Exception("Analysis module not available. Install dependencies: pip install transformers pillow opencv-python numpy")
-                    
-                    start_time = time.time()
-                    result = analyzer.analyze_image(str(image_path), settings, output_path, progress_callback=progress_callback)
-                    result['processingTime'] = time.time() - start_time
-                    
-                    # Ensure all required fields are present
-                    if 'summary' not in result:
-                        result['summary'] = 'Image analysis complete'
-                    if 'metadata' not in result:
-                        result['metadata'] = {'filename': image_file.filename}
-                    if 'annotatedImage' not in result:
-                        result['annotatedImage'] = ''
-                    if 'images' not in result:
-                        result['images'] = []
-                    
-                    # Put result in queue - this must happen
-                    print(f"[Backend] Analysis function returned, preparing to put result in queue...")
-                    print(f"[Backend] Result keys: {list(result.keys()) if result else 'None'}")
-                    result_queue.put(result)
-                    print(f"[Backend] Analysis complete, result put in queue. Queue size: {result_queue.qsize()}")
-                    import sys
-                    sys.stdout.flush()
-                except Exception as e:
-                    import traceback
-                    error_trace = traceback.format_exc()
-                    print(f"Analysis error: {error_trace}")
-                    error_queue.put(e)
-                    print(f"[Backend] Error put in error queue. Error queue size: {error_queue.qsize()}")
-            
-            # Start analysis in background thread
-            analysis_thread = threading.Thread(target=run_analysis)
-            analysis_thread.start()
-            
-            # Stream progress updates while analysis runs
-            result = None
-            while analysis_thread.is_alive() or not progress_queue.empty() or not result_queue.empty():
-                # Check for progress updates
-                try:
-                    while True:
-                        prog, step_msg = progress_queue.get_nowait()
-                        yield f"data: {json.dumps({'progress': prog, 'step': step_msg})}\n\n"
-                except queue.Empty:
-                    pass
-                
-                # Check if analysis is done
-                try:
-                    result = result_queue.get_nowait()
-                    print(f"[Backend] Got result from queue in main loop (image)")
-                    break
-                except queue.Empty:
-                    pass
-                
-                # Check for errors
-                try:
-                    error = error_queue.get_nowait()
-                    raise error
-                except queue.Empty:
-                    pass
-                
-                time.sleep(0.1)  # Small delay to avoid busy waiting
-            
-            # Wait for thread to finish (with longer timeout for analysis)
-            analysis_thread.join(timeout=300.0)  # 5 minute timeout for analysis
+        def run(progress_callback, partial_callback=None):
+            if analyzer is None:
+                raise Exception(ANALYSIS_UNAVAILABLE_MESSAGE)
             
-            print(f"[Backend] Thread joined (image). Result is None: {result is None}, Queue size: {result_queue.qsize()}, Error queue size: {error_queue.qsize()}")
+            start_time = time.time()
+            result = analyzer.analyze_image(str(image_path), settings, output_path, progress_callback=progress_callback)
+            result['processingTime'] = time.time() - start_time
             
-            # If we didn't get result in loop, try to get it now
-            if result is None:
-                # Check for errors first
-                try:
-                    error = error_queue.get_nowait()
-                    print(f"[Backend] Error found in queue (image): {error}")
-                    raise error
-                except queue.Empty:
-                    pass
-                
-                # Try multiple times in case of race condition
-                for attempt in range(20):  # Increased attempts
-                    try:
-                        result = result_queue.get(timeout=0.5)  # Use blocking get with timeout instead of get_nowait
-                        print(f"[Backend] Got result from queue after thread join (image, attempt {attempt + 1})")
-                        break
-                    except queue.Empty:
-                        # If thread is still alive, wait a bit
-                        if analysis_thread.is_alive():
-                            print(f"[Backend] Thread still alive (image), waiting... (attempt {attempt + 1})")
-                            time.sleep(0.2)
-                        else:
-                            # Thread finished but no result - check one more time
-                            if attempt < 19:
-                                print(f"[Backend] Thread finished (image), retrying queue get... (attempt {attempt + 1})")
-                                time.sleep(0.2)
-                                continue
-                            else:
-                                # Final attempt failed - check error queue one more time
-                                try:
-                                    error = error_queue.get_nowait()
-                                    raise error
-                                except queue.Empty:
-                                    raise Exception(f"Analysis completed but no result returned. Thread finished but result queue is empty after {attempt + 1} attempts.")
-            
-            if result is None:
-                # Last check for errors
-                try:
-                    error = error_queue.get_nowait()
-                    raise error
-                except queue.Empty:
-                    raise Exception("Analysis completed but no result returned")
-            
-            print(f"[Backend] Final result ready (image), keys: {list(result.keys()) if result else 'None'}")
-            
-            # Send final result
-            yield f"data: {json.dumps(result)}\n\n"
+            # Ensure all required fields are present
+            if 'summary' not in result:
+                result['summary'] = 'Image analysis complete'
+            if 'metadata' not in result:
+                result['metadata'] = {}
+            result['metadata']['filename'] = upload['filename']
+            result['metadata']['originalFilename'] = upload['originalFilename']
+            result['metadata']['sha256'] = upload['sha256']
+            result['jobId'] = job_id
+            if 'annotatedImage' not in result:
+                result['annotatedImage'] = ''
+            if 'images' not in result:
+                result['images'] = []
+            return result
         
         # Return streaming response with progress
+        return _sse_response(_stream_analysis(run, output_path, 'image'), output_path)
+        
+    except Exception as e:
+        if output_path is not None:
+            retention.unpin(output_path)
+        error_trace = traceback.format_exc()
+        print(f"Image analysis error: {error_trace}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/analyze-image-sync', methods=['POST'])
+def analyze_image_sync():
+    """Analyse one image inline and return plain JSON (no SSE, no job directory)
+    
+    Send the image as the raw request body (settings as JSON in the `settings` query
+    parameter) to keep it in memory end to end, or as the `image` field of a multipart
+    form. With INFERENCE_BATCHING=1 concurrent calls share detector batches.
+    Set saveResult=true to keep the image and result in a job directory.
+    """
+    try:
+        if 'image' in request.files:
+            image_file = request.files['image']
+            data = image_file.stream.read()
+            filename = image_file.filename
+            settings = _read_settings()
+        else:
+            data = request.get_data(cache=False)
+            filename = None
+            settings = json.loads(request.args['settings']) if 'settings' in request.args else {}
+        if not data:
+            return jsonify({'error': 'No image provided'}), 400
+        try:
+            _validate_settings(settings, _image_size(BytesIO(data)))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        analyzer = get_analyzer(settings)
+        if analyzer is None:
+            return jsonify({'error': ANALYSIS_UNAVAILABLE_MESSAGE}), 503
+        
+        start_time = time.perf_counter()
+        active_jobs.start('image-sync')
+        try:
+            result = analyzer.analyze_image_bytes(data, settings)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            # PIL.UnidentifiedImageError, truncated files, oversized or malformed images
+            return jsonify({'error': f'Could not decode image: {e}'}), 400
+        finally:
+            active_jobs.finish('image-sync')
+        result['processingTime'] = time.perf_counter() - start_time
+        
+        if settings.get('saveResult', False):
+            output_path = create_job_dir(OUTPUT_DIR, 'analysis')
+            result['jobId'] = output_path.name
+            source_path(output_path, safe_filename(filename, 'image')).write_bytes(data)
+            (output_path / RESULT_FILENAME).write_text(dumps(result), encoding='utf-8')
+        
+        return Response(dumps(result), mimetype='application/json')
+        
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"Image analysis error: {error_trace}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/analyze-bulk', methods=['POST'])
+def analyze_bulk_images():
+    """Analyse many images in one request: a zip/tar `archive` or several `images` fields
+    
+    Images go through detection and weather in batches of bulkBatchSize and results
+    stream back as they complete: NDJSON by default, SSE with ?format=sse (or an
+    Accept: text/event-stream header). The last event is an aggregate summary.
+    """
+    try:
+        settings = _read_settings()
+        archive = request.files.get('archive')
+        files = request.files.getlist('images')
+        if archive is None and not files:
+            return jsonify({'error': 'Provide an archive file or one or more images'}), 400
+        try:
+            # Images differ in size: an ROI outside one of them fails only that image
+            _validate_settings(settings)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        analyzer = get_analyzer(settings)
+        if analyzer is None:
+            return jsonify({'error': ANALYSIS_UNAVAILABLE_MESSAGE}), 503
+        
+        items = iter_archive(archive.stream) if archive is not None else iter_uploads(files)
+        sse = request.args.get('format') == 'sse' or 'text/event-stream' in request.headers.get('Accept', '')
+        
+        def events():
+            active_jobs.start('bulk')
+            try:
+                for event in analyze_bulk(analyzer, items, settings):
+                    yield f"data: {dumps(event)}\n\n" if sse else dumps(event) + '\n'
+            except Exception as e:
+                print(f"Bulk analysis error: {traceback.format_exc()}")
+                error = {'type': 'error', 'error': str(e)}
+                yield f"data: {dumps(error)}\n\n" if sse else dumps(error) + '\n'
+            finally:
+                active_jobs.finish('bulk')
+        
+        # The uploads are read lazily, so the request (and its spooled files) must outlive the view
         return Response(
-            generate_progress(),
-            mimetype='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'X-Accel-Buffering': 'no'
-            }
+            stream_with_context(events()),
+            mimetype='text/event-stream' if sse else 'application/x-ndjson',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
         )
         
     except Exception as e:
-        import traceback
         error_trace = traceback.format_exc()
-        print(f"Image analysis error: {error_trace}")
+        print(f"Bulk analysis error: {error_trace}")
+        return jsonify({'error': str(e)}), 500
+
+
+def _input_roots() -> list:
+    """Directories server-side path/manifest analysis may read from (ANALYSIS_INPUT_ROOTS)"""
+    return [Path(p) for p in os.environ.get('ANALYSIS_INPUT_ROOTS', '').split(os.pathsep) if p]
+
+
+@app.route('/api/analyze-path', methods=['POST'])
+def analyze_path():
+    """Analyze a video that already exists on the server, reading it in place"""
+    output_path = None
+    try:
+        body = request.get_json(force=True) or {}
+        settings = body.get('settings', {})
+        roots = _input_roots()
+        if not roots:
+            return jsonify({'error': 'Server-side paths are disabled. Set ANALYSIS_INPUT_ROOTS to enable them.'}), 403
+        if not body.get('path'):
+            return jsonify({'error': 'No path provided'}), 400
+        try:
+            _validate_settings(settings)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        try:
+            video_path = resolve_input_path(body['path'], roots)
+        except PermissionError as e:
+            return jsonify({'error': str(e)}), 403
+        except FileNotFoundError as e:
+            return jsonify({'error': str(e)}), 404
+        info = _probe(video_path, settings)
+        try:
+            _validate_settings(settings, decoded_frame_size(info, settings) if info else None)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # The job directory only receives outputs; the source video is not copied
+        output_path = create_job_dir(OUTPUT_DIR, 'analysis')
+        job_id = output_path.name
+        retention.pin(output_path)
+        
+        analyzer = get_analyzer(settings)
+        
+        def run(progress_callback, partial_callback=None):
+            if analyzer is None:
+                raise Exception(ANALYSIS_UNAVAILABLE_MESSAGE)
+            
+            start_time = time.time()
+            result = analyzer.analyze_video(str(video_path), settings, output_path,
+                                            progress_callback=progress_callback, partial_callback=partial_callback)
+            result['processingTime'] = time.time() - start_time
+            result['metadata']['sourcePath'] = str(video_path)
+            result['jobId'] = job_id
+            return result
+        
+        return _sse_response(
+            _stream_analysis(run, output_path, 'path',
+                             initial_step='Initialising video analysis...',
+                             complete_step='Analysis complete!',
+                             predicted_seconds=_predict_seconds(info, settings)),
+            output_path
+        )
+        
+    except Exception as e:
+        if output_path is not None:
+            retention.unpin(output_path)
+        error_trace = traceback.format_exc()
+        print(f"Path analysis error: {error_trace}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/probe', methods=['POST'])
+def probe():
+    """Predicted runtime and memory of a video analysis, from a container probe and this node's frame costs
+    
+    Accepts a multipart `video` upload (probed, then discarded) or JSON {"path", "settings",
+    "calibrate"} for a server-side video. With calibrate, a few frames are analysed
+    first so the estimate uses costs measured for these settings.
+    """
+    probe_dir = None
+    try:
+        if 'video' in request.files:
+            settings = _read_settings()
+            calibrate = request.form.get('calibrate', '').lower() in ('1', 'true', 'yes')
+            probe_dir = create_job_dir(OUTPUT_DIR, 'probe')
+            retention.pin(probe_dir)
+            video_path = save_upload(request.files['video'], probe_dir, default_name='video')['path']
+        else:
+            body = request.get_json(force=True) or {}
+            settings = body.get('settings', {})
+            calibrate = bool(body.get('calibrate', False))
+            roots = _input_roots()
+            if not roots:
+                return jsonify({'error': 'Server-side paths are disabled. Set ANALYSIS_INPUT_ROOTS to enable them.'}), 403
+            if not body.get('path'):
+                return jsonify({'error': 'No video file or path provided'}), 400
+            try:
+                video_path = resolve_input_path(body['path'], roots)
+            except PermissionError as e:
+                return jsonify({'error': str(e)}), 403
+            except FileNotFoundError as e:
+                return jsonify({'error': str(e)}), 404
+        
+        try:
+            info = probe_video(str(video_path), settings)
+        except Exception as e:
+            return jsonify({'error': f'Could not read video: {e}'}), 400
+        try:
+            _validate_settings(settings, decoded_frame_size(info, settings))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        calibration = None
+        if calibrate:
+            analyzer = get_analyzer(settings)
+            if analyzer is None:
+                return jsonify({'error': ANALYSIS_UNAVAILABLE_MESSAGE}), 500
+            calibration = analyzer.measure_frame_costs(str(video_path), settings)
+        
+        device = analysis_device(settings)
+        estimate = node_costs.estimate(info, settings, device)
+        
+        # Models already loaded count once; the job itself needs its frames and buffers on top
+        model_bytes = sum(model['memoryBytes'] or 0 for model in loaded_models(_analyzer).values())
+        available = host_stats()['memoryAvailableBytes']
+        job_limit = resources.job_memory_mb * 1024 ** 2 if resources.job_memory_mb else None
+        active = active_jobs.snapshot()
+        
+        return jsonify({
+            'video': info,
+            'device': device,
+            'estimate': estimate,
+            'calibration': calibration,
+            'memory': {
+                'jobBytes': estimate['memoryBytes'],
+                'modelBytes': model_bytes,
+                'availableBytes': available,
+                'jobLimitBytes': job_limit,
+                'fits': (available is None or estimate['memoryBytes'] <= available)
+                        and (job_limit is None or estimate['memoryBytes'] <= job_limit),
+            },
+            # Jobs already running here share the device, so the estimate is a lower bound while busy
+            'activeJobs': sum(active.values()),
+        })
+    
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"Probe error: {error_trace}")
         return jsonify({'error': str(e)}), 500
+    finally:
+        if probe_dir is not None:
+            retention.unpin(probe_dir)
+            shutil.rmtree(probe_dir, ignore_errors=True)
+
+
+# Server-side batch jobs, keyed by job id
+_batch_jobs = {}
+_batch_jobs_lock = threading.Lock()
+
+
+@app.route('/api/analyze-manifest', methods=['POST'])
+def analyze_manifest():
+    """Start a background batch analysis of server-side videos from a manifest"""
+    try:
+        body = request.get_json(force=True) or {}
+        settings = body.get('settings', {})
+        roots = _input_roots()
+        if not roots:
+            return jsonify({'error': 'Server-side paths are disabled. Set ANALYSIS_INPUT_ROOTS to enable them.'}), 403
+        
+        try:
+            _validate_settings(settings)
+            if body.get('manifest'):
+                items = load_manifest(resolve_input_path(body['manifest'], roots))
+            elif body.get('items'):
+                items = normalise_items(body['items'], source='items')
+            else:
+                return jsonify({'error': 'Provide either "manifest" or "items"'}), 400
+            for item in items:
+                item['path'] = str(resolve_input_path(item['path'], roots))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except PermissionError as e:
+            return jsonify({'error': str(e)}), 403
+        except FileNotFoundError as e:
+            return jsonify({'error': str(e)}), 404
+        
+        analyzer = get_analyzer(settings)
+        if analyzer is None:
+            return jsonify({'error': ANALYSIS_UNAVAILABLE_MESSAGE}), 503
+        
+        output_path = create_job_dir(OUTPUT_DIR, 'batch')
+        job_id = output_path.name
+        results_path = output_path / 'results.jsonl'
+        retention.pin(output_path)
+        
+        state = {
+            'jobId': job_id,
+            'state': 'running',
+            'total': len(items),
+            'skipped': 0,
+            'succeeded': 0,
+            'failed': 0,
+            'resultsPath': str(results_path),
+        }
+        with _batch_jobs_lock:
+            _batch_jobs[job_id] = state
+        
+        def run_job():
+            try:
+                run_batch(items, results_path, settings=settings, work_dir=output_path / 'items',
+                          analyzer=analyzer, progress_callback=state.update, resources=resources)
+                if body.get('format') == 'parquet':
+                    state['parquetPath'] = str(write_parquet(results_path, output_path / 'results.parquet'))
+                state['state'] = 'complete'
+            except Exception as e:
+                print(f"Batch analysis error: {traceback.format_exc()}")
+                state['state'] = 'failed'
+                state['error'] = str(e)
+            finally:
+                retention.unpin(output_path)
+        
+        threading.Thread(target=run_job, name=f'batch-{job_id}', daemon=True).start()
+        return jsonify(state), 202
+        
+    except Exception as e:
+        print(f"Manifest analysis error: {traceback.format_exc()}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/batch/<job_id>', methods=['GET'])
+def batch_status(job_id):
+    """Return progress of a server-side batch job"""
+    with _batch_jobs_lock:
+        state = _batch_jobs.get(job_id)
+    if state is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(state)
 
 
 @app.route('/api/upload', methods=['POST'])
@@ -451,27 +923,219 @@ def upload_file():
             return jsonify({'error': 'No file provided'}), 400
         
         file = request.files['file']
-        timestamp = int(time.time())
-        output_path = OUTPUT_DIR / f'upload_{timestamp}'
-        output_path.mkdir(exist_ok=True)
+        output_path = create_job_dir(OUTPUT_DIR, 'upload')
         
-        file_path = output_path / file.filename
-        file.save(str(file_path))
+        upload = save_upload(file, output_path)
+        retention.touch(output_path)
         
         return jsonify({
             'success': True,
-            'path': str(file_path),
-            'filename': file.filename
+            'jobId': output_path.name,
+            'path': str(upload['path']),
+            'filename': upload['filename'],
+            'bytes': upload['bytes'],
+            'sha256': upload['sha256']
         })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """State of a job queued on the broker (status, progress, attempts, worker, error)"""
+    if broker is None:
+        return jsonify({'error': 'No job broker configured (JOB_BROKER_DB)'}), 404
+    job = broker.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify({
+        'jobId': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'progress': job['progress'],
+        'step': job['step'],
+        'attempts': job['attempts'],
+        'worker': job['worker'],
+        'error': job['error'],
+        'created': job['created'],
+        'updated': job['updated'],
+        'resultReady': job['status'] == 'done',
+    })
+
+
+@app.route('/api/jobs/<job_id>/resume', methods=['POST'])
+def resume_job(job_id):
+    """Re-run an interrupted video analysis in its job directory, continuing from its last checkpoint"""
+    output_path = OUTPUT_DIR / job_id
+    if job_id.startswith('.') or '/' in job_id or not output_path.is_dir():
+        return jsonify({'error': 'Unknown job'}), 404
+    spec = read_job_spec(output_path)
+    if spec is None or spec['kind'] != 'video':
+        return jsonify({'error': 'Job cannot be resumed (no video job spec)'}), 400
+    if (output_path / RESULT_FILENAME).is_file():
+        return jsonify({'error': 'Job already finished', 'resultReady': True}), 409
+    if retention.is_pinned(output_path):
+        return jsonify({'error': 'Job is still running'}), 409
+    
+    video_path = output_path / spec['source']
+    settings = spec['settings']
+    upload = {**spec['upload'], 'path': video_path}
+    checkpoint = VideoCheckpoint.from_settings(settings, output_path, str(video_path))
+    print(f"[Backend] Resuming job {job_id} ({'from checkpoint' if checkpoint and checkpoint.path.exists() else 'no checkpoint, from the start'})")
+    retention.pin(output_path)
+    
+    if broker is not None:
+        existing = broker.get(job_id)
+        if existing is not None and existing['status'] in ('queued', 'running'):
+            retention.unpin(output_path)
+            return jsonify({'error': f"Job is {existing['status']} on the broker"}), 409
+        if existing is not None:
+            broker.requeue(job_id)
+        else:
+            _enqueue('video', output_path, video_path, settings, upload)
+        return _sse_response(
+            _stream_broker_job(job_id, output_path,
+                               initial_step='Queued resumed video analysis...',
+                               complete_step='Analysis complete!'),
+            output_path
+        )
+    
+    analyzer = get_analyzer(settings)
+    return _sse_response(
+        _stream_analysis(_run_video(analyzer, video_path, settings, output_path, upload), output_path, 'video',
+                         initial_step='Resuming video analysis...',
+                         complete_step='Analysis complete!'),
+        output_path
+    )
+
+
+@app.route('/api/results/<job_id>', methods=['GET'])
+def job_result(job_id):
+    """Stored final result of an analysis: ?format=json (default), msgpack or arrow"""
+    job_dir = OUTPUT_DIR / job_id
+    result_path = job_dir / RESULT_FILENAME
+    if job_id.startswith('.') or '/' in job_id or not result_path.is_file():
+        return jsonify({'error': 'Unknown job or result not ready'}), 404
+    retention.touch(job_dir)
+    
+    fmt = request.args.get('format', 'json')
+    if fmt == 'json':
+        return Response(result_path.read_bytes(), mimetype='application/json')
+    if fmt not in RESULT_ENCODINGS:
+        return jsonify({'error': f"Unknown format '{fmt}' (json, {', '.join(RESULT_ENCODINGS)})"}), 400
+    
+    mimetype, encode = RESULT_ENCODINGS[fmt]
+    try:
+        data = encode(loads(result_path.read_bytes()))
+    except ImportError as e:
+        return jsonify({'error': f"Format '{fmt}' is not available on this server: {e}"}), 501
+    return Response(data, mimetype=mimetype)
+
+
+@app.route('/api/results/<job_id>/video', methods=['GET'])
+def job_annotated_video(job_id):
+    """Annotated MP4/WebM of a finished analysis, with Range support for seeking
+
+    A resumed job's segments are joined into one file on completion; if that was not
+    possible the result lists them in order and ?segment=<n> (default 0) picks one.
+    """
+    job_dir = OUTPUT_DIR / job_id
+    result_path = job_dir / RESULT_FILENAME
+    if job_id.startswith('.') or '/' in job_id or not result_path.is_file():
+        return jsonify({'error': 'Unknown job or result not ready'}), 404
+    video = loads(result_path.read_bytes()).get('annotatedVideo') or {}
+    names = video.get('segments') or ([video['filename']] if video.get('filename') else [])
+    if not names:
+        return jsonify({'error': 'No annotated video for this job (enable annotatedVideo)'}), 404
+    try:
+        name = names[int(request.args.get('segment', 0))]
+    except (ValueError, IndexError):
+        return jsonify({'error': f"segment must be an index below {len(names)}"}), 404
+    video_path = job_dir / Path(name).name
+    if not video_path.name.startswith(ANNOTATED_VIDEO_BASENAME) or not video_path.is_file():
+        return jsonify({'error': 'Annotated video is missing from the job directory'}), 404
+    retention.touch(job_dir)
+    
+    # conditional=True answers Range requests with 206 partial content (compression skips those)
+    return send_file(video_path, mimetype=VIDEO_MIMETYPES[video_path.suffix.lstrip('.')], conditional=True, max_age=3600)
+
+
+# gzip/br for responses when RESPONSE_COMPRESSION=1 (SSE streams are flushed per event)
+RESPONSE_COMPRESSION = os.environ.get('RESPONSE_COMPRESSION', '0').lower() in ('1', 'true', 'yes')
+COMPRESSION_MIN_BYTES = 1024
+
+
+@app.after_request
+def compress_response(response):
+    if not RESPONSE_COMPRESSION or response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return response
+    encoding = choose_encoding(request.headers.get('Accept-Encoding', ''))
+    if encoding is None:
+        return response
+    
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESSION_MIN_BYTES:
+            return response
+        response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    response.headers.add('Vary', 'Accept-Encoding')
+    return response
+
+
+@app.route('/api/storage', methods=['GET'])
+def storage_usage():
+    """Return per-job disk usage of the output directory"""
+    try:
+        return jsonify(retention.usage_report())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/storage/<job_id>', methods=['GET'])
+def job_storage_usage(job_id):
+    """Return disk usage of a single job directory"""
+    job_dir = OUTPUT_DIR / job_id
+    if job_id.startswith('.') or '/' in job_id or not job_dir.is_dir():
+        return jsonify({'error': 'Unknown job'}), 404
+    usage = retention.job_usage(job_dir)
+    return jsonify({
+        'jobId': job_id,
+        'bytes': usage['bytes'],
+        'files': usage['files'],
+        'lastAccess': retention.last_access(job_dir),
+        'pinned': retention.is_pinned(job_dir),
+        'protected': retention.is_protected(job_dir),
+    })
+
+
+def drain(timeout: float) -> bool:
+    """Wait for running analyses and batch jobs to finish (graceful shutdown); False on timeout"""
+    deadline = time.time() + timeout
+    while True:
+        with _batch_jobs_lock:
+            batches_running = any(job['state'] == 'running' for job in _batch_jobs.values())
+        if not active_jobs.snapshot() and not batches_running:
+            return True
+        if time.time() >= deadline:
+            return False
+        time.sleep(1.0)
+
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
-    return jsonify({'status': 'ok', 'system': get_system_info()})
+    return jsonify({
+        'status': 'ok',
+        'system': get_system_info(),
+        'inferenceBatching': batching_stats(_analyzer.detector) if _analyzer is not None else None,
+    })
 
 
 if __name__ == '__main__':
@@ -483,14 +1147,31 @@ if __name__ == '__main__':
     if system['hasGPU']:
         print(f"GPU: {system['gpuName']}")
     print(f"PyTorch: {system['torchVersion']}")
+    effective = system['resources']
+    print(f"Threads: torch {effective['torchThreads']} (inter-op {effective['torchInteropThreads']}), OpenCV {effective['cv2Threads']}, "
+          f"CPUs {effective['affinityCount']}/{effective['cpuCount']}")
+    if effective['jobMemoryLimitMB']:
+        print(f"Job memory limit: {effective['jobMemoryLimitMB']} MB")
+    if batching_enabled():
+        print(f"Inference batching: max batch {os.environ.get('INFERENCE_MAX_BATCH', 8)}, max wait {os.environ.get('INFERENCE_MAX_WAIT_MS', 5)} ms")
     print('=' * 60)
-    print('Starting server on http://localhost:7860')
+    print(f"Starting development server on http://localhost:{os.environ.get('PORT', 7860)}")
     print('API endpoints:')
     print('  GET  /api/system-info')
     print('  POST /api/analyze-video')
     print('  POST /api/analyze-image')
+    print('  POST /api/analyze-path')
+    print('  POST /api/analyze-manifest')
+    print('  GET  /api/batch/<job_id>')
     print('  POST /api/upload')
+    print('  GET  /api/results/<job_id>')
+    print('  GET  /api/storage')
     print('  GET  /health')
     print('=' * 60)
     
-    app.run(host='0.0.0.0', port=7860, debug=True)
+    # Development server only; production runs `gunicorn -c gunicorn.conf.py wsgi:app`.
+    # The debug reloader runs the app in a child process, which then owns the sweeper
+    debug = os.environ.get('FLASK_DEBUG', '0').lower() in ('1', 'true', 'yes')
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        retention.start()
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 7860)), debug=debug, threaded=True)
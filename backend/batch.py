@@ -0,0 +1,396 @@
+"""
+Batch analysis of videos that already sit on disk, driven by a JSONL manifest
+"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+from resources import ResourceConfig
+from uploads import safe_filename
+
+
+# Batch jobs read sources in place and skip everything that only matters for the UI
+BATCH_DEFAULT_SETTINGS = {
+    'saveFrames': False,
+    'saveAnnotated': False,
+    'includeImages': False,
+    'generateCharts': False,
+    'resultSchema': 'columnar',
+}
+
+# Base64 payloads that are never written to batch results
+HEAVY_RESULT_FIELDS = ('images', 'frames', 'chartImages', 'annotatedImage')
+
+# Scalar result fields promoted to their own Parquet columns
+PARQUET_RESULT_COLUMNS = ('totalFrames', 'vehicleCount', 'humanCount', 'uniqueVehicleCount', 'uniqueHumanCount', 'avgConfidence', 'qualityScore')
+
+
+def normalise_items(entries: List[Dict], base_dir: Optional[Path] = None, source: str = 'manifest') -> List[Dict]:
+    """Validate manifest entries, resolving relative paths and defaulting ids to the path"""
+    items = []
+    seen_ids = set()
+    for index, entry in enumerate(entries, 1):
+        if isinstance(entry, str):
+            entry = {'path': entry}
+        if 'path' not in entry:
+            raise ValueError(f'{source}:{index}: manifest entry has no "path"')
+
+        # Relative paths are relative to the manifest, not the working directory
+        path = Path(entry['path'])
+        if base_dir is not None and not path.is_absolute():
+            path = Path(base_dir) / path
+        entry = {**entry, 'path': str(path)}
+        entry['id'] = str(entry.get('id', entry['path']))
+
+        if entry['id'] in seen_ids:
+            raise ValueError(f'{source}:{index}: duplicate manifest id {entry["id"]!r}')
+        seen_ids.add(entry['id'])
+        items.append(entry)
+    return items
+
+
+def load_manifest(manifest_path: Path) -> List[Dict]:
+    """Read a manifest: one JSON object per line ({"path": ..., "id": ..., "settings": {...}}) or bare paths"""
+    manifest_path = Path(manifest_path)
+    entries = []
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            entries.append(json.loads(line) if line.startswith('{') else line)
+    return normalise_items(entries, manifest_path.parent, str(manifest_path))
+
+
+def resolve_input_path(path: str, allowed_roots: Iterable[Path]) -> Path:
+    """Resolve a server-side input path, refusing anything outside the allowed roots"""
+    resolved = Path(path).resolve()
+    for root in allowed_roots:
+        root = Path(root).resolve()
+        if resolved == root or root in resolved.parents:
+            if not resolved.is_file():
+                raise FileNotFoundError(f'No such file: {path}')
+            return resolved
+    raise PermissionError(f'Path is outside the allowed input roots: {path}')
+
+
+def read_checkpoint(results_path: Path) -> set:
+    """Return ids already completed successfully in an existing results file"""
+    done = set()
+    results_path = Path(results_path)
+    if not results_path.exists():
+        return done
+
+    with open(results_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a partially written last line; that item is simply redone
+                continue
+            if row.get('status') == 'ok':
+                done.add(row['id'])
+    return done
+
+
+class ResultWriter:
+    """Append-only JSONL writer; every row is flushed to disk so it doubles as the checkpoint"""
+
+    def __init__(self, results_path: Path):
+        self.results_path = Path(results_path)
+        self.results_path.parent.mkdir(parents=True, exist_ok=True)
+        self._terminate_partial_line()
+        self._file = open(self.results_path, 'a', encoding='utf-8')
+
+    def _terminate_partial_line(self):
+        """Make sure appended rows start on a fresh line after a crash mid-write"""
+        if not self.results_path.exists() or self.results_path.stat().st_size == 0:
+            return
+        with open(self.results_path, 'rb+') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+
+    def write(self, row: Dict):
+        self._file.write(json.dumps(row) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def write_parquet(results_path: Path, parquet_path: Path) -> Path:
+    """Convert a JSONL results file to Parquet (requires pyarrow)"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet output requires pyarrow. Install with: pip install pyarrow")
+
+    # Later rows win, so items retried after a failure keep only their final outcome
+    rows = {}
+    with open(results_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            rows[row['id']] = row
+
+    columns = {name: [] for name in ('id', 'path', 'status', 'error', 'processingTime', *PARQUET_RESULT_COLUMNS, 'result_json')}
+    for row in rows.values():
+        result = row.get('result') or {}
+        columns['id'].append(row['id'])
+        columns['path'].append(row['path'])
+        columns['status'].append(row['status'])
+        columns['error'].append(row.get('error'))
+        columns['processingTime'].append(row.get('processingTime'))
+        for name in PARQUET_RESULT_COLUMNS:
+            columns[name].append(result.get(name))
+        columns['result_json'].append(json.dumps(result) if result else None)
+
+    pq.write_table(pa.table(columns), str(parquet_path))
+    return Path(parquet_path)
+
+
+def item_dirname(item_id) -> str:
+    """Per-item output directory name: readable, and distinct for ids that sanitise alike"""
+    digest = hashlib.sha1(str(item_id).encode('utf-8')).hexdigest()[:10]
+    return f"{safe_filename(str(item_id), 'item')[:80]}-{digest}"
+
+
+# Analyzers kept per process; items asking for other models evict the oldest extra one
+MAX_CACHED_ANALYZERS = 2
+
+
+def get_analyzer(analyzers: Dict, settings: Dict):
+    """Analyzer for the models settings select, loaded once per VideoAnalyzer.model_key"""
+    from analysis import VideoAnalyzer
+
+    key = VideoAnalyzer.model_key(settings)
+    if key not in analyzers:
+        print(f"[Batch] Loading models {key}")
+        analyzer = VideoAnalyzer.from_settings(settings)
+        if len(analyzers) >= MAX_CACHED_ANALYZERS:
+            # Keep the first (global settings) analyzer, drop the oldest of the others
+            del analyzers[list(analyzers)[1 if len(analyzers) > 1 else 0]]
+        analyzers[key] = analyzer
+    return analyzers[key]
+
+
+def analyze_item(analyzers: Dict, item: Dict, settings: Dict, work_dir: Path, resources: Optional[ResourceConfig] = None) -> Dict:
+    """Analyse one manifest entry in place and return its result row
+
+    Per-item settings may select other models (detectionModel, weatherModel, ...);
+    analyzers caches one analyzer per model_key.
+    """
+    item_settings = {**settings, **item.get('settings', {})}
+    start_time = time.time()
+    # Per-item memory cap (JOB_MEMORY_LIMIT_MB), checked on each progress update
+    guard = resources.memory_guard() if resources else None
+    try:
+        analyzer = get_analyzer(analyzers, item_settings)
+        # Outputs and checkpoints go to a per-item directory; the source is never copied
+        item_dir = Path(work_dir) / item_dirname(item['id'])
+        item_dir.mkdir(parents=True, exist_ok=True)
+
+        result = analyzer.analyze_video(item['path'], item_settings, item_dir, progress_callback=guard.wrap(None) if guard else None)
+        for field in HEAVY_RESULT_FIELDS:
+            result.pop(field, None)
+        result.pop('processingTime', None)
+
+        return {
+            'id': item['id'],
+            'path': item['path'],
+            'status': 'ok',
+            'processingTime': time.time() - start_time,
+            'result': result,
+        }
+    except Exception as e:
+        print(f"[Batch] Failed {item['id']}: {traceback.format_exc()}")
+        return {
+            'id': item['id'],
+            'path': item['path'],
+            'status': 'error',
+            'error': str(e),
+            'processingTime': time.time() - start_time,
+        }
+
+
+# Per-process analyzers and resource share used by pool workers (each worker loads each model set once)
+_worker_analyzers: Dict = {}
+_worker_resources = None
+
+
+def _init_worker(settings: Dict, resources: ResourceConfig, worker_counter, workers: int):
+    """Pool initializer: take this worker's share of CPUs/threads and load the models"""
+    global _worker_resources
+
+    with worker_counter.get_lock():
+        index = worker_counter.value
+        worker_counter.value += 1
+    _worker_resources = resources.for_worker(index, workers)
+    effective = _worker_resources.apply()
+    print(f"[Batch] Worker {index}: {effective['torchThreads']} torch threads, CPUs {effective['affinity']}")
+    get_analyzer(_worker_analyzers, settings)
+
+
+def _worker_analyze(item: Dict, settings: Dict, work_dir: str) -> Dict:
+    return analyze_item(_worker_analyzers, item, settings, Path(work_dir), _worker_resources)
+
+
+def run_batch(
+    items: List[Dict],
+    results_path: Path,
+    settings: Optional[Dict] = None,
+    workers: int = 1,
+    work_dir: Optional[Path] = None,
+    analyzer=None,
+    progress_callback: Optional[Callable[[Dict], None]] = None,
+    resources: Optional[ResourceConfig] = None
+) -> Dict:
+    """Analyse manifest items, skipping those already in results_path, and append new rows to it"""
+    settings = {**BATCH_DEFAULT_SETTINGS, **(settings or {})}
+    results_path = Path(results_path)
+    work_dir = Path(work_dir) if work_dir else results_path.parent / f'{results_path.stem}_outputs'
+    resources = resources or ResourceConfig.from_env()
+
+    done = read_checkpoint(results_path)
+    pending = [item for item in items if item['id'] not in done]
+    summary = {
+        'total': len(items),
+        'skipped': len(items) - len(pending),
+        'succeeded': 0,
+        'failed': 0,
+        'resultsPath': str(results_path),
+    }
+    print(f"[Batch] {summary['total']} items, {summary['skipped']} already done, {len(pending)} to process with {workers} worker(s)")
+
+    writer = ResultWriter(results_path)
+
+    def record(row: Dict):
+        writer.write(row)
+        summary['succeeded' if row['status'] == 'ok' else 'failed'] += 1
+        if progress_callback:
+            progress_callback(dict(summary))
+
+    try:
+        if workers <= 1:
+            from analysis import VideoAnalyzer
+            analyzers = {}
+            if analyzer is not None:
+                analyzers[analyzer.key or VideoAnalyzer.model_key(settings)] = analyzer
+            for item in pending:
+                record(analyze_item(analyzers, item, settings, work_dir, resources))
+        else:
+            # spawn: CUDA and torch thread pools do not survive fork
+            context = multiprocessing.get_context('spawn')
+            
+            def start_pool() -> ProcessPoolExecutor:
+                return ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=context,
+                    initializer=_init_worker,
+                    initargs=(settings, resources, context.Value('i', 0), workers),
+                )
+            
+            def collect(future, item: Dict) -> bool:
+                """Record a finished item; False if its worker process died"""
+                try:
+                    record(future.result())
+                    return True
+                except BrokenProcessPool as e:
+                    print(f"[Batch] Failed {item['id']}: worker process died ({e})")
+                    record({
+                        'id': item['id'],
+                        'path': item['path'],
+                        'status': 'error',
+                        'error': f'Worker process died: {e}',
+                        'processingTime': None,
+                    })
+                    return False
+            
+            executor = start_pool()
+            try:
+                queue_iter = iter(pending)
+                in_flight = {}
+                # Keep a bounded number of items in flight instead of submitting thousands at once
+                while True:
+                    while len(in_flight) < workers * 2:
+                        item = next(queue_iter, None)
+                        if item is None:
+                            break
+                        in_flight[executor.submit(_worker_analyze, item, settings, str(work_dir))] = item
+                    if not in_flight:
+                        break
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    intact = [collect(future, in_flight.pop(future)) for future in finished]
+                    if not all(intact):
+                        # A dead worker (OOM kill, crash) breaks the whole pool: settle every item
+                        # still in flight, then continue with a fresh pool
+                        for future in wait(in_flight).done:
+                            collect(future, in_flight.pop(future))
+                        executor.shutdown(wait=True)
+                        executor = start_pool()
+            finally:
+                executor.shutdown(wait=True)
+    finally:
+        writer.close()
+
+    print(f"[Batch] Done: {summary['succeeded']} succeeded, {summary['failed']} failed, {summary['skipped']} skipped")
+    return summary
+
+
+def _run_batch_command(args) -> int:
+    """Handler for `python -m analysis batch`"""
+    settings = json.loads(args.settings) if args.settings else {}
+    if args.detection_model:
+        settings['detectionModel'] = args.detection_model
+    if args.weather_model:
+        settings['weatherModel'] = args.weather_model
+    if args.detector_backend:
+        settings['detectorBackend'] = args.detector_backend
+    if args.quantization:
+        settings['quantization'] = args.quantization
+
+    manifest_path = Path(args.manifest)
+    results_path = Path(args.output) if args.output else manifest_path.with_suffix('.results.jsonl')
+
+    summary = run_batch(
+        load_manifest(manifest_path),
+        results_path,
+        settings=settings,
+        workers=args.workers,
+        work_dir=Path(args.work_dir) if args.work_dir else None,
+    )
+
+    if args.parquet:
+        write_parquet(results_path, Path(args.parquet))
+        print(f"[Batch] Wrote {args.parquet}")
+
+    print(json.dumps(summary, indent=2))
+    return 0 if summary['failed'] == 0 else 1
+
+
+def add_batch_arguments(parser):
+    """Register the `batch` subcommand arguments"""
+    parser.add_argument('manifest', help='JSONL manifest: {"path": ..., "id": ..., "settings": {...}} per line, or one path per line')
+    parser.add_argument('-o', '--output', help='Results JSONL (also the resume checkpoint); default: <manifest>.results.jsonl')
+    parser.add_argument('--parquet', help='Also write results to this Parquet file (requires pyarrow)')
+    parser.add_argument('-j', '--workers', type=int, default=1, help='Number of worker processes (each loads its own models)')
+    parser.add_argument('--settings', help='JSON analysis settings applied to every item')
+    parser.add_argument('--detection-model', help='Detection model name (default: facebook/detr-resnet-50)')
+    parser.add_argument('--weather-model', help='Optional weather classification model name')
+    parser.add_argument('--detector-backend', choices=['detr', 'onnx', 'ssdlite'], help='Detector backend (default: DETECTOR_BACKEND or detr)')
+    parser.add_argument('--quantization', choices=['none', 'int8'], help='Dynamic int8 quantization of the torch models (default: QUANTIZATION or none)')
+    parser.add_argument('--work-dir', help='Directory for per-item outputs when saveFrames/saveAnnotated are enabled')
+    parser.set_defaults(handler=_run_batch_command)
@@ -0,0 +1,181 @@
+"""
+Cross-request micro-batching: coalesce concurrent detector calls into dynamic batches
+"""
+
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class MicroBatcher:
+    """Run submitted items through run_batch in batches on a single worker thread
+
+    A batch closes when it reaches max_batch_size or when its oldest item has waited
+    max_wait_ms, so an item never waits longer than max_wait_ms plus the batch ahead
+    of it. Items that queued up while the worker was busy go out immediately.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List], List],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 5.0,
+        name: str = 'micro-batcher'
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._queue: queue.Queue = queue.Queue()
+        self._closed = False
+        # Makes the closed check + put in submit() atomic with close() queueing the sentinel
+        self._submit_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        # Recent end-to-end latencies (submit -> result) and batch sizes for stats()
+        self._latencies = deque(maxlen=2048)
+        self._batch_sizes = deque(maxlen=2048)
+
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item) -> Future:
+        """Queue one item; the future resolves to its entry of run_batch's output"""
+        future = Future()
+        with self._submit_lock:
+            if self._closed:
+                raise RuntimeError("Batcher is closed")
+            self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def close(self, timeout: float = 5.0):
+        """Finish queued work and stop the worker thread
+
+        Every item submitted before close() is ahead of the sentinel, so the worker
+        runs it before it exits; later submits raise.
+        """
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join(timeout=timeout)
+
+    def _collect(self, first) -> Tuple[List, bool]:
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    def _loop(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch, stop = self._collect(first)
+            self._run(batch)
+            if stop:
+                return
+
+    def _run(self, batch: List):
+        try:
+            results = self.run_batch([item for item, _, _ in batch])
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+
+        done = time.perf_counter()
+        with self._lock:
+            self._batches += 1
+            self._items += len(batch)
+            self._batch_sizes.append(len(batch))
+            self._latencies.extend(done - submitted for _, _, submitted in batch)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            latencies = np.array(self._latencies) * 1000.0
+            sizes = list(self._batch_sizes)
+            batches, items = self._batches, self._items
+        return {
+            'maxBatchSize': self.max_batch_size,
+            'maxWaitMs': self.max_wait * 1000.0,
+            'batches': batches,
+            'items': items,
+            'meanBatchSize': float(np.mean(sizes)) if sizes else 0.0,
+            'queueDepth': self._queue.qsize(),
+            'p50LatencyMs': float(np.percentile(latencies, 50)) if len(latencies) else None,
+            'p99LatencyMs': float(np.percentile(latencies, 99)) if len(latencies) else None,
+        }
+
+
+class BatchingDetector:
+    """Detector proxy that funnels detect() calls from all threads through one MicroBatcher
+
+    Each image is queued separately, so crops and tiles from one job batch together
+    with images from concurrent requests. A batch runs once at the lowest requested
+    threshold and each image is then filtered back to its own threshold.
+    """
+
+    def __init__(self, detector, max_batch_size: int = 8, max_wait_ms: float = 5.0):
+        self.inner = detector
+        self.batcher = MicroBatcher(self._run, max_batch_size, max_wait_ms, name=f'{detector.name}-batcher')
+
+    @classmethod
+    def from_env(cls, detector) -> 'BatchingDetector':
+        return cls(
+            detector,
+            max_batch_size=int(os.environ.get('INFERENCE_MAX_BATCH', 8)),
+            max_wait_ms=float(os.environ.get('INFERENCE_MAX_WAIT_MS', 5)),
+        )
+
+    def __getattr__(self, name):
+        # id2label, model, processor, ... come from the wrapped detector
+        return getattr(self.inner, name)
+
+    def detect(self, images, threshold: float):
+        try:
+            futures = [self.batcher.submit((image, threshold)) for image in images]
+        except RuntimeError:
+            # Closed because the analyzer was replaced: jobs still holding it run unbatched
+            return self.inner.detect(images, threshold)
+        return [future.result() for future in futures]
+
+    def _run(self, items):
+        threshold = min(t for _, t in items)
+        raw = self.inner.detect([image for image, _ in items], threshold)
+        results = []
+        for (_, own_threshold), (boxes, scores, labels) in zip(items, raw):
+            keep = scores > own_threshold
+            results.append((boxes[keep], scores[keep], labels[keep]))
+        return results
+
+    def close(self):
+        """Stop batching; queued images still complete and later calls run directly"""
+        self.batcher.close()
+
+
+def batching_enabled() -> bool:
+    """Cross-request batching is opt-in per node (INFERENCE_BATCHING=1)"""
+    return os.environ.get('INFERENCE_BATCHING', '0').lower() in ('1', 'true', 'yes')
+
+
+def batching_stats(detector) -> Optional[Dict]:
+    """stats() of a BatchingDetector, None for a plain detector"""
+    return detector.batcher.stats() if isinstance(detector, BatchingDetector) else None
@@ -0,0 +1,244 @@
+"""
+Job broker for distributing analyses to worker processes: SQLite-backed queue with leases and heartbeats
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+# Job states: queued -> running -> done | failed (running jobs whose lease expires go back to queued)
+JOB_STATES = ('queued', 'running', 'done', 'failed')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_expires REAL,
+    progress INTEGER NOT NULL DEFAULT 0,
+    step TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    host TEXT,
+    pid INTEGER,
+    kinds TEXT,
+    job_id TEXT,
+    started REAL NOT NULL,
+    last_seen REAL NOT NULL
+);
+"""
+
+
+class LeaseLost(Exception):
+    """The worker's lease on a job expired and the job was handed to someone else"""
+
+
+def new_worker_id() -> str:
+    return f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}'
+
+
+class JobBroker:
+    """Durable job queue in one SQLite file, shared by the API process and any number of workers
+
+    Workers claim a job for lease_seconds and keep the lease alive with heartbeats.
+    A job whose lease runs out (worker crashed, node lost) is queued again, up to
+    max_attempts claims; after that it fails. Results are written by the worker to
+    the job directory, which therefore has to be on storage every node can reach.
+
+    SQLite needs working file locks: use local disk for several workers on one node,
+    or a shared filesystem with reliable POSIX locking across nodes.
+    """
+
+    def __init__(self, path: Path, lease_seconds: float = 60.0, max_attempts: int = 3):
+        self.path = Path(path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max(1, max_attempts)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._db() as db:
+            db.executescript(_SCHEMA)
+
+    @classmethod
+    def from_env(cls) -> Optional['JobBroker']:
+        """Broker at JOB_BROKER_DB, or None to run analyses in the API process"""
+        path = os.environ.get('JOB_BROKER_DB')
+        if not path:
+            return None
+        return cls(
+            Path(path),
+            lease_seconds=float(os.environ.get('JOB_LEASE_SECONDS', 60)),
+            max_attempts=int(os.environ.get('JOB_MAX_ATTEMPTS', 3)),
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        # One short-lived connection per operation: safe from any thread or process
+        db = sqlite3.connect(str(self.path), timeout=30.0, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    @contextmanager
+    def _db(self):
+        db = self._connect()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    # ------------------------------------------------------------------
+    # API side
+    # ------------------------------------------------------------------
+
+    def submit(self, kind: str, payload: Dict, job_id: Optional[str] = None) -> str:
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        with self._db() as db:
+            db.execute(
+                'INSERT INTO jobs (id, kind, payload, created, updated) VALUES (?, ?, ?, ?, ?)',
+                (job_id, kind, json.dumps(payload), now, now)
+            )
+        return job_id
+
+    def requeue(self, job_id: str):
+        """Queue a failed job again with a fresh set of attempts (its job directory is kept)"""
+        now = time.time()
+        with self._db() as db:
+            db.execute(
+                "UPDATE jobs SET status = 'queued', attempts = 0, worker = NULL, error = NULL, "
+                "step = 'Requeued for resume', updated = ? WHERE id = ? AND status = 'failed'",
+                (now, job_id)
+            )
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Job row with its payload (expired leases are reclaimed first, so a lost job does not read as running)"""
+        with self._db() as db:
+            self._expire_leases(db, time.time())
+            row = db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        return job
+
+    def stats(self) -> Dict:
+        """Jobs by state (after reclaiming expired leases) and workers seen within two lease periods"""
+        now = time.time()
+        with self._db() as db:
+            self._expire_leases(db, now)
+            counts = dict(db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+            workers = [dict(row) for row in db.execute(
+                'SELECT id, host, kinds, job_id, last_seen FROM workers WHERE last_seen > ? ORDER BY id',
+                (now - 2 * self.lease_seconds,)
+            )]
+        return {
+            'jobs': {state: counts.get(state, 0) for state in JOB_STATES},
+            'workers': workers,
+            'leaseSeconds': self.lease_seconds,
+            'maxAttempts': self.max_attempts,
+        }
+
+    # ------------------------------------------------------------------
+    # Worker side
+    # ------------------------------------------------------------------
+
+    def register_worker(self, worker_id: str, kinds: Optional[List[str]] = None):
+        now = time.time()
+        with self._db() as db:
+            db.execute(
+                'INSERT OR REPLACE INTO workers (id, host, pid, kinds, job_id, started, last_seen) VALUES (?, ?, ?, ?, NULL, ?, ?)',
+                (worker_id, socket.gethostname(), os.getpid(), ','.join(kinds or []), now, now)
+            )
+
+    def unregister_worker(self, worker_id: str):
+        with self._db() as db:
+            db.execute('DELETE FROM workers WHERE id = ?', (worker_id,))
+
+    def _expire_leases(self, db: sqlite3.Connection, now: float):
+        """Requeue running jobs whose worker stopped heartbeating (fail them once out of attempts)"""
+        db.execute(
+            "UPDATE jobs SET status = 'failed', error = 'Worker lost (lease expired) after ' || attempts || ' attempt(s)', "
+            "worker = NULL, updated = ? WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+            (now, now, self.max_attempts)
+        )
+        db.execute(
+            "UPDATE jobs SET status = 'queued', worker = NULL, step = 'Requeued after worker loss', updated = ? "
+            "WHERE status = 'running' AND lease_expires < ?",
+            (now, now)
+        )
+
+    def claim(self, worker_id: str, kinds: Optional[List[str]] = None) -> Optional[Dict]:
+        """Lease the oldest queued job (of the given kinds), or None if there is none"""
+        now = time.time()
+        db = self._connect()
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            self._expire_leases(db, now)
+            query = "SELECT id FROM jobs WHERE status = 'queued'"
+            params: list = []
+            if kinds:
+                query += f" AND kind IN ({','.join('?' * len(kinds))})"
+                params.extend(kinds)
+            row = db.execute(query + ' ORDER BY created LIMIT 1', params).fetchone()
+            if row is None:
+                db.execute('COMMIT')
+                return None
+            db.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, lease_expires = ?, "
+                "progress = 0, step = NULL, updated = ? WHERE id = ?",
+                (worker_id, now + self.lease_seconds, now, row['id'])
+            )
+            db.execute('UPDATE workers SET job_id = ?, last_seen = ? WHERE id = ?', (row['id'], now, worker_id))
+            db.execute('COMMIT')
+        except Exception:
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+            raise
+        finally:
+            db.close()
+        return self.get(row['id'])
+
+    def heartbeat(self, job_id: Optional[str], worker_id: str, progress: Optional[int] = None, step: Optional[str] = None):
+        """Extend the worker's lease (and record progress); raises LeaseLost if the job was taken away"""
+        now = time.time()
+        with self._db() as db:
+            db.execute('UPDATE workers SET job_id = ?, last_seen = ? WHERE id = ?', (job_id, now, worker_id))
+            if job_id is None:
+                return
+            cursor = db.execute(
+                "UPDATE jobs SET lease_expires = ?, progress = COALESCE(?, progress), step = COALESCE(?, step), updated = ? "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (now + self.lease_seconds, progress, step, now, job_id, worker_id)
+            )
+            if cursor.rowcount == 0:
+                raise LeaseLost(f'Lease on job {job_id} was lost')
+
+    def complete(self, job_id: str, worker_id: str):
+        self._finish(job_id, worker_id, 'done', None)
+
+    def fail(self, job_id: str, worker_id: str, error: str):
+        self._finish(job_id, worker_id, 'failed', error)
+
+    def _finish(self, job_id: str, worker_id: str, status: str, error: Optional[str]):
+        now = time.time()
+        with self._db() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, error = ?, progress = CASE WHEN ? = 'done' THEN 100 ELSE progress END, "
+                "lease_expires = NULL, updated = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (status, error, status, now, job_id, worker_id)
+            )
+            db.execute('UPDATE workers SET job_id = NULL, last_seen = ? WHERE id = ?', (now, worker_id))
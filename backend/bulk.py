@@ -0,0 +1,166 @@
+"""
+Bulk image analysis: archives and multi-file uploads streamed through batched inference
+"""
+
+import os
+import tarfile
+import time
+import zipfile
+from collections import Counter
+from io import BytesIO
+from pathlib import PurePosixPath
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from PIL import Image
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tif', '.tiff')
+
+# Archive members larger than this are reported as errors instead of being decompressed
+BULK_MAX_IMAGE_BYTES = int(os.environ.get('BULK_MAX_IMAGE_BYTES', 50 * 1024 ** 2))
+
+
+def _is_image_name(name: str) -> bool:
+    path = PurePosixPath(name)
+    # Skip macOS resource forks and hidden files that archivers add
+    if any(part.startswith('.') or part == '__MACOSX' for part in path.parts):
+        return False
+    return path.suffix.lower() in IMAGE_EXTENSIONS
+
+
+def iter_archive(fileobj: BinaryIO, max_bytes: int = BULK_MAX_IMAGE_BYTES) -> Iterator[Tuple[str, Optional[bytes]]]:
+    """(name, bytes) for every image in a zip or tar archive, in archive order
+
+    Oversized members yield (name, None). Raises ValueError for other formats.
+    """
+    fileobj.seek(0)
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not _is_image_name(info.filename):
+                    continue
+                yield info.filename, archive.read(info) if info.file_size <= max_bytes else None
+        return
+
+    fileobj.seek(0)
+    try:
+        # Stream mode reads members in order without seeking back (also for .tar.gz/.tar.bz2)
+        archive = tarfile.open(fileobj=fileobj, mode='r|*')
+    except tarfile.TarError:
+        raise ValueError('Archive must be a zip or tar file')
+    with archive:
+        for member in archive:
+            if not member.isfile() or not _is_image_name(member.name):
+                continue
+            if member.size > max_bytes:
+                yield member.name, None
+                continue
+            yield member.name, archive.extractfile(member).read()
+
+
+def iter_uploads(files) -> Iterator[Tuple[str, bytes]]:
+    """(filename, bytes) for multipart FileStorage objects, read one at a time"""
+    for index, file_storage in enumerate(files):
+        yield file_storage.filename or f'image_{index:05d}', file_storage.stream.read()
+
+
+def decode_image(data: bytes) -> Image.Image:
+    image = Image.open(BytesIO(data))
+    image.load()
+    return image.convert('RGB')
+
+
+class BulkSummary:
+    """Aggregate over all images of a bulk request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.images = 0
+        self.failed = 0
+        self.vehicles = 0
+        self.humans = 0
+        self.confidence_sum = 0.0
+        self.weather = Counter()
+        self.busiest: Optional[Dict] = None
+
+    def add(self, name: str, result: Dict):
+        self.images += 1
+        self.vehicles += result['vehicleCount']
+        self.humans += result['humanCount']
+        self.confidence_sum += result['confidence']
+        if result.get('weather'):
+            self.weather[result['weather']] += 1
+        if self.busiest is None or result['vehicleCount'] > self.busiest['vehicleCount']:
+            self.busiest = {'name': name, 'vehicleCount': result['vehicleCount']}
+
+    def add_error(self):
+        self.failed += 1
+
+    def to_dict(self) -> Dict:
+        elapsed = time.perf_counter() - self.started
+        return {
+            'images': self.images,
+            'failed': self.failed,
+            'vehicleCount': self.vehicles,
+            'humanCount': self.humans,
+            'meanVehicleCount': self.vehicles / self.images if self.images else 0.0,
+            'meanHumanCount': self.humans / self.images if self.images else 0.0,
+            'meanConfidence': self.confidence_sum / self.images if self.images else 0.0,
+            'weatherDistribution': dict(self.weather),
+            'busiestImage': self.busiest,
+            'processingTime': elapsed,
+            'imagesPerSecond': self.images / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+def analyze_bulk(analyzer, items: Iterable[Tuple[str, Optional[bytes]]], settings: Dict) -> Iterator[Dict]:
+    """Analyse (name, bytes) items in batches of bulkBatchSize, yielding events as batches complete
+
+    Events: {'type': 'image', ...compact result} per decoded image,
+    {'type': 'error', 'name', 'error'} per item that cannot be decoded or analysed and one final
+    {'type': 'summary', ...} aggregate.
+    """
+    batch_size = max(1, int(settings.get('bulkBatchSize', 8)))
+    summary = BulkSummary()
+    index = 0
+    batch: List[Tuple[int, str, Image.Image]] = []
+
+    def run_batch():
+        try:
+            results = analyzer.analyze_images([image for _, _, image in batch], settings)
+        except Exception as e:
+            # Retry one by one, so only the images that actually fail become error events
+            print(f"[Bulk] Batch of {len(batch)} failed ({e}); analysing its images one by one")
+            results = None
+        for position, (item_index, name, image) in enumerate(batch):
+            try:
+                result = results[position] if results is not None else analyzer.analyze_images([image], settings)[0]
+            except Exception as e:
+                summary.add_error()
+                yield {'type': 'error', 'index': item_index, 'name': name, 'error': f'Analysis failed: {e}'}
+                continue
+            summary.add(name, result)
+            yield {'type': 'image', 'index': item_index, 'name': name, **result}
+        batch.clear()
+
+    for name, data in items:
+        item_index, index = index, index + 1
+        if data is None:
+            summary.add_error()
+            yield {'type': 'error', 'index': item_index, 'name': name, 'error': f'Larger than {BULK_MAX_IMAGE_BYTES} bytes'}
+            continue
+        try:
+            image = decode_image(data)
+        except Exception as e:
+            # OSError for corrupt files, but also DecompressionBombError, ValueError, ...
+            summary.add_error()
+            yield {'type': 'error', 'index': item_index, 'name': name, 'error': f'Could not decode image: {e}'}
+            continue
+        batch.append((item_index, name, image))
+        if len(batch) >= batch_size:
+            yield from run_batch()
+
+    if batch:
+        yield from run_batch()
+    yield {'type': 'summary', **summary.to_dict()}
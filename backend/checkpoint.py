@@ -0,0 +1,185 @@
+"""
+Checkpoint and resume for long video analyses: accumulated per-frame state saved periodically to the job directory
+"""
+
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+# JSON state plus its NumPy arrays in one .npz, loaded with allow_pickle=False
+CHECKPOINT_FILENAME = 'checkpoint.npz'
+
+# Base64 frames of the run, one per line, appended at every save rather than rewritten
+CHECKPOINT_FRAMES_FILENAME = 'checkpoint_frames.txt'
+
+# What an API job was asked to do (kind, source, settings), kept so it can be resumed later
+JOB_SPEC_FILENAME = 'job.json'
+
+# Bumped whenever the saved state changes shape; older checkpoints are ignored
+CHECKPOINT_VERSION = 2
+
+# npz entry holding the JSON document; arrays are stored next to it and referenced by key
+_STATE_KEY = '__state__'
+
+
+def source_fingerprint(video_path: str, settings: Dict) -> str:
+    """Identity of a run: the source file (size, mtime) and every analysis setting"""
+    stat = os.stat(video_path)
+    digest = hashlib.sha256()
+    digest.update(f'{Path(video_path).name}:{stat.st_size}:{stat.st_mtime_ns}'.encode('utf-8'))
+    digest.update(json.dumps(settings, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def write_job_spec(job_dir: Path, kind: str, settings: Dict, upload: Dict):
+    spec = {
+        'kind': kind,
+        'settings': settings,
+        'source': Path(upload['path']).name,
+        'upload': {key: upload[key] for key in ('filename', 'originalFilename', 'sha256') if key in upload},
+    }
+    (Path(job_dir) / JOB_SPEC_FILENAME).write_text(json.dumps(spec), encoding='utf-8')
+
+
+def read_job_spec(job_dir: Path) -> Optional[Dict]:
+    try:
+        return json.loads((Path(job_dir) / JOB_SPEC_FILENAME).read_text(encoding='utf-8'))
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _split_arrays(value, arrays: Dict[str, np.ndarray]):
+    """JSON-safe copy of value with every ndarray moved into arrays and replaced by {"__array__": key}"""
+    if isinstance(value, np.ndarray):
+        key = f'a{len(arrays)}'
+        arrays[key] = value
+        return {'__array__': key}
+    if isinstance(value, dict):
+        return {str(k): _split_arrays(v, arrays) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_split_arrays(v, arrays) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _join_arrays(value, arrays):
+    if isinstance(value, dict):
+        if set(value) == {'__array__'}:
+            return arrays[value['__array__']]
+        return {k: _join_arrays(v, arrays) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_join_arrays(v, arrays) for v in value]
+    return value
+
+
+class VideoCheckpoint:
+    """Periodic snapshots of an analyze_video run, written atomically to <job dir>/checkpoint.npz
+
+    A run that finds a checkpoint for the same source and settings in its output
+    directory resumes from the frame after the last snapshot instead of starting over.
+    State is plain JSON plus numeric arrays (no pickles), and the base64 frames are
+    appended to checkpoint_frames.txt, so each save only writes what is new.
+    """
+
+    def __init__(self, output_dir: Path, fingerprint: str, interval_seconds: float = 60.0):
+        self.path = Path(output_dir) / CHECKPOINT_FILENAME
+        self.frames_path = Path(output_dir) / CHECKPOINT_FRAMES_FILENAME
+        self.fingerprint = fingerprint
+        self.interval_seconds = interval_seconds
+        self.saved = 0
+        self._frames_saved = 0
+        self._frames_offset = 0
+        self._last_save = time.monotonic()
+
+    @classmethod
+    def from_settings(cls, settings: Dict, output_dir: Path, video_path: str) -> Optional['VideoCheckpoint']:
+        """Checkpointing every checkpointInterval seconds (off unless set)"""
+        interval = float(settings.get('checkpointInterval') or 0)
+        if interval <= 0 or output_dir is None or not Path(output_dir).is_dir():
+            return None
+        return cls(output_dir, source_fingerprint(video_path, settings), interval)
+
+    def load(self) -> Optional[Dict]:
+        """The saved state if it belongs to this run, else None"""
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                arrays = {key: data[key] for key in data.files}
+            state = _join_arrays(json.loads(arrays.pop(_STATE_KEY).tobytes().decode('utf-8')), arrays)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"[Checkpoint] Ignoring unreadable checkpoint {self.path}: {e}")
+            return None
+        if state.get('version') != CHECKPOINT_VERSION or state.get('fingerprint') != self.fingerprint:
+            print(f"[Checkpoint] Ignoring checkpoint for a different source or settings: {self.path}")
+            return None
+        try:
+            state['frameImages'] = self._load_frames(state['frameImages'])
+        except (OSError, ValueError) as e:
+            print(f"[Checkpoint] Ignoring checkpoint with unreadable frames {self.frames_path}: {e}")
+            return None
+        return state
+
+    def _load_frames(self, saved: Dict) -> List[str]:
+        """Frames up to the checkpoint; anything appended after it is cut off"""
+        if saved['count'] == 0:
+            return []
+        os.truncate(self.frames_path, saved['offset'])
+        with open(self.frames_path, encoding='ascii') as f:
+            frames = f.read().splitlines()
+        if len(frames) != saved['count']:
+            raise ValueError(f"expected {saved['count']} frames, found {len(frames)}")
+        self._frames_saved, self._frames_offset = saved['count'], saved['offset']
+        return frames
+
+    def due(self) -> bool:
+        return time.monotonic() - self._last_save >= self.interval_seconds
+
+    def _append_frames(self, frame_images: List[str]):
+        new_frames = frame_images[self._frames_saved:]
+        # The first save of a fresh run starts the file over
+        with open(self.frames_path, 'a' if self._frames_saved else 'w', encoding='ascii') as f:
+            if self._frames_saved:
+                f.truncate(self._frames_offset)
+            for frame in new_frames:
+                f.write(frame + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+            self._frames_offset = f.tell()
+        self._frames_saved = len(frame_images)
+
+    def save(self, state: Dict, frame_images: List[str]):
+        """Write state (JSON values and ndarrays) and append the frames added since the last save"""
+        self._append_frames(frame_images)
+        arrays: Dict[str, np.ndarray] = {}
+        document = _split_arrays({
+            **state,
+            'frameImages': {'count': self._frames_saved, 'offset': self._frames_offset},
+            'version': CHECKPOINT_VERSION,
+            'fingerprint': self.fingerprint,
+            'savedAt': time.time(),
+        }, arrays)
+        arrays[_STATE_KEY] = np.frombuffer(json.dumps(document).encode('utf-8'), dtype=np.uint8)
+        tmp_path = self.path.with_name(f'{self.path.name}.part')
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.saved += 1
+        self._last_save = time.monotonic()
+
+    def clear(self):
+        """Remove the checkpoint once the run has produced its result"""
+        for path in (self.path, self.frames_path):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
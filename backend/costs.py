@@ -0,0 +1,252 @@
+"""
+Cost and ETA estimation: container probes, per-frame costs measured on this node, live ETAs for progress events
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+
+# Starting costs before anything was measured, in seconds per megapixel:
+# analysis per analysed frame (detection, weather, quality, saving) and decode per source frame
+DEFAULT_COSTS = {
+    'cpu': {'analysis': 0.35, 'decode': 0.004},
+    'cuda': {'analysis': 0.06, 'decode': 0.004},
+}
+
+# Work after the frame loop (statistics, charts, result serialisation)
+FIXED_SECONDS = 3.0
+
+# Rough JPEG size of a frame relative to its raw RGB bytes (base64 frames held until the result is built)
+JPEG_RATIO = 0.1
+
+
+def cost_key(settings: Dict, device: str) -> str:
+    """What the per-frame cost depends on besides resolution: device, models, tiling, weather model"""
+    from detectors import detector_backend_from_settings
+    from quantization import quantization_from_settings
+
+    return '|'.join([
+        device,
+        detector_backend_from_settings(settings),
+        settings.get('detectionModel') or 'default',
+        quantization_from_settings(settings) or 'none',
+        'tiled' if settings.get('tiledInference') or settings.get('roi') else 'full',
+        'weather-model' if settings.get('weatherModel') else 'weather-heuristic',
+        'static-gate' if settings.get('skipStaticFrames') else 'every-frame',
+    ])
+
+
+def analysis_device(settings: Dict) -> str:
+    """Device an analyzer for settings runs on (int8 quantization is CPU-only)"""
+    import torch
+    from quantization import quantization_from_settings
+
+    return 'cuda' if torch.cuda.is_available() and not quantization_from_settings(settings) else 'cpu'
+
+
+def probe_video(path: str, settings: Optional[Dict] = None) -> Dict:
+    """Container metadata (duration, fps, frame count, resolution, codec) without decoding frames"""
+    from decoders import open_decoder
+
+    decoder = open_decoder(path, settings or {})
+    try:
+        info = dict(decoder.info)
+    finally:
+        decoder.close()
+    size = os.path.getsize(path)
+    duration = info['frameCount'] / info['fps'] if info['fps'] > 0 else 0.0
+    info.update({
+        'duration': duration,
+        'fileSizeBytes': size,
+        'bitRate': int(size * 8 / duration) if duration > 0 else None,
+    })
+    return info
+
+
+class CostModel:
+    """Per-megapixel frame costs of finished analyses, averaged per cost_key
+
+    Every finished analyze_video (and every calibration) updates an exponential
+    moving average of its analysis and decode cost. With COST_MODEL_PATH the costs
+    are kept in a JSON file shared by the API and any workers on the same storage.
+    """
+
+    def __init__(self, path: Optional[Path] = None, alpha: float = 0.3):
+        self.path = Path(path) if path else None
+        self.alpha = alpha
+        self.entries: Dict[str, Dict] = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'CostModel':
+        return cls(os.environ.get('COST_MODEL_PATH') or None)
+
+    def _reload(self):
+        if self.path is None:
+            return
+        try:
+            mtime = self.path.stat().st_mtime_ns
+            if mtime != self._mtime:
+                self.entries = json.loads(self.path.read_text(encoding='utf-8'))
+                self._mtime = mtime
+        except (OSError, ValueError):
+            pass
+
+    def _save(self):
+        if self.path is None:
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(f'{self.path.name}.{os.getpid()}.part')
+            tmp_path.write_text(json.dumps(self.entries, indent=2), encoding='utf-8')
+            os.replace(tmp_path, self.path)
+            self._mtime = self.path.stat().st_mtime_ns
+        except OSError as e:
+            print(f"[Costs] Could not save cost model to {self.path}: {e}")
+
+    def record(self, key: str, analysis_per_mp: float, decode_per_mp: Optional[float], source: str = 'measured'):
+        """Fold one run's per-megapixel costs into the averages for key"""
+        with self._lock:
+            self._reload()
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = {'analysis': analysis_per_mp, 'decode': decode_per_mp, 'samples': 0}
+            else:
+                entry['analysis'] += self.alpha * (analysis_per_mp - entry['analysis'])
+                if decode_per_mp is not None:
+                    previous = entry.get('decode')
+                    entry['decode'] = decode_per_mp if previous is None else previous + self.alpha * (decode_per_mp - previous)
+            entry['samples'] += 1
+            entry['source'] = source
+            entry['updated'] = time.time()
+            self.entries[key] = entry
+            self._save()
+
+    def record_run(
+        self,
+        settings: Dict,
+        device: str,
+        timer: 'LoopTimer',
+        frame_size: Tuple[int, int],
+        source_size: Tuple[int, int],
+        source_frames: int
+    ):
+        """Record a finished analyze_video frame loop"""
+        if timer.frames == 0:
+            return
+        frame_mp = frame_size[0] * frame_size[1] / 1e6
+        source_mp = source_size[0] * source_size[1] / 1e6
+        self.record(
+            cost_key(settings, device),
+            timer.analysis_seconds / timer.frames / max(frame_mp, 1e-3),
+            timer.decode_seconds / max(source_frames, 1) / max(source_mp, 1e-3) if source_frames > 0 else None,
+        )
+
+    def costs(self, key: str, device: str) -> Dict:
+        """Per-megapixel costs for key: measured if available, else the defaults for the device"""
+        with self._lock:
+            self._reload()
+            entry = self.entries.get(key)
+        defaults = DEFAULT_COSTS['cuda' if device.startswith('cuda') else 'cpu']
+        if entry is None:
+            return {**defaults, 'source': 'default', 'samples': 0}
+        return {
+            'analysis': entry['analysis'],
+            'decode': entry['decode'] if entry.get('decode') is not None else defaults['decode'],
+            'source': entry.get('source', 'measured'),
+            'samples': entry['samples'],
+        }
+
+    def estimate(self, info: Dict, settings: Dict, device: str) -> Dict:
+        """Predicted runtime and memory of analyze_video for a probed video"""
+        from decoders import fit_size, parse_image_size
+
+        fps = info['fps']
+        frame_interval = max(1, int(fps / settings.get('fps', 1.0))) if fps > 0 else 1
+        frames = -(-info['frameCount'] // frame_interval) if info['frameCount'] else 0
+        width, height = fit_size(info['width'], info['height'], parse_image_size(settings.get('imageSize')))
+        frame_mp = width * height / 1e6
+        source_mp = info['width'] * info['height'] / 1e6
+
+        costs = self.costs(cost_key(settings, device), device)
+        analysis_seconds = frames * costs['analysis'] * frame_mp
+        decode_seconds = info['frameCount'] * costs['decode'] * source_mp
+        seconds = analysis_seconds + decode_seconds + FIXED_SECONDS
+
+        # Decoded frame plus its annotated/resized copies, and the base64 frames kept for the result
+        frame_bytes = width * height * 3
+        image_bytes = frames * frame_bytes * JPEG_RATIO * 4 / 3 if settings.get('includeImages', True) else 0
+        job_bytes = int(frame_bytes * 6 + image_bytes)
+        return {
+            'framesToAnalyse': frames,
+            'frameInterval': frame_interval,
+            'analysisSize': f'{width}x{height}',
+            'costs': costs,
+            'seconds': round(seconds, 1),
+            'breakdown': {
+                'analysisSeconds': round(analysis_seconds, 1),
+                'decodeSeconds': round(decode_seconds, 1),
+                'fixedSeconds': FIXED_SECONDS,
+            },
+            'memoryBytes': job_bytes,
+        }
+
+
+class LoopTimer:
+    """Split a frame loop's wall time into waiting for the decoder and analysing frames"""
+
+    def __init__(self):
+        self.decode_seconds = 0.0
+        self.analysis_seconds = 0.0
+        self.frames = 0
+        self._mark = time.perf_counter()
+
+    def frame_ready(self):
+        now = time.perf_counter()
+        self.decode_seconds += now - self._mark
+        self._mark = now
+
+    def frame_done(self):
+        now = time.perf_counter()
+        self.analysis_seconds += now - self._mark
+        self._mark = now
+        self.frames += 1
+
+
+class EtaTracker:
+    """Remaining seconds of a job from its progress percentage
+
+    Extrapolates the progress rate since the first update, blended with a prior
+    prediction (e.g. from CostModel.estimate) that loses weight as progress grows.
+    """
+
+    def __init__(self, predicted_seconds: Optional[float] = None):
+        self.predicted_seconds = predicted_seconds
+        self.started = time.monotonic()
+        self._first: Optional[tuple] = None
+
+    def update(self, progress: float) -> Optional[float]:
+        now = time.monotonic()
+        prior = max(0.0, self.predicted_seconds - (now - self.started)) if self.predicted_seconds is not None else None
+        if progress >= 100:
+            return 0.0
+        if self._first is None:
+            self._first = (now, progress)
+            return round(prior, 1) if prior is not None else None
+        first_time, first_progress = self._first
+        if progress <= first_progress or now <= first_time:
+            return round(prior, 1) if prior is not None else None
+        measured = (100 - progress) * (now - first_time) / (progress - first_progress)
+        if prior is None:
+            return round(measured, 1)
+        weight = min(1.0, progress / 100.0)
+        return round(weight * measured + (1.0 - weight) * prior, 1)
+
+
+# Costs learned by this process (shared through COST_MODEL_PATH when set)
+node_costs = CostModel.from_env()
@@ -0,0 +1,404 @@
+"""
+Pluggable video decode backends (OpenCV, PyAV, ffmpeg pipe) yielding sampled RGB frames
+"""
+
+import json
+import os
+import shutil
+import subprocess
+from fractions import Fraction
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+# Friendly names for the codec identifiers reported by FourCC / FFmpeg
+CODEC_NAMES = {
+    'avc1': 'H.264', 'h264': 'H.264', 'x264': 'H.264',
+    'hev1': 'H.265', 'hvc1': 'H.265', 'hevc': 'H.265', 'h265': 'H.265',
+    'vp08': 'VP8', 'vp8': 'VP8',
+    'vp09': 'VP9', 'vp9': 'VP9',
+    'av01': 'AV1', 'av1': 'AV1',
+    'mp4v': 'MPEG-4', 'mpeg4': 'MPEG-4',
+    'mjpg': 'MJPEG', 'mjpeg': 'MJPEG',
+    'mpeg2video': 'MPEG-2', 'prores': 'ProRes',
+}
+
+# Backends tried, in order, when settings ask for 'auto'
+AUTO_ORDER = ('pyav', 'ffmpeg', 'opencv')
+
+
+def codec_display_name(raw: Optional[str]) -> str:
+    """Map a FourCC or FFmpeg codec name to a human readable codec"""
+    if not raw:
+        return 'unknown'
+    key = raw.strip().strip('\x00').lower()
+    return CODEC_NAMES.get(key, key.upper())
+
+
+def parse_image_size(image_size) -> Optional[Tuple[int, int]]:
+    """Parse the 'imageSize' setting ('original' or 'WxH') into a (width, height) box"""
+    if not image_size or image_size == 'original':
+        return None
+    try:
+        width, height = str(image_size).lower().split('x')
+        return int(width), int(height)
+    except ValueError:
+        return None
+
+
+def fit_size(width: int, height: int, box: Optional[Tuple[int, int]]) -> Tuple[int, int]:
+    """Largest even size that fits within box while keeping the aspect ratio (never upscales)"""
+    if not box or width <= 0 or height <= 0:
+        return width, height
+    scale = min(box[0] / width, box[1] / height, 1.0)
+    # Even dimensions keep ffmpeg/swscale happy with subsampled formats
+    return max(2, int(width * scale) // 2 * 2), max(2, int(height * scale) // 2 * 2)
+
+
+class VideoDecoder:
+    """Base class: open a video, report its metadata and yield sampled RGB frames"""
+
+    name = 'base'
+
+    def __init__(self, path: str, threads: int = 0, output_size: Optional[Tuple[int, int]] = None, hw_accel: bool = False):
+        self.path = str(path)
+        self.threads = threads
+        self.output_size = output_size
+        self.hw_accel = hw_accel
+        self.info: Dict = {}
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return True
+
+    def open(self) -> Dict:
+        """Open the source and fill self.info (fps, frameCount, width, height, codec)"""
+        raise NotImplementedError
+
+    def frames(self, frame_interval: int = 1, start_frame: int = 0) -> Iterator[Tuple[int, np.ndarray]]:
+        """Yield (source frame index, HxWx3 uint8 RGB array) for every frame_interval-th frame
+
+        Sampling starts at start_frame (start_frame, start_frame + frame_interval, ...),
+        seeking there instead of decoding from the start.
+        """
+        raise NotImplementedError
+
+    def frames_at(self, frame_indices: Iterable[int]) -> Iterator[Tuple[int, np.ndarray]]:
+        """Yield (source frame index, RGB array) for the given ascending frame indices
+
+        Seeks to every frame instead of decoding the frames in between, which pays off
+        when the indices are further apart than the keyframe interval. Stops at the
+        first index past the end of the video.
+        """
+        for target in frame_indices:
+            frames = self.frames(1, start_frame=target)
+            try:
+                item = next(frames, None)
+            finally:
+                frames.close()
+            if item is None:
+                return
+            yield item
+
+    def close(self):
+        pass
+
+    def _target_size(self) -> Tuple[int, int]:
+        return fit_size(self.info['width'], self.info['height'], self.output_size)
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class OpenCVDecoder(VideoDecoder):
+    """cv2.VideoCapture with the FFmpeg backend; skipped frames are grabbed but never converted"""
+
+    name = 'opencv'
+
+    def open(self) -> Dict:
+        params = []
+        if hasattr(cv2, 'CAP_PROP_N_THREADS') and self.threads:
+            params += [cv2.CAP_PROP_N_THREADS, int(self.threads)]
+        if self.hw_accel and hasattr(cv2, 'CAP_PROP_HW_ACCELERATION'):
+            params += [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+
+        self.cap = cv2.VideoCapture(self.path, cv2.CAP_FFMPEG, params) if params else cv2.VideoCapture(self.path)
+        if not self.cap.isOpened():
+            raise ValueError(f"Could not open video: {self.path}")
+
+        fourcc = int(self.cap.get(cv2.CAP_PROP_FOURCC))
+        fourcc_str = ''.join(chr((fourcc >> (8 * i)) & 0xFF) for i in range(4)) if fourcc else ''
+        self.info = {
+            'fps': float(self.cap.get(cv2.CAP_PROP_FPS)),
+            'frameCount': int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+            'width': int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            'codec': codec_display_name(fourcc_str),
+            'decoder': self.name,
+        }
+        return self.info
+
+    def _to_rgb(self, frame: np.ndarray, target: Tuple[int, int]) -> np.ndarray:
+        if target != (self.info['width'], self.info['height']):
+            frame = cv2.resize(frame, target, interpolation=cv2.INTER_AREA)
+        # OpenCV can only hand out BGR, so this backend still converts
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    def frames(self, frame_interval: int = 1, start_frame: int = 0) -> Iterator[Tuple[int, np.ndarray]]:
+        frame_interval = max(1, frame_interval)
+        target = self._target_size()
+        frame_idx = 0
+        if start_frame > 0 and self.cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame):
+            frame_idx = start_frame
+        while True:
+            # grab() decodes without the BGR copy; only sampled frames are retrieved
+            if not self.cap.grab():
+                break
+            if frame_idx >= start_frame and (frame_idx - start_frame) % frame_interval == 0:
+                ret, frame = self.cap.retrieve()
+                if not ret:
+                    break
+                yield frame_idx, self._to_rgb(frame, target)
+            frame_idx += 1
+
+    def frames_at(self, frame_indices: Iterable[int]) -> Iterator[Tuple[int, np.ndarray]]:
+        target = self._target_size()
+        for frame_idx in frame_indices:
+            # A failed seek would leave the capture somewhere else, so stop rather than mislabel frames
+            if not self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx):
+                return
+            ret, frame = self.cap.read()
+            if not ret:
+                return
+            yield frame_idx, self._to_rgb(frame, target)
+
+    def close(self):
+        if getattr(self, 'cap', None) is not None:
+            self.cap.release()
+            self.cap = None
+
+
+class PyAVDecoder(VideoDecoder):
+    """PyAV with FFmpeg frame/slice threading; sampled frames are scaled and converted to RGB by swscale"""
+
+    name = 'pyav'
+
+    @classmethod
+    def is_available(cls) -> bool:
+        try:
+            import av  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    def open(self) -> Dict:
+        import av
+
+        try:
+            self.container = av.open(self.path)
+        except Exception as e:
+            raise ValueError(f"Could not open video: {self.path} ({e})")
+        if not self.container.streams.video:
+            self.container.close()
+            raise ValueError(f"No video stream in: {self.path}")
+
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = 'AUTO'
+        self.stream.codec_context.thread_count = int(self.threads or 0)
+
+        rate = self.stream.average_rate or self.stream.guessed_rate
+        fps = float(rate) if rate else 0.0
+        frame_count = int(self.stream.frames or 0)
+        if frame_count == 0 and fps > 0:
+            duration = None
+            if self.stream.duration is not None and self.stream.time_base is not None:
+                duration = float(self.stream.duration * self.stream.time_base)
+            elif self.container.duration:
+                duration = self.container.duration / av.time_base
+            frame_count = int(round(duration * fps)) if duration else 0
+
+        self.info = {
+            'fps': fps,
+            'frameCount': frame_count,
+            'width': int(self.stream.codec_context.width),
+            'height': int(self.stream.codec_context.height),
+            'codec': codec_display_name(self.stream.codec_context.name),
+            'decoder': self.name,
+        }
+        return self.info
+
+    def frames(self, frame_interval: int = 1, start_frame: int = 0) -> Iterator[Tuple[int, np.ndarray]]:
+        frame_interval = max(1, frame_interval)
+        width, height = self._target_size()
+        fps = self.info['fps']
+        if start_frame > 0 and fps > 0 and self.stream.time_base is not None:
+            # Seek to the keyframe before start_frame, then number frames by their timestamps
+            start_time = float(self.stream.start_time * self.stream.time_base) if self.stream.start_time is not None else 0.0
+            self.container.seek(int((start_time + start_frame / fps) / self.stream.time_base), stream=self.stream, backward=True)
+            for frame in self.container.decode(self.stream):
+                if frame.time is None:
+                    continue
+                frame_idx = int(round((frame.time - start_time) * fps))
+                if frame_idx >= start_frame and (frame_idx - start_frame) % frame_interval == 0:
+                    yield frame_idx, frame.to_ndarray(format='rgb24', width=width, height=height)
+            return
+        for frame_idx, frame in enumerate(self.container.decode(self.stream)):
+            if frame_idx % frame_interval == 0:
+                yield frame_idx, frame.to_ndarray(format='rgb24', width=width, height=height)
+
+    def close(self):
+        if getattr(self, 'container', None) is not None:
+            self.container.close()
+            self.container = None
+
+
+class FFmpegPipeDecoder(VideoDecoder):
+    """ffmpeg subprocess that selects, scales and converts frames itself and pipes raw RGB"""
+
+    name = 'ffmpeg'
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return shutil.which('ffmpeg') is not None and shutil.which('ffprobe') is not None
+
+    def open(self) -> Dict:
+        try:
+            probe = subprocess.run(
+                ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+                 '-show_entries', 'stream=codec_name,width,height,avg_frame_rate,r_frame_rate,nb_frames,duration',
+                 '-show_entries', 'format=duration',
+                 '-of', 'json', self.path],
+                capture_output=True, check=True, timeout=60
+            )
+            data = json.loads(probe.stdout)
+            stream = data['streams'][0]
+        except (subprocess.SubprocessError, KeyError, IndexError, ValueError) as e:
+            raise ValueError(f"Could not open video: {self.path} ({e})")
+
+        fps = 0.0
+        for key in ('avg_frame_rate', 'r_frame_rate'):
+            try:
+                rate = Fraction(stream.get(key, '0/1'))
+            except (ValueError, ZeroDivisionError):
+                continue
+            if rate > 0:
+                fps = float(rate)
+                break
+
+        frame_count = int(stream.get('nb_frames') or 0)
+        if frame_count == 0 and fps > 0:
+            duration = float(stream.get('duration') or data.get('format', {}).get('duration') or 0)
+            frame_count = int(round(duration * fps))
+
+        self.info = {
+            'fps': fps,
+            'frameCount': frame_count,
+            'width': int(stream['width']),
+            'height': int(stream['height']),
+            'codec': codec_display_name(stream.get('codec_name')),
+            'decoder': self.name,
+        }
+        return self.info
+
+    def frames(self, frame_interval: int = 1, start_frame: int = 0) -> Iterator[Tuple[int, np.ndarray]]:
+        frame_interval = max(1, frame_interval)
+        width, height = self._target_size()
+        fps = self.info['fps']
+        if fps <= 0:
+            start_frame = 0
+
+        filters = []
+        if frame_interval > 1:
+            filters.append(f'select=not(mod(n\\,{frame_interval}))')
+        if (width, height) != (self.info['width'], self.info['height']):
+            filters.append(f'scale={width}:{height}:flags=area')
+
+        cmd = ['ffmpeg', '-v', 'error', '-nostdin']
+        if self.hw_accel:
+            cmd += ['-hwaccel', 'auto']
+        cmd += ['-threads', str(int(self.threads or 0))]
+        if start_frame > 0:
+            # Input seeking: fast, and frame-accurate since ffmpeg decodes from the keyframe
+            cmd += ['-ss', f'{start_frame / fps:.6f}']
+        cmd += ['-i', self.path]
+        if filters:
+            cmd += ['-vf', ','.join(filters)]
+        cmd += ['-vsync', 'passthrough', '-an', '-pix_fmt', 'rgb24', '-f', 'rawvideo', 'pipe:1']
+
+        frame_bytes = width * height * 3
+        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=frame_bytes)
+        sampled = 0
+        try:
+            while True:
+                # A fresh writable buffer per frame, filled in place (no intermediate bytes object)
+                buffer = bytearray(frame_bytes)
+                view = memoryview(buffer)
+                filled = 0
+                while filled < frame_bytes:
+                    n = self.process.stdout.readinto(view[filled:])
+                    if not n:
+                        break
+                    filled += n
+                if filled < frame_bytes:
+                    break
+                yield start_frame + sampled * frame_interval, np.frombuffer(buffer, dtype=np.uint8).reshape(height, width, 3)
+                sampled += 1
+        finally:
+            self.close()
+
+    def close(self):
+        process = getattr(self, 'process', None)
+        if process is not None:
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            process.wait()
+            self.process = None
+
+
+DECODERS = {
+    OpenCVDecoder.name: OpenCVDecoder,
+    PyAVDecoder.name: PyAVDecoder,
+    FFmpegPipeDecoder.name: FFmpegPipeDecoder,
+}
+
+
+def decoded_frame_size(info: Dict, settings: Dict) -> Tuple[int, int]:
+    """(width, height) of the frames open_decoder hands out for a video with this info"""
+    return fit_size(info['width'], info['height'], parse_image_size(settings.get('imageSize')))
+
+
+def open_decoder(path: str, settings: Dict) -> VideoDecoder:
+    """Open a video with the decoder chosen in settings ('decoder': auto/opencv/pyav/ffmpeg)"""
+    choice = settings.get('decoder') or os.environ.get('VIDEO_DECODER', 'auto')
+    threads = int(settings.get('decodeThreads', os.environ.get('DECODE_THREADS', 0)))
+    output_size = parse_image_size(settings.get('imageSize'))
+    hw_accel = bool(settings.get('hwAccel', False))
+
+    if choice == 'auto':
+        candidates = [name for name in AUTO_ORDER if DECODERS[name].is_available()]
+    elif choice in DECODERS:
+        candidates = [choice]
+        if choice != OpenCVDecoder.name:
+            candidates.append(OpenCVDecoder.name)
+    else:
+        raise ValueError(f"Unknown decoder: {choice}")
+
+    last_error = None
+    for name in candidates:
+        decoder = DECODERS[name](path, threads=threads, output_size=output_size, hw_accel=hw_accel)
+        try:
+            decoder.open()
+            return decoder
+        except Exception as e:
+            # Fall through to the next backend (OpenCV is always last)
+            print(f"[Decode] {name} could not open {path}: {e}")
+            decoder.close()
+            last_error = e
+    raise last_error if last_error else ValueError(f"Could not open video: {path}")
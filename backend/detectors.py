@@ -0,0 +1,362 @@
+"""
+Object detector backends behind a common interface (HF DETR, ONNX Runtime, torchvision single-stage)
+"""
+
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from PIL import Image
+
+
+# Labels counted as vehicles / humans (COCO names after normalise_label)
+VEHICLE_LABELS = ('car', 'truck', 'bus', 'motorcycle', 'bicycle')
+PERSON_LABELS = ('person',)
+
+# Spellings used by non-COCO label maps, mapped onto the COCO names above
+LABEL_ALIASES = {
+    'motorbike': 'motorcycle',
+    'motor bike': 'motorcycle',
+    'bike': 'bicycle',
+    'pedestrian': 'person',
+    'people': 'person',
+    'human': 'person',
+    'lorry': 'truck',
+    'automobile': 'car',
+}
+
+DEFAULT_DETECTION_MODEL = 'facebook/detr-resnet-50'
+
+# One image's raw detections: xyxy boxes (N, 4), scores (N,), label ids (N,)
+RawDetections = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+# Category codes in Detector.category_lut and Detections.categories (0 = not counted)
+CATEGORY_CODES = {'vehicle': 1, 'person': 2}
+CATEGORY_NAMES = {code: name for name, code in CATEGORY_CODES.items()}
+
+
+def normalise_label(name: str) -> str:
+    """Lower-case a model label and map known aliases onto the shared COCO vocabulary"""
+    name = str(name).strip().lower().replace('_', ' ')
+    return LABEL_ALIASES.get(name, name)
+
+
+def label_category(label: str) -> Optional[str]:
+    """'vehicle', 'person' or None for a normalised label"""
+    if label in VEHICLE_LABELS:
+        return 'vehicle'
+    if label in PERSON_LABELS:
+        return 'person'
+    return None
+
+
+def _empty() -> RawDetections:
+    return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+
+class Detections:
+    """One image's detections as parallel arrays, with each box's category code
+
+    Counting, confidence and annotation work on the arrays directly; per-box
+    dicts are only built by to_dicts() where a result leaves the backend.
+    """
+
+    __slots__ = ('boxes', 'scores', 'label_ids', 'categories', 'id2label')
+
+    def __init__(
+        self,
+        boxes: np.ndarray,
+        scores: np.ndarray,
+        label_ids: np.ndarray,
+        categories: np.ndarray,
+        id2label: Dict[int, str]
+    ):
+        self.boxes = boxes
+        self.scores = scores
+        self.label_ids = label_ids
+        self.categories = categories
+        self.id2label = id2label
+
+    @classmethod
+    def from_raw(cls, raw: RawDetections, detector: 'Detector') -> 'Detections':
+        boxes, scores, label_ids = raw
+        return cls(boxes, scores, label_ids, detector.categories_of(label_ids), detector.id2label)
+
+    @classmethod
+    def empty(cls, id2label: Optional[Dict[int, str]] = None) -> 'Detections':
+        boxes, scores, label_ids = _empty()
+        return cls(boxes, scores, label_ids, np.zeros(0, dtype=np.int8), id2label or {})
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def to_state(self) -> Dict:
+        """Arrays and label map for a checkpoint"""
+        return {
+            'boxes': self.boxes, 'scores': self.scores, 'labelIds': self.label_ids, 'categories': self.categories,
+            'id2label': {str(label_id): name for label_id, name in self.id2label.items()},
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict) -> 'Detections':
+        return cls(state['boxes'], state['scores'], state['labelIds'], state['categories'],
+                   {int(label_id): name for label_id, name in state['id2label'].items()})
+
+    @property
+    def vehicle_mask(self) -> np.ndarray:
+        return self.categories == CATEGORY_CODES['vehicle']
+
+    @property
+    def person_mask(self) -> np.ndarray:
+        return self.categories == CATEGORY_CODES['person']
+
+    @property
+    def tracked_mask(self) -> np.ndarray:
+        """Vehicles and people (the categories the tracker follows)"""
+        return self.categories > 0
+
+    @property
+    def vehicle_count(self) -> int:
+        return int(np.count_nonzero(self.vehicle_mask))
+
+    @property
+    def person_count(self) -> int:
+        return int(np.count_nonzero(self.person_mask))
+
+    def mean_score(self) -> float:
+        return float(self.scores.mean()) if len(self.scores) else 0.0
+
+    def labels(self) -> List[str]:
+        return [self.id2label.get(label_id, str(label_id)) for label_id in self.label_ids.tolist()]
+
+    def category_names(self) -> List[Optional[str]]:
+        return [CATEGORY_NAMES.get(code) for code in self.categories.tolist()]
+
+    def select(self, mask: np.ndarray) -> 'Detections':
+        """Subset by boolean mask or index array"""
+        return Detections(self.boxes[mask], self.scores[mask], self.label_ids[mask], self.categories[mask], self.id2label)
+
+    def to_dicts(self) -> List[Dict]:
+        """[{label, score, box}, ...] for JSON results"""
+        return [
+            {'label': label, 'score': score, 'box': box}
+            for label, score, box in zip(self.labels(), self.scores.tolist(), self.boxes.tolist())
+        ]
+
+
+class Detector:
+    """Base class: detect(images, threshold) -> per-image (boxes, scores, label ids) in pixels"""
+
+    name = 'base'
+
+    def __init__(self, model_name: str, device: torch.device, quantization: Optional[str] = None):
+        self.model_name = model_name
+        self.device = device
+        self.quantization = quantization
+        # Normalised label for every class id the model can emit
+        self.id2label: Dict[int, str] = {}
+        # Category code for every class id (index = label id), see CATEGORY_CODES
+        self.category_lut = np.zeros(0, dtype=np.int8)
+        # Underlying torch module, if any (used for quantization and memory accounting)
+        self.model = None
+
+    def detect(self, images: List[Image.Image], threshold: float) -> List[RawDetections]:
+        raise NotImplementedError
+
+    def _set_labels(self, id2label: Dict):
+        self.id2label = {int(k): normalise_label(v) for k, v in id2label.items()}
+        self.category_lut = np.zeros(max(self.id2label, default=-1) + 1, dtype=np.int8)
+        for label_id, label in self.id2label.items():
+            category = label_category(label)
+            if category and label_id >= 0:
+                self.category_lut[label_id] = CATEGORY_CODES[category]
+
+    def categories_of(self, label_ids: np.ndarray) -> np.ndarray:
+        """Category codes for an array of label ids (0 for ids outside the label map)"""
+        label_ids = np.asarray(label_ids, dtype=np.int64)
+        if not len(self.category_lut):
+            return np.zeros(len(label_ids), dtype=np.int8)
+        known = (label_ids >= 0) & (label_ids < len(self.category_lut))
+        return np.where(known, self.category_lut[np.where(known, label_ids, 0)], 0).astype(np.int8)
+
+    def _load_model(self, load_fp32) -> torch.nn.Module:
+        """Load the torch module, going through the int8 cache when quantization is enabled"""
+        if self.quantization:
+            from quantization import load_quantized
+            model = load_quantized(f'{self.name}-{self.model_name}', load_fp32, self.quantization)
+        else:
+            model = load_fp32()
+        model.to(self.device)
+        model.eval()
+        return model
+
+
+class DetrDetector(Detector):
+    """Hugging Face DETR (DetrImageProcessor + DetrForObjectDetection)"""
+
+    name = 'detr'
+
+    def __init__(self, model_name: str, device: torch.device, quantization: Optional[str] = None):
+        super().__init__(model_name, device, quantization)
+        from transformers import DetrImageProcessor, DetrForObjectDetection
+
+        self.processor = DetrImageProcessor.from_pretrained(model_name)
+        self.model = self._load_model(lambda: DetrForObjectDetection.from_pretrained(model_name))
+        self._set_labels(self.model.config.id2label)
+
+    def detect(self, images: List[Image.Image], threshold: float) -> List[RawDetections]:
+        inputs = self.processor(images=images, return_tensors="pt")
+        inputs = {k: v.to(self.device) for k, v in inputs.items()}
+
+        with torch.no_grad():
+            outputs = self.model(**inputs)
+
+        results = self.processor.post_process_object_detection(
+            outputs, threshold=threshold,
+            target_sizes=torch.tensor([image.size[::-1] for image in images]).to(self.device)
+        )
+        # One device->host copy per tensor per image, not per box
+        return [
+            (r["boxes"].float().cpu().numpy(), r["scores"].float().cpu().numpy(), r["labels"].cpu().numpy())
+            for r in results
+        ]
+
+
+class OnnxDetrDetector(Detector):
+    """DETR exported to ONNX, run with ONNX Runtime on the CPU execution provider
+
+    Expects the usual Hugging Face export (inputs pixel_values[, pixel_mask];
+    outputs logits, pred_boxes). Pre-processing reuses the model's image processor.
+    """
+
+    name = 'onnx'
+
+    def __init__(self, model_name: str, device: torch.device, onnx_path: str, intra_op_threads: int = 0, inter_op_threads: int = 0):
+        super().__init__(model_name, device)
+        import onnxruntime as ort
+        from transformers import AutoConfig, DetrImageProcessor
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = int(intra_op_threads)
+        if inter_op_threads:
+            options.inter_op_num_threads = int(inter_op_threads)
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+
+        self.onnx_path = onnx_path
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.output_names = [o.name for o in self.session.get_outputs()]
+        self.processor = DetrImageProcessor.from_pretrained(model_name)
+        self._set_labels(AutoConfig.from_pretrained(model_name).id2label)
+
+    def detect(self, images: List[Image.Image], threshold: float) -> List[RawDetections]:
+        inputs = self.processor(images=images, return_tensors="np")
+
+        # IO binding: inputs are bound in place and outputs allocated by ORT, avoiding extra copies
+        binding = self.session.io_binding()
+        for name in self.input_names:
+            binding.bind_cpu_input(name, np.ascontiguousarray(inputs[name]))
+        for name in self.output_names:
+            binding.bind_output(name)
+        self.session.run_with_iobinding(binding)
+        outputs = dict(zip(self.output_names, binding.copy_outputs_to_cpu()))
+
+        logits = outputs['logits']
+        pred_boxes = outputs['pred_boxes']
+
+        # Softmax over classes, dropping DETR's trailing "no object" class
+        logits = logits - logits.max(axis=-1, keepdims=True)
+        probs = np.exp(logits)
+        probs /= probs.sum(axis=-1, keepdims=True)
+        probs = probs[..., :-1]
+        scores = probs.max(axis=-1)
+        labels = probs.argmax(axis=-1)
+
+        results = []
+        for image, image_scores, image_labels, boxes in zip(images, scores, labels, pred_boxes):
+            keep = image_scores > threshold
+            if not keep.any():
+                results.append(_empty())
+                continue
+            width, height = image.size
+            cx, cy, w, h = boxes[keep].T
+            xyxy = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1) * np.array([width, height, width, height])
+            results.append((xyxy.astype(np.float32), image_scores[keep].astype(np.float32), image_labels[keep].astype(np.int64)))
+        return results
+
+
+class SingleStageDetector(Detector):
+    """Lightweight torchvision single-stage detector (SSDLite MobileNetV3 by default), COCO labels"""
+
+    name = 'ssdlite'
+
+    BUILDERS = ('ssdlite320_mobilenet_v3_large', 'ssd300_vgg16', 'retinanet_resnet50_fpn_v2', 'fcos_resnet50_fpn')
+    DEFAULT_MODEL = 'ssdlite320_mobilenet_v3_large'
+
+    def __init__(self, model_name: str, device: torch.device, quantization: Optional[str] = None):
+        builder_name = model_name if model_name in self.BUILDERS else self.DEFAULT_MODEL
+        super().__init__(builder_name, device, quantization)
+        from torchvision.models import detection, get_model_weights
+
+        weights = get_model_weights(builder_name).DEFAULT
+        self.model = self._load_model(lambda: getattr(detection, builder_name)(weights=weights))
+        self.transforms = weights.transforms()
+        self._set_labels(dict(enumerate(weights.meta['categories'])))
+
+    def detect(self, images: List[Image.Image], threshold: float) -> List[RawDetections]:
+        import torchvision.transforms.functional as F
+
+        batch = [self.transforms(F.pil_to_tensor(image)).to(self.device) for image in images]
+        with torch.no_grad():
+            outputs = self.model(batch)
+
+        results = []
+        for output in outputs:
+            keep = output['scores'] > threshold
+            results.append((
+                output['boxes'][keep].float().cpu().numpy(),
+                output['scores'][keep].float().cpu().numpy(),
+                output['labels'][keep].cpu().numpy(),
+            ))
+        return results
+
+
+DETECTOR_BACKENDS = {
+    DetrDetector.name: DetrDetector,
+    OnnxDetrDetector.name: OnnxDetrDetector,
+    SingleStageDetector.name: SingleStageDetector,
+}
+
+
+def create_detector(
+    backend: str,
+    model_name: str,
+    device: torch.device,
+    options: Optional[Dict] = None,
+    quantization: Optional[str] = None
+) -> Detector:
+    """Build a detector backend ('detr', 'onnx' or 'ssdlite'), optionally with int8 dynamic quantization"""
+    options = options or {}
+    if backend == OnnxDetrDetector.name:
+        if quantization:
+            # ONNX models are quantized at export time (onnxruntime.quantization), not here
+            print("[Detector] Ignoring quantization for the onnx backend; pass an already quantized model instead")
+        onnx_path = options.get('onnxModelPath') or os.environ.get('ONNX_MODEL_PATH')
+        if not onnx_path:
+            raise ValueError("The onnx detector backend needs onnxModelPath (or ONNX_MODEL_PATH)")
+        return OnnxDetrDetector(
+            model_name, device, onnx_path,
+            intra_op_threads=int(options.get('onnxIntraOpThreads', os.environ.get('ONNX_INTRA_OP_THREADS', 0))),
+            inter_op_threads=int(options.get('onnxInterOpThreads', os.environ.get('ONNX_INTER_OP_THREADS', 0))),
+        )
+    if backend not in DETECTOR_BACKENDS:
+        raise ValueError(f"Unknown detector backend: {backend}")
+    return DETECTOR_BACKENDS[backend](model_name, device, quantization)
+
+
+def detector_backend_from_settings(settings: Dict) -> str:
+    """Backend requested by settings, else the node default (DETECTOR_BACKEND, 'detr')"""
+    return settings.get('detectorBackend') or os.environ.get('DETECTOR_BACKEND', DetrDetector.name)
@@ -0,0 +1,462 @@
+"""
+Annotated output video: encode annotated frames into one MP4/WebM while the analysis runs
+"""
+
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+from fractions import Fraction
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+from serialization import ANNOTATED_VIDEO_BASENAME, VIDEO_MIMETYPES
+
+
+# Default codec per output container
+CONTAINER_CODECS = {'mp4': 'h264', 'webm': 'vp9'}
+
+# FFmpeg encoder per codec (PyAV and the ffmpeg pipe) and the OpenCV FourCC fallback
+FFMPEG_ENCODERS = {
+    'h264': 'libx264', 'h265': 'libx265', 'mpeg4': 'mpeg4',
+    'vp8': 'libvpx', 'vp9': 'libvpx-vp9', 'av1': 'libaom-av1',
+}
+OPENCV_FOURCC = {'h264': 'avc1', 'h265': 'hvc1', 'mpeg4': 'mp4v', 'vp8': 'VP80', 'vp9': 'VP90', 'av1': 'av01'}
+
+# Backends tried, in order, when settings ask for 'auto'
+ENCODER_AUTO_ORDER = ('pyav', 'ffmpeg', 'opencv')
+
+# Annotated frames waiting for the encoder thread before add() blocks the analysis loop
+ENCODE_QUEUE_FRAMES = 8
+
+
+def parse_bit_rate(value: Union[int, float, str, None]) -> Optional[int]:
+    """Bits per second from 2500000, '2.5M' or '800k' (None keeps the encoder's default quality)"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value).strip().lower()
+    scale = {'k': 1_000, 'm': 1_000_000}.get(text[-1:], 1)
+    return int(float(text[:-1] if scale > 1 else text) * scale)
+
+
+class VideoEncoder:
+    """Base class: write fixed-size RGB frames at a constant frame rate to one file"""
+
+    name = 'base'
+
+    def __init__(self, path: Path, size: Tuple[int, int], fps: float, codec: str,
+                 bit_rate: Optional[int] = None, threads: int = 0):
+        self.path = Path(path)
+        self.size = size
+        self.fps = fps
+        self.codec = codec
+        self.bit_rate = bit_rate
+        self.threads = threads
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return True
+
+    def open(self):
+        raise NotImplementedError
+
+    def write(self, frame_rgb: np.ndarray):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class PyAVEncoder(VideoEncoder):
+    """PyAV (libav*) encoder with FFmpeg frame/slice threading; RGB -> YUV conversion in swscale"""
+
+    name = 'pyav'
+
+    @classmethod
+    def is_available(cls) -> bool:
+        try:
+            import av  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    def open(self):
+        import av
+
+        options = {'movflags': '+faststart'} if self.path.suffix == '.mp4' else {}
+        self.container = av.open(str(self.path), mode='w', options=options)
+        try:
+            self.stream = self.container.add_stream(FFMPEG_ENCODERS[self.codec], rate=Fraction(self.fps).limit_denominator(1001))
+            self.stream.width, self.stream.height = self.size
+            self.stream.pix_fmt = 'yuv420p'
+            if self.bit_rate:
+                self.stream.bit_rate = self.bit_rate
+            self.stream.thread_type = 'AUTO'
+            self.stream.codec_context.thread_count = int(self.threads or 0)
+        except Exception:
+            self.container.close()
+            raise
+
+    def write(self, frame_rgb: np.ndarray):
+        import av
+
+        frame = av.VideoFrame.from_ndarray(frame_rgb, format='rgb24')
+        for packet in self.stream.encode(frame):
+            self.container.mux(packet)
+
+    def close(self):
+        if getattr(self, 'container', None) is not None:
+            try:
+                for packet in self.stream.encode():
+                    self.container.mux(packet)
+            finally:
+                self.container.close()
+                self.container = None
+
+
+class FFmpegPipeEncoder(VideoEncoder):
+    """ffmpeg subprocess reading raw RGB frames from a pipe"""
+
+    name = 'ffmpeg'
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return shutil.which('ffmpeg') is not None
+
+    def open(self):
+        width, height = self.size
+        cmd = ['ffmpeg', '-v', 'error', '-nostdin', '-y',
+               '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-r', f'{self.fps:.6f}', '-i', 'pipe:0',
+               '-an', '-c:v', FFMPEG_ENCODERS[self.codec], '-pix_fmt', 'yuv420p', '-threads', str(int(self.threads or 0))]
+        if self.bit_rate:
+            cmd += ['-b:v', str(self.bit_rate)]
+        if self.path.suffix == '.mp4':
+            cmd += ['-movflags', '+faststart']
+        cmd.append(str(self.path))
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def write(self, frame_rgb: np.ndarray):
+        try:
+            self.process.stdin.write(np.ascontiguousarray(frame_rgb).data)
+        except BrokenPipeError:
+            raise RuntimeError(f"ffmpeg encoder exited: {self.process.stderr.read().decode(errors='replace').strip()}")
+
+    def close(self):
+        process = getattr(self, 'process', None)
+        if process is None:
+            return
+        self.process = None
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        stderr = process.stderr.read().decode(errors='replace').strip()
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg encoder failed: {stderr}")
+
+
+class OpenCVEncoder(VideoEncoder):
+    """cv2.VideoWriter fallback (no bit rate control; codec support depends on the OpenCV build)"""
+
+    name = 'opencv'
+
+    def open(self):
+        fourcc = cv2.VideoWriter_fourcc(*OPENCV_FOURCC.get(self.codec, 'mp4v'))
+        self.writer = cv2.VideoWriter(str(self.path), fourcc, self.fps, self.size)
+        if not self.writer.isOpened():
+            raise ValueError(f"OpenCV cannot encode {self.codec} to {self.path.name}")
+
+    def write(self, frame_rgb: np.ndarray):
+        self.writer.write(cv2.cvtColor(frame_rgb, cv2.COLOR_RGB2BGR))
+
+    def close(self):
+        if getattr(self, 'writer', None) is not None:
+            self.writer.release()
+            self.writer = None
+
+
+ENCODERS = {
+    PyAVEncoder.name: PyAVEncoder,
+    FFmpegPipeEncoder.name: FFmpegPipeEncoder,
+    OpenCVEncoder.name: OpenCVEncoder,
+}
+
+
+def open_encoder(path: Path, size: Tuple[int, int], fps: float, codec: str, bit_rate: Optional[int],
+                 threads: int, choice: str = 'auto') -> VideoEncoder:
+    """Open the first encoder backend that can write codec to path ('auto', 'pyav', 'ffmpeg' or 'opencv')"""
+    if choice == 'auto':
+        candidates = [name for name in ENCODER_AUTO_ORDER if ENCODERS[name].is_available()]
+    elif choice in ENCODERS:
+        candidates = [choice]
+        if choice != OpenCVEncoder.name:
+            candidates.append(OpenCVEncoder.name)
+    else:
+        raise ValueError(f"Unknown video encoder: {choice}")
+
+    last_error = None
+    for name in candidates:
+        encoder = ENCODERS[name](path, size, fps, codec, bit_rate, threads)
+        try:
+            encoder.open()
+            return encoder
+        except Exception as e:
+            # Fall through to the next backend (OpenCV is always last)
+            print(f"[Encode] {name} could not open {path.name} ({codec}): {e}")
+            try:
+                encoder.close()
+            except Exception:
+                pass
+            last_error = e
+    raise last_error if last_error else ValueError(f"No video encoder available for {codec}")
+
+
+def concat_segments(segments: List[Tuple[Path, Optional[float]]], output: Path) -> bool:
+    """Join videos with ffmpeg's concat demuxer (stream copy), each cut at its outpoint in seconds
+
+    output may be one of the inputs: the joined file is written next to it and renamed
+    over it. Returns False (inputs untouched) when ffmpeg is missing or fails.
+    """
+    if shutil.which('ffmpeg') is None:
+        return False
+    output = Path(output)
+    list_path = output.with_name(f'{output.stem}.concat.txt')
+    joined = output.with_name(f'{output.stem}.joining{output.suffix}')
+    lines = []
+    for path, outpoint in segments:
+        quoted = Path(path).resolve().as_posix().replace("'", "'\\''")
+        lines.append(f"file '{quoted}'")
+        if outpoint is not None:
+            lines.append(f'outpoint {outpoint:.6f}')
+    list_path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+
+    cmd = ['ffmpeg', '-v', 'error', '-nostdin', '-y', '-f', 'concat', '-safe', '0', '-i', str(list_path), '-c', 'copy']
+    if output.suffix == '.mp4':
+        cmd += ['-movflags', '+faststart']
+    cmd.append(str(joined))
+    try:
+        subprocess.run(cmd, capture_output=True, check=True, timeout=3600)
+        os.replace(joined, output)
+        return True
+    except (subprocess.SubprocessError, OSError) as e:
+        detail = getattr(e, 'stderr', None) or b''
+        print(f"[Encode] Could not join {len(segments)} segments into {output.name}: {e} {detail.decode(errors='replace').strip()}")
+        joined.unlink(missing_ok=True)
+        return False
+    finally:
+        list_path.unlink(missing_ok=True)
+
+
+class AnnotatedVideoWriter:
+    """Encode annotated frames into one video on a background thread, in frame order
+
+    add() queues the frame with its output index (the n-th sampled frame) and only
+    blocks when the encoder falls ENCODE_QUEUE_FRAMES behind. Indices skipped by
+    the caller (adaptive sampling stride) repeat the previous frame, so the output
+    keeps the sampled frame rate and stays aligned with the source timeline.
+
+    A resumed run writes annotated_from_<first source frame>; when it finishes, all
+    segments are joined into annotated.<ext>, each cut where the next one starts.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        fps: float,
+        codec: str,
+        bit_rate: Optional[int] = None,
+        encoder: str = 'auto',
+        threads: int = 0,
+        first_frame: int = 0,
+        frame_interval: int = 1
+    ):
+        self.path = Path(path)
+        self.fps = fps if fps > 0 else 1.0
+        self.codec = codec
+        self.bit_rate = bit_rate
+        self.encoder_choice = encoder
+        self.threads = threads
+        self.first_frame = first_frame
+        self.frame_interval = max(1, int(frame_interval))
+
+        self.encoder: Optional[VideoEncoder] = None
+        self.frames_written = 0
+        self.encode_seconds = 0.0
+        self._queue: queue.Queue = queue.Queue(maxsize=ENCODE_QUEUE_FRAMES)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, name='annotated-video-encoder', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_settings(
+        cls,
+        settings: Dict,
+        output_dir: Path,
+        fps: float,
+        start_frame: int = 0,
+        frame_interval: int = 1
+    ) -> Optional['AnnotatedVideoWriter']:
+        """Writer for annotatedVideo (true, 'mp4' or 'webm'), or None when it is off
+
+        fps is the output (sampled) rate, one frame per frame_interval source frames.
+        """
+        container = settings.get('annotatedVideo')
+        if not container:
+            return None
+        container = 'mp4' if container is True else str(container).lower()
+        if container not in CONTAINER_CODECS:
+            raise ValueError(f"Unknown annotatedVideo container: {container} ({', '.join(CONTAINER_CODECS)})")
+        codec = str(settings.get('annotatedVideoCodec') or CONTAINER_CODECS[container]).lower()
+        if codec not in FFMPEG_ENCODERS:
+            raise ValueError(f"Unknown annotatedVideoCodec: {codec} ({', '.join(FFMPEG_ENCODERS)})")
+        name = ANNOTATED_VIDEO_BASENAME if start_frame == 0 else f'{ANNOTATED_VIDEO_BASENAME}_from_{start_frame:06d}'
+        return cls(
+            Path(output_dir) / f'{name}.{container}',
+            fps,
+            codec,
+            bit_rate=parse_bit_rate(settings.get('annotatedVideoBitrate')),
+            encoder=settings.get('videoEncoder') or os.environ.get('VIDEO_ENCODER', 'auto'),
+            threads=int(settings.get('encodeThreads', os.environ.get('ENCODE_THREADS', 0))),
+            first_frame=start_frame,
+            frame_interval=frame_interval,
+        )
+
+    def add(self, frame_rgb: np.ndarray, index: int):
+        """Queue an annotated frame for output position index (indices must increase)"""
+        if self._error is not None:
+            raise RuntimeError(f"Annotated video encoding failed: {self._error}")
+        self._queue.put((index, frame_rgb))
+
+    def _run(self):
+        previous = None
+        next_index = 0
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self._error is not None:
+                # Keep draining so add() never blocks on a dead encoder
+                continue
+            index, frame = item
+            try:
+                started = time.perf_counter()
+                if self.encoder is None:
+                    # yuv420p needs even dimensions
+                    height, width = frame.shape[:2]
+                    size = (width - width % 2, height - height % 2)
+                    self.encoder = open_encoder(self.path, size, self.fps, self.codec, self.bit_rate,
+                                                self.threads, self.encoder_choice)
+                    print(f"[Encode] Writing {self.path.name} with {self.encoder.name} "
+                          f"({self.codec}, {size[0]}x{size[1]} @ {self.fps:.3g} fps)")
+                width, height = self.encoder.size
+                if frame.shape[:2] != (height, width):
+                    frame = np.ascontiguousarray(frame[:height, :width])
+                while previous is not None and next_index < index:
+                    self.encoder.write(previous)
+                    self.frames_written += 1
+                    next_index += 1
+                self.encoder.write(frame)
+                self.frames_written += 1
+                next_index = index + 1
+                previous = frame
+                self.encode_seconds += time.perf_counter() - started
+            except Exception as e:
+                print(f"[Encode] {self.path.name}: {e}")
+                self._error = e
+
+    def _finish(self):
+        self._queue.put(None)
+        self._thread.join()
+        if self.encoder is not None:
+            started = time.perf_counter()
+            try:
+                self.encoder.close()
+            finally:
+                self.encode_seconds += time.perf_counter() - started
+
+    def close(self) -> Optional[Dict]:
+        """Flush the encoder and describe the finished file (None if no frame was written)"""
+        self._finish()
+        if self._error is not None:
+            raise RuntimeError(f"Annotated video encoding failed: {self._error}")
+        if self.encoder is None:
+            return None
+        container = self.path.suffix.lstrip('.')
+        info = {
+            'filename': self.path.name,
+            'container': container,
+            'mimetype': VIDEO_MIMETYPES[container],
+            'codec': self.codec,
+            'encoder': self.encoder.name,
+            'bitRate': self.bit_rate if self.encoder.name != OpenCVEncoder.name else None,
+            'width': self.encoder.size[0],
+            'height': self.encoder.size[1],
+            'fps': self.fps,
+            'frames': self.frames_written,
+            'firstFrame': self.first_frame,
+            'bytes': self.path.stat().st_size if self.path.exists() else 0,
+            'encodeSeconds': round(self.encode_seconds, 3),
+        }
+        if self.first_frame > 0:
+            self._join_segments(info)
+        return info
+
+    def _segments(self) -> List[Tuple[int, Path]]:
+        """(first source frame, path) of every segment of this job, in order"""
+        directory, suffix = self.path.parent, self.path.suffix
+        segments = []
+        base = directory / f'{ANNOTATED_VIDEO_BASENAME}{suffix}'
+        if base.exists():
+            segments.append((0, base))
+        for path in directory.glob(f'{ANNOTATED_VIDEO_BASENAME}_from_*{suffix}'):
+            start = path.stem.rsplit('_', 1)[-1]
+            if start.isdigit():
+                segments.append((int(start), path))
+        return sorted(segments)
+
+    def _join_segments(self, info: Dict):
+        """Join earlier runs' segments and this one into annotated.<ext>, updating info
+
+        Each segment is cut where the next starts: frames after the checkpoint were
+        analysed again by the next run. If joining fails, info lists the segments.
+        """
+        segments = [(start, path) for start, path in self._segments() if start <= self.first_frame]
+        if len(segments) < 2:
+            return
+        cuts, frames = [], 0
+        for (start, path), (next_start, _) in zip(segments, segments[1:]):
+            count = max(0, (next_start - start) // self.frame_interval)
+            cuts.append((path, count / self.fps))
+            frames += count
+        cuts.append((self.path, None))
+        frames += self.frames_written
+
+        target = self.path.with_name(f'{ANNOTATED_VIDEO_BASENAME}{self.path.suffix}')
+        if not concat_segments(cuts, target):
+            info['segments'] = [path.name for _, path in segments]
+            return
+        for _, path in segments:
+            if path != target:
+                path.unlink(missing_ok=True)
+        print(f"[Encode] Joined {len(segments)} segments into {target.name}")
+        info.update({
+            'filename': target.name,
+            'firstFrame': 0,
+            'frames': frames,
+            'bytes': target.stat().st_size,
+            'joinedSegments': len(segments),
+        })
+
+    def abort(self):
+        """Finalise whatever was written after a failed analysis (errors are only logged)"""
+        try:
+            self._finish()
+        except Exception as e:
+            print(f"[Encode] Could not finalise {self.path.name}: {e}")
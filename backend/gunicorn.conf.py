@@ -0,0 +1,40 @@
+"""
+Gunicorn settings for serving the backend in production
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+gthread workers: one process holds one copy of the models and serves requests from
+a thread pool, so concurrent requests share the models (and the micro-batcher when
+INFERENCE_BATCHING=1). Server-side batch job status (/api/batch/<job_id>) lives in
+process memory, so the server runs exactly one worker: scale with GUNICORN_THREADS,
+or with analysis workers on a job broker (JOB_BROKER_DB).
+"""
+
+import os
+
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', 7860)}")
+worker_class = 'gthread'
+workers = 1
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Models load in each worker after fork; torch thread pools and CUDA do not survive fork
+preload_app = False
+
+# gthread workers heartbeat from their main loop, so this does not cap long SSE streams
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+# Time given to in-flight analyses (SSE streams and batch jobs) to finish on SIGTERM/HUP
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 900))
+# Longer than typical load balancer idle timeouts (60 s) to avoid races on reused connections
+keepalive = int(os.environ.get('KEEPALIVE', 75))
+
+accesslog = os.environ.get('ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.environ.get('LOG_LEVEL', 'info')
+
+
+def worker_exit(server, worker):
+    """Requests are drained by gunicorn; background batch jobs are waited for here"""
+    from app import drain
+
+    if not drain(graceful_timeout):
+        worker.log.warning("Worker %s exiting with analyses still running", worker.pid)
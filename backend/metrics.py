@@ -0,0 +1,164 @@
+"""
+Live capacity metrics for scheduling: host load, memory, loaded models, throughput and execution modes
+"""
+
+import importlib.util
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+
+class ThroughputMeter:
+    """Events per second over a sliding window (thread-safe)"""
+
+    def __init__(self, window_seconds: float = 60.0):
+        self.window = window_seconds
+        self._events = deque()
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self.total = 0
+
+    def add(self, count: int = 1):
+        now = time.time()
+        with self._lock:
+            self._events.append((now, count))
+            self.total += count
+            self._prune(now)
+
+    def _prune(self, now: float):
+        while self._events and now - self._events[0][0] > self.window:
+            self._events.popleft()
+
+    def rate(self) -> float:
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            count = sum(n for _, n in self._events)
+        # A meter younger than its window divides by its age instead
+        return count / max(min(self.window, now - self._started), 1e-3)
+
+
+class JobCounter:
+    """Jobs currently running in this process, by kind"""
+
+    def __init__(self):
+        self._active: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def start(self, kind: str):
+        with self._lock:
+            self._active[kind] = self._active.get(kind, 0) + 1
+
+    def finish(self, kind: str):
+        with self._lock:
+            self._active[kind] = max(0, self._active.get(kind, 0) - 1)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {kind: count for kind, count in self._active.items() if count}
+
+
+# Frames analysed by this process (video frames and single images)
+frames_meter = ThroughputMeter()
+
+
+def _meminfo() -> Dict[str, int]:
+    """RAM totals in bytes (psutil if installed, else /proc/meminfo)"""
+    try:
+        import psutil
+        memory = psutil.virtual_memory()
+        return {'total': memory.total, 'available': memory.available}
+    except ImportError:
+        pass
+    values = {}
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                key, value = line.split(':', 1)
+                values[key] = int(value.split()[0]) * 1024
+    except (OSError, ValueError):
+        return {}
+    return {'total': values.get('MemTotal'), 'available': values.get('MemAvailable')}
+
+
+def host_stats() -> Dict:
+    """CPU cores, load average and RAM of this node"""
+    from resources import available_cpus, process_rss_bytes
+
+    cores = len(available_cpus())
+    load = os.getloadavg() if hasattr(os, 'getloadavg') else None
+    memory = _meminfo()
+    return {
+        'cpuCores': os.cpu_count(),
+        'usableCores': cores,
+        'loadAverage': list(load) if load else None,
+        # 1-minute load per usable core: ~1.0 means the CPUs are saturated
+        'loadPerCore': load[0] / cores if load and cores else None,
+        'memoryTotalBytes': memory.get('total'),
+        'memoryAvailableBytes': memory.get('available'),
+        'processRssBytes': process_rss_bytes(),
+    }
+
+
+def gpu_stats() -> Optional[Dict]:
+    import torch
+
+    if not torch.cuda.is_available():
+        return None
+    free, total = torch.cuda.mem_get_info()
+    return {
+        'name': torch.cuda.get_device_name(0),
+        'memoryTotalBytes': total,
+        'memoryFreeBytes': free,
+        'memoryAllocatedBytes': torch.cuda.memory_allocated(),
+    }
+
+
+def execution_modes() -> Dict[str, bool]:
+    """Precision/compilation modes this node can run"""
+    import torch
+
+    cuda = torch.cuda.is_available()
+    cpu_capability = ''
+    try:
+        cpu_capability = torch.backends.cpu.get_cpu_capability()
+    except AttributeError:
+        pass
+    return {
+        'fp16': cuda,
+        # bf16 is only worth it with native support (Ampere+ GPUs, AVX512-BF16/AMX CPUs)
+        'bf16': (cuda and torch.cuda.is_bf16_supported()) or 'AVX512' in cpu_capability,
+        'int8': any(engine in ('fbgemm', 'x86', 'qnnpack', 'onednn') for engine in torch.backends.quantized.supported_engines),
+        'compile': hasattr(torch, 'compile'),
+        'onnx': importlib.util.find_spec('onnxruntime') is not None,
+    }
+
+
+def loaded_models(analyzer) -> Dict:
+    """Models held by the analyzer and their parameter memory"""
+    if analyzer is None:
+        return {}
+    from quantization import model_size_bytes
+
+    detector = analyzer.detector
+    models = {}
+    if detector is not None:
+        onnx_path = getattr(detector, 'onnx_path', None)
+        models['detection'] = {
+            'name': analyzer.detection_model_name,
+            'backend': analyzer.detector_backend,
+            'quantization': analyzer.quantization or 'none',
+            'device': str(analyzer.device),
+            'memoryBytes': model_size_bytes(detector.model) if detector.model is not None
+            else (os.path.getsize(onnx_path) if onnx_path and os.path.exists(onnx_path) else None),
+        }
+    if analyzer.weather_model is not None:
+        models['weather'] = {
+            'name': analyzer.weather_model_name,
+            'quantization': analyzer.quantization or 'none',
+            'device': str(analyzer.device),
+            'memoryBytes': model_size_bytes(analyzer.weather_model),
+        }
+    return models
@@ -0,0 +1,100 @@
+"""
+Progressive (coarse-to-fine) video analysis: pass planning and per-frame results filled in any order
+"""
+
+import math
+from typing import Dict, List, Optional, Tuple
+
+from weather import smooth_labels
+
+
+# Result fields sent with each provisional update
+PARTIAL_FIELDS = (
+    'totalFrames', 'vehicleCount', 'humanCount', 'vehicleStats', 'humanStats', 'imageQuality',
+    'avgConfidence', 'qualityScore', 'weatherDistribution', 'congestionDistribution', 'perFrameColumns',
+)
+
+
+def validate_progressive(settings: Dict):
+    """Reject settings that cannot be combined with progressive analysis"""
+    if not settings.get('progressive', False):
+        return
+    pacing = [key for key in ('deadlineSeconds', 'processingFps') if settings.get(key)]
+    if pacing:
+        raise ValueError(f"{' and '.join(pacing)} cannot be combined with progressive analysis "
+                         "(passes do not visit frames in time order)")
+
+
+def plan_passes(coarse_stride: int, upgrade: bool) -> List[Tuple[str, int, int]]:
+    """(kind, first slot, slot step) for every pass, coarse to fine
+
+    Slots are sampled-frame indices. 'preview' visits every stride-th slot (stride
+    rounded to a power of two), 'upgrade' re-runs those slots at full resolution and
+    each 'fill' pass visits the slots halfway between the ones already done, so
+    every slot is analysed exactly once at full settings.
+    """
+    stride = 1 << max(0, int(round(math.log2(max(1, coarse_stride)))))
+    passes = [('preview', 0, stride)]
+    if upgrade:
+        passes.append(('upgrade', 0, stride))
+    step = stride
+    while step > 1:
+        passes.append(('fill', step // 2, step))
+        step //= 2
+    return passes
+
+
+class FrameSlots:
+    """Per-frame results keyed by slot (the n-th sampled frame), filled in any order
+
+    Each slot holds plain values (counts, confidence, quality, timestamp, weather
+    label, tracked Detections, frame image); series() returns them in slot order.
+    """
+
+    def __init__(self, expected: int):
+        self.expected = max(1, expected)
+        self.frames: Dict[int, Dict] = {}
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def put(self, slot: int, **values):
+        self.frames.setdefault(slot, {}).update(values)
+
+    @property
+    def coverage(self) -> float:
+        return min(1.0, len(self.frames) / self.expected)
+
+    def ordered(self) -> List[int]:
+        return sorted(self.frames)
+
+    def series(self, key: str, default=None) -> List:
+        return [self.frames[slot].get(key, default) for slot in self.ordered()]
+
+    def weather_samples(self) -> List[str]:
+        """Raw labels of the slots that were weather-sampled, in slot order"""
+        return [self.frames[slot]['weather'] for slot in self.ordered() if self.frames[slot].get('weather')]
+
+    def weather_labels(self, smoothing_window: int = 1, min_dwell: int = 1) -> List[str]:
+        """Smoothed label of the latest weather sample at or before every slot"""
+        slots = self.ordered()
+        sampled = [slot for slot in slots if self.frames[slot].get('weather')]
+        if not sampled:
+            return ['Clear'] * len(slots)
+        smoothed = dict(zip(sampled, smooth_labels([self.frames[slot]['weather'] for slot in sampled], smoothing_window, min_dwell)))
+        # Slots before the first sample take its label
+        labels, current = [], smoothed[sampled[0]]
+        for slot in slots:
+            current = smoothed.get(slot, current)
+            labels.append(current)
+        return labels
+
+    def replay_tracker(self, tracker) -> Optional[Dict]:
+        """Feed the stored tracked detections to the tracker in time order and return its summary"""
+        if tracker is None:
+            return None
+        for slot in self.ordered():
+            frame = self.frames[slot]
+            tracked = frame['tracked']
+            tracker.update(tracked.boxes, tracked.labels(), tracked.category_names(), tracked.scores, frame['timestamp'])
+        return tracker.summary()
@@ -0,0 +1,217 @@
+"""
+Dynamic int8 quantization for CPU deployments, with an on-disk cache and an fp32 accuracy report
+"""
+
+import json
+import os
+import re
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import torch
+
+from tracking import iou_matrix
+
+
+# Quantized state dicts (tensors only, loaded with weights_only=True) are cached here,
+# keyed by model name, torch version and model revision
+QUANT_CACHE_DIR = Path(os.environ.get('QUANT_CACHE_DIR', './model_cache'))
+
+SUPPORTED_MODES = ('int8',)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def quantization_from_settings(settings: Dict) -> Optional[str]:
+    """Quantization mode requested by settings, else the node default (QUANTIZATION)"""
+    mode = settings.get('quantization') or os.environ.get('QUANTIZATION') or None
+    if mode in (None, 'none', 'fp32'):
+        return None
+    if mode not in SUPPORTED_MODES:
+        raise ValueError(f"Unsupported quantization mode: {mode}")
+    return mode
+
+
+def quantize_dynamic_int8(model: torch.nn.Module) -> torch.nn.Module:
+    """Replace every nn.Linear with a dynamically quantized int8 version (CPU only)"""
+    model = model.to('cpu').eval()
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def model_revision(model: torch.nn.Module) -> Optional[str]:
+    """Hub commit the weights were loaded from (transformers models), else None"""
+    return getattr(getattr(model, 'config', None), '_commit_hash', None)
+
+
+def _cache_path(model_name: str, mode: str, revision: Optional[str]) -> Path:
+    """A state dict only fits the architecture and weights it came from: key on torch version and revision"""
+    key = f'{model_name}.{mode}.torch{torch.__version__}.{revision or "unversioned"}.pt'
+    return QUANT_CACHE_DIR / re.sub(r'[^A-Za-z0-9_.-]', '_', key)
+
+
+def load_quantized(model_name: str, load_fp32: Callable[[], torch.nn.Module], mode: str = 'int8') -> torch.nn.Module:
+    """Quantize the fp32 model, using the cached quantized weights when present
+
+    Only state_dict() is cached and it is read with weights_only=True, so a file
+    planted in the (possibly shared) cache directory cannot run code; the
+    architecture always comes from load_fp32().
+    """
+    if mode not in SUPPORTED_MODES:
+        raise ValueError(f"Unsupported quantization mode: {mode}")
+
+    start_time = time.time()
+    fp32 = load_fp32()
+    cache_path = _cache_path(model_name, mode, model_revision(fp32))
+    model = quantize_dynamic_int8(fp32)
+    if cache_path.exists():
+        try:
+            model.load_state_dict(torch.load(cache_path, map_location='cpu', weights_only=True))
+            print(f"[Quantization] Loaded cached {mode} weights: {cache_path}")
+            return model.eval()
+        except Exception as e:
+            print(f"[Quantization] Ignoring unreadable cache {cache_path}: {e}")
+            # A failed load may have left some layers overwritten
+            model = quantize_dynamic_int8(load_fp32())
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_suffix(f'.{os.getpid()}.tmp')
+    torch.save(model.state_dict(), tmp_path)
+    os.replace(tmp_path, cache_path)
+    print(f"[Quantization] Built {mode} model for {model_name} in {time.time() - start_time:.1f}s, cached weights at {cache_path}")
+    return model.eval()
+
+
+def model_size_bytes(model: torch.nn.Module) -> int:
+    """Bytes held by a model's parameters and buffers (including packed quantized weights)"""
+    total = sum(t.numel() * t.element_size() for t in model.parameters())
+    total += sum(t.numel() * t.element_size() for t in model.buffers())
+    # Dynamic quantized Linear keeps its int8 weights in packed params, not parameters()
+    for module in model.modules():
+        packed = getattr(module, '_packed_params', None)
+        if packed is not None and hasattr(packed, '_weight_bias'):
+            weight, bias = packed._weight_bias()
+            total += weight.numel() * weight.element_size()
+            if bias is not None:
+                total += bias.numel() * bias.element_size()
+    return total
+
+
+def _collect_images(paths: List[str]) -> List[Path]:
+    images = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            images.extend(sorted(p for p in path.rglob('*') if p.suffix.lower() in IMAGE_EXTENSIONS))
+        elif path.suffix.lower() in IMAGE_EXTENSIONS:
+            images.append(path)
+    return images
+
+
+def _match_detections(reference, candidate, iou_threshold: float = 0.5) -> int:
+    """Greedy one-to-one matches between two Detections with the same label and IoU >= threshold"""
+    if not len(reference) or not len(candidate):
+        return 0
+    iou = iou_matrix(reference.boxes.astype(np.float64), candidate.boxes.astype(np.float64))
+    same_label = reference.label_ids[:, None] == candidate.label_ids[None, :]
+    iou = np.where(same_label, iou, 0.0)
+    matched = 0
+    while iou.size and iou.max() >= iou_threshold:
+        r, c = np.unravel_index(np.argmax(iou), iou.shape)
+        iou[r, :] = 0.0
+        iou[:, c] = 0.0
+        matched += 1
+    return matched
+
+
+def accuracy_report(settings: Dict, image_paths: List[str]) -> Dict:
+    """Run fp32 and int8 analyzers over reference images and compare detections and weather labels"""
+    from PIL import Image
+    from analysis import VideoAnalyzer
+
+    images = _collect_images(image_paths)
+    if not images:
+        raise ValueError("No reference images found")
+
+    fp32 = VideoAnalyzer.from_settings({**settings, 'quantization': 'none'})
+    int8 = VideoAnalyzer.from_settings({**settings, 'quantization': 'int8'})
+
+    totals = {'reference': 0, 'candidate': 0, 'matched': 0, 'weatherAgree': 0}
+    latency = {'fp32': [], 'int8': []}
+    count_errors = {'vehicle': [], 'person': []}
+    per_image = []
+
+    for path in images:
+        image = Image.open(path).convert('RGB')
+        outputs = {}
+        for name, analyzer in (('fp32', fp32), ('int8', int8)):
+            start = time.perf_counter()
+            detections = analyzer._detect_objects(image, settings)
+            weather = analyzer._analyze_weather(image, settings)
+            latency[name].append(time.perf_counter() - start)
+            outputs[name] = (detections, weather)
+
+        (ref, ref_weather), (cand, cand_weather) = outputs['fp32'], outputs['int8']
+        matched = _match_detections(ref, cand)
+        totals['reference'] += len(ref)
+        totals['candidate'] += len(cand)
+        totals['matched'] += matched
+        totals['weatherAgree'] += int(ref_weather == cand_weather)
+        count_errors['vehicle'].append(abs(ref.vehicle_count - cand.vehicle_count))
+        count_errors['person'].append(abs(ref.person_count - cand.person_count))
+        per_image.append({
+            'image': str(path),
+            'fp32Detections': len(ref),
+            'int8Detections': len(cand),
+            'matched': matched,
+            'fp32Weather': ref_weather,
+            'int8Weather': cand_weather,
+        })
+
+    fp32_latency = float(np.mean(latency['fp32']))
+    int8_latency = float(np.mean(latency['int8']))
+    return {
+        'images': len(images),
+        'detection': {
+            # fp32 is the reference: recall = fp32 boxes reproduced, precision = int8 boxes confirmed
+            'recall': totals['matched'] / totals['reference'] if totals['reference'] else 1.0,
+            'precision': totals['matched'] / totals['candidate'] if totals['candidate'] else 1.0,
+            'meanVehicleCountError': float(np.mean(count_errors['vehicle'])),
+            'meanPersonCountError': float(np.mean(count_errors['person'])),
+        },
+        'weatherAgreement': totals['weatherAgree'] / len(images),
+        'latencySeconds': {'fp32': fp32_latency, 'int8': int8_latency},
+        'speedup': fp32_latency / int8_latency if int8_latency > 0 else None,
+        'modelBytes': {
+            'fp32': model_size_bytes(fp32.detection_model) if fp32.detection_model is not None else None,
+            'int8': model_size_bytes(int8.detection_model) if int8.detection_model is not None else None,
+        },
+        'perImage': per_image,
+    }
+
+
+def _run_report_command(args) -> int:
+    """Handler for `python -m analysis quant-report`"""
+    settings = json.loads(args.settings) if args.settings else {}
+    if args.detection_model:
+        settings['detectionModel'] = args.detection_model
+    if args.weather_model:
+        settings['weatherModel'] = args.weather_model
+
+    report = accuracy_report(settings, args.images)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f"[Quantization] Wrote {args.output}")
+
+    print(json.dumps({k: v for k, v in report.items() if k != 'perImage'}, indent=2))
+    return 0
+
+
+def add_report_arguments(parser):
+    """Register the `quant-report` subcommand arguments"""
+    parser.add_argument('images', nargs='+', help='Reference images or directories of images')
+    parser.add_argument('-o', '--output', help='Write the full report (including per-image rows) to this JSON file')
+    parser.add_argument('--settings', help='JSON analysis settings (e.g. confidenceThreshold)')
+    parser.add_argument('--detection-model', help='Detection model name (default: facebook/detr-resnet-50)')
+    parser.add_argument('--weather-model', help='Optional weather classification model name')
+    parser.set_defaults(handler=_run_report_command)
@@ -0,0 +1,140 @@
+"""
+Regions of interest and tiling for detection on high-resolution frames
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+# Fraction of the frame height treated as sky (shared with the image-based weather heuristic)
+SKY_FRACTION = 0.3
+
+# Named ROI presets, as [x1, y1, x2, y2] fractions of the frame
+ROI_PRESETS = {
+    'full': [[0.0, 0.0, 1.0, 1.0]],
+    'road': [[0.0, SKY_FRACTION, 1.0, 1.0]],
+}
+
+Rect = Tuple[int, int, int, int]
+
+# Stand-in frame size for checking an ROI's syntax before the real frame size is known
+_ANY_FRAME = 1 << 16
+
+
+def _clip_rect(x1: float, y1: float, x2: float, y2: float, width: int, height: int) -> Optional[Rect]:
+    x1, x2 = sorted((int(round(x1)), int(round(x2))))
+    y1, y2 = sorted((int(round(y1)), int(round(y2))))
+    x1, y1 = max(0, x1), max(0, y1)
+    x2, y2 = min(width, x2), min(height, y2)
+    if x2 - x1 < 2 or y2 - y1 < 2:
+        return None
+    return x1, y1, x2, y2
+
+
+def parse_roi(roi, width: int, height: int) -> Tuple[List[Rect], List[np.ndarray]]:
+    """Turn the 'roi' setting into pixel crop rectangles plus optional polygons
+
+    'roi' may be a preset name ('road', 'full') or a list whose entries are either
+    rectangles [x1, y1, x2, y2] or polygons [[x, y], ...]. Units are decided per
+    entry: if every value is within [0, 1] the entry is in fractions of the frame,
+    otherwise all of its values are pixels. Polygons are cropped to their bounding
+    box and detections whose centre falls outside every polygon are dropped.
+    """
+    if not roi:
+        return [(0, 0, width, height)], []
+    entries = ROI_PRESETS.get(roi) if isinstance(roi, str) else roi
+    if entries is None:
+        raise ValueError(f"Unknown ROI preset: {roi}")
+
+    if not isinstance(entries, (list, tuple)):
+        raise ValueError(f"Invalid ROI: {roi!r}")
+
+    rects, polygons = [], []
+    for entry in entries:
+        if not isinstance(entry, (list, tuple)):
+            raise ValueError(f"Invalid ROI entry: {entry!r}")
+        is_rect = len(entry) == 4 and all(isinstance(v, (int, float)) for v in entry)
+        try:
+            points = np.array([entry[0:2], entry[2:4]] if is_rect else entry, dtype=np.float32).reshape(-1, 2)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid ROI entry: {entry!r}")
+        if not is_rect and len(points) < 3:
+            raise ValueError(f"ROI polygon needs at least 3 points: {entry!r}")
+        if np.all((points >= 0.0) & (points <= 1.0)):
+            points = points * np.array([width, height], dtype=np.float32)
+        if is_rect:
+            rect = _clip_rect(points[0, 0], points[0, 1], points[1, 0], points[1, 1], width, height)
+        else:
+            polygons.append(points)
+            rect = _clip_rect(points[:, 0].min(), points[:, 1].min(), points[:, 0].max(), points[:, 1].max(), width, height)
+        if rect is not None:
+            rects.append(rect)
+
+    if not rects:
+        raise ValueError("ROI does not overlap the frame")
+    return rects, polygons
+
+
+def make_tiles(rect: Rect, tile_size: int, overlap: float) -> List[Rect]:
+    """Cover rect with tile_size squares overlapping by the given fraction"""
+    x1, y1, x2, y2 = rect
+    tile_size = max(32, int(tile_size))
+    stride = max(1, int(tile_size * (1.0 - overlap)))
+
+    def starts(lo: int, hi: int) -> List[int]:
+        if hi - lo <= tile_size:
+            return [lo]
+        positions = list(range(lo, hi - tile_size, stride))
+        positions.append(hi - tile_size)  # last tile flush with the edge
+        return positions
+
+    return [
+        (x, y, min(x + tile_size, x2), min(y + tile_size, y2))
+        for y in starts(y1, y2)
+        for x in starts(x1, x2)
+    ]
+
+
+def inference_regions(settings: Dict, width: int, height: int) -> Tuple[List[Rect], List[np.ndarray]]:
+    """Crops to run detection on (ROI, optionally tiled) and polygons to filter by"""
+    rects, polygons = parse_roi(settings.get('roi'), width, height)
+    if settings.get('tiledInference', False):
+        tile_size = int(settings.get('tileSize', 640))
+        overlap = float(settings.get('tileOverlap', 0.2))
+        rects = [tile for rect in rects for tile in make_tiles(rect, tile_size, overlap)]
+    return rects, polygons
+
+
+def validate_regions(settings: Dict, width: Optional[int] = None, height: Optional[int] = None):
+    """Raise ValueError for an unusable roi / tiling setting, once before any frame is analysed
+
+    Without a frame size only the syntax is checked; with one, an ROI that does not
+    overlap the frame is rejected too.
+    """
+    if settings.get('tiledInference', False):
+        try:
+            tile_size = int(settings.get('tileSize', 640))
+            overlap = float(settings.get('tileOverlap', 0.2))
+        except (TypeError, ValueError):
+            raise ValueError("tileSize and tileOverlap must be numbers")
+        if tile_size <= 0 or not 0.0 <= overlap < 1.0:
+            raise ValueError("tileSize must be positive and tileOverlap in [0, 1)")
+    if width and height:
+        inference_regions(settings, width, height)
+    else:
+        parse_roi(settings.get('roi'), _ANY_FRAME, _ANY_FRAME)
+
+
+def inside_polygons(boxes: np.ndarray, polygons: List[np.ndarray]) -> np.ndarray:
+    """Boolean mask of boxes whose centre lies inside any polygon"""
+    import cv2
+
+    if not polygons or len(boxes) == 0:
+        return np.ones(len(boxes), dtype=bool)
+    centres = (boxes[:, :2] + boxes[:, 2:]) / 2
+    keep = np.zeros(len(boxes), dtype=bool)
+    for polygon in polygons:
+        contour = polygon.reshape(-1, 1, 2)
+        keep |= np.array([cv2.pointPolygonTest(contour, (float(x), float(y)), False) >= 0 for x, y in centres])
+    return keep
@@ -0,0 +1,208 @@
+"""
+CPU thread, affinity and memory controls for inference processes
+"""
+
+import os
+from typing import Callable, Dict, List, Optional
+
+
+def parse_cpu_list(spec: str) -> List[int]:
+    """'0-3,8,10-11' -> [0, 1, 2, 3, 8, 10, 11]"""
+    cpus = set()
+    for part in spec.replace(' ', '').split(','):
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-', 1)
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def available_cpus() -> List[int]:
+    """CPUs this process may run on (its affinity mask where the platform has one)"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _optional_int(value) -> Optional[int]:
+    return int(value) if value not in (None, '') else None
+
+
+def process_rss_bytes() -> Optional[int]:
+    """Resident set size of this process (psutil if installed, else /proc)"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MemoryLimitExceeded(MemoryError):
+    """A job grew the process beyond its memory budget"""
+
+
+class MemoryGuard:
+    """Soft per-job memory cap: process RSS growth since the job started, checked on progress
+
+    Jobs share one process in the server, so growth from concurrent jobs counts
+    against each of them; the cap is a safety net against runaway jobs rather than
+    exact accounting.
+    """
+
+    def __init__(self, limit_bytes: Optional[int]):
+        self.limit_bytes = limit_bytes
+        self.baseline = process_rss_bytes() if limit_bytes else None
+        self.peak_growth = 0
+
+    def check(self):
+        if not self.limit_bytes or self.baseline is None:
+            return
+        rss = process_rss_bytes()
+        if rss is None:
+            return
+        growth = rss - self.baseline
+        self.peak_growth = max(self.peak_growth, growth)
+        if growth > self.limit_bytes:
+            raise MemoryLimitExceeded(
+                f"Job exceeded its memory limit ({growth / 1024 ** 2:.0f} MB > {self.limit_bytes / 1024 ** 2:.0f} MB)"
+            )
+
+    def wrap(self, progress_callback: Optional[Callable]) -> Optional[Callable]:
+        """Progress callback that checks the cap before forwarding"""
+        if not self.limit_bytes:
+            return progress_callback
+
+        def guarded(progress, step):
+            self.check()
+            if progress_callback:
+                progress_callback(progress, step)
+        return guarded
+
+
+class ResourceConfig:
+    """Thread pool sizes, CPU affinity and per-job memory cap for one process
+
+    Unset values leave the library defaults alone. Configure per node with:
+    TORCH_NUM_THREADS, TORCH_INTEROP_THREADS, CV2_NUM_THREADS, BLAS_NUM_THREADS,
+    CPU_AFFINITY (e.g. '0-15'), PIN_WORKERS and JOB_MEMORY_LIMIT_MB.
+    """
+
+    def __init__(
+        self,
+        torch_threads: Optional[int] = None,
+        interop_threads: Optional[int] = None,
+        cv2_threads: Optional[int] = None,
+        blas_threads: Optional[int] = None,
+        cpus: Optional[List[int]] = None,
+        pin_workers: bool = False,
+        job_memory_mb: Optional[int] = None
+    ):
+        self.torch_threads = torch_threads
+        self.interop_threads = interop_threads
+        self.cv2_threads = cv2_threads
+        self.blas_threads = blas_threads
+        self.cpus = cpus
+        self.pin_workers = pin_workers
+        self.job_memory_mb = job_memory_mb
+
+    @classmethod
+    def from_env(cls) -> 'ResourceConfig':
+        affinity = os.environ.get('CPU_AFFINITY')
+        return cls(
+            torch_threads=_optional_int(os.environ.get('TORCH_NUM_THREADS')),
+            interop_threads=_optional_int(os.environ.get('TORCH_INTEROP_THREADS')),
+            cv2_threads=_optional_int(os.environ.get('CV2_NUM_THREADS')),
+            blas_threads=_optional_int(os.environ.get('BLAS_NUM_THREADS')),
+            cpus=parse_cpu_list(affinity) if affinity else None,
+            pin_workers=os.environ.get('PIN_WORKERS', '0').lower() in ('1', 'true', 'yes'),
+            job_memory_mb=_optional_int(os.environ.get('JOB_MEMORY_LIMIT_MB')),
+        )
+
+    def for_worker(self, index: int, workers: int) -> 'ResourceConfig':
+        """Share of this configuration for worker `index` of `workers` processes
+
+        With pin_workers each worker gets a contiguous slice of the CPUs; threads
+        default to the worker's share of the CPUs so workers do not oversubscribe.
+        """
+        cpus = self.cpus or available_cpus()
+        share = max(1, len(cpus) // max(1, workers))
+        worker_cpus = None
+        if self.pin_workers and len(cpus) >= workers:
+            start = (index % workers) * share
+            worker_cpus = cpus[start:start + share]
+        elif self.cpus:
+            worker_cpus = self.cpus
+        return ResourceConfig(
+            torch_threads=self.torch_threads or share,
+            interop_threads=self.interop_threads,
+            cv2_threads=self.cv2_threads or share,
+            blas_threads=self.blas_threads,
+            cpus=worker_cpus,
+            pin_workers=False,
+            job_memory_mb=self.job_memory_mb,
+        )
+
+    def apply(self) -> Dict:
+        """Apply to the current process and return the effective configuration"""
+        import torch
+
+        if self.cpus and hasattr(os, 'sched_setaffinity'):
+            try:
+                os.sched_setaffinity(0, self.cpus)
+            except OSError as e:
+                print(f"[Resources] Could not set CPU affinity {self.cpus}: {e}")
+        if self.torch_threads:
+            torch.set_num_threads(self.torch_threads)
+        elif self.cpus:
+            torch.set_num_threads(len(self.cpus))
+        if self.interop_threads:
+            try:
+                torch.set_num_interop_threads(self.interop_threads)
+            except RuntimeError as e:
+                # Only allowed before the first inter-op parallel work in the process
+                print(f"[Resources] Could not set inter-op threads: {e}")
+        if self.cv2_threads is not None:
+            import cv2
+            cv2.setNumThreads(self.cv2_threads)
+        if self.blas_threads:
+            try:
+                from threadpoolctl import threadpool_limits
+                threadpool_limits(limits=self.blas_threads)
+            except ImportError:
+                print("[Resources] BLAS_NUM_THREADS needs threadpoolctl (pip install threadpoolctl); set OMP_NUM_THREADS instead")
+        return self.effective()
+
+    def effective(self) -> Dict:
+        """Thread counts and affinity actually in effect in this process"""
+        import torch
+
+        try:
+            import cv2
+            cv2_threads = cv2.getNumThreads()
+        except ImportError:
+            cv2_threads = None
+        cpus = available_cpus()
+        return {
+            'cpuCount': os.cpu_count(),
+            'affinity': cpus,
+            'affinityCount': len(cpus),
+            'torchThreads': torch.get_num_threads(),
+            'torchInteropThreads': torch.get_num_interop_threads(),
+            'cv2Threads': cv2_threads,
+            'blasThreads': self.blas_threads,
+            'ompNumThreads': os.environ.get('OMP_NUM_THREADS'),
+            'pinWorkers': self.pin_workers,
+            'jobMemoryLimitMB': self.job_memory_mb,
+        }
+
+    def memory_guard(self) -> MemoryGuard:
+        """A fresh guard for one job (no-op when no limit is configured)"""
+        return MemoryGuard(self.job_memory_mb * 1024 ** 2 if self.job_memory_mb else None)
@@ -0,0 +1,379 @@
+"""
+Output directory retention: age/size quota, LRU eviction and disk-usage accounting
+"""
+
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+# Marker files kept inside each job directory
+ACCESS_MARKER = '.last_access'
+KEEP_MARKER = '.keep'
+
+# Pin marker (.pin-<host>-<pid>) a process keeps in a job directory while it uses it, so the
+# sweeper in another server or worker process sharing the output root sees the pin too
+PIN_PREFIX = '.pin-'
+
+# Job directories are renamed to .deleting-<name>-<id> in root before they are removed
+TOMBSTONE_PREFIX = '.deleting-'
+
+# Lock file in the retention root held by the process that runs the sweeper
+SWEEPER_LOCK = '.sweeper.lock'
+
+# Partial uploads older than this are leftovers from crashed or aborted requests
+STALE_UPLOAD_SECONDS = 6 * 3600
+
+
+def _process_alive(pid: int) -> bool:
+    if os.name == 'nt':
+        return True  # No cheap liveness check; keep the pin
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class OutputRetention:
+    """Keep OUTPUT_DIR bounded by deleting least recently used job directories"""
+
+    def __init__(
+        self,
+        root: Path,
+        max_age_seconds: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        sweep_interval: float = 300.0,
+        grace_seconds: float = 60.0
+    ):
+        self.root = Path(root)
+        self.max_age_seconds = max_age_seconds
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.grace_seconds = grace_seconds
+
+        self._lock = threading.Lock()
+        self._pins: Dict[str, int] = {}
+        self._usage_cache: Dict[str, tuple] = {}
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._lock_file = None
+
+    @classmethod
+    def from_env(cls, root: Path) -> 'OutputRetention':
+        """Build retention policy from OUTPUT_* environment variables"""
+        max_age_hours = float(os.environ.get('OUTPUT_MAX_AGE_HOURS', '48'))
+        max_gb = float(os.environ.get('OUTPUT_MAX_GB', '10'))
+        return cls(
+            root,
+            max_age_seconds=max_age_hours * 3600 if max_age_hours > 0 else None,
+            max_bytes=int(max_gb * 1024 ** 3) if max_gb > 0 else None,
+            sweep_interval=float(os.environ.get('OUTPUT_SWEEP_INTERVAL', '300')),
+        )
+
+    # ------------------------------------------------------------------
+    # Job bookkeeping
+    # ------------------------------------------------------------------
+
+    def touch(self, job_dir: Path):
+        """Record an access to a job directory (used for LRU ordering)"""
+        marker = Path(job_dir) / ACCESS_MARKER
+        try:
+            marker.touch(exist_ok=True)
+            now = time.time()
+            os.utime(marker, (now, now))
+        except OSError:
+            pass
+
+    @staticmethod
+    def _pin_marker(job_dir: Path) -> Path:
+        return Path(job_dir) / f'{PIN_PREFIX}{socket.gethostname()}-{os.getpid()}'
+
+    def pin(self, job_dir: Path):
+        """Protect a job directory from deletion while it is in use (by any process sharing root)"""
+        name = Path(job_dir).name
+        with self._lock:
+            count = self._pins.get(name, 0) + 1
+            self._pins[name] = count
+            if count == 1:
+                try:
+                    self._pin_marker(job_dir).touch(exist_ok=True)
+                except OSError:
+                    pass
+        self.touch(job_dir)
+
+    def unpin(self, job_dir: Path):
+        """Release a pin taken with pin()"""
+        name = Path(job_dir).name
+        with self._lock:
+            count = self._pins.get(name, 0) - 1
+            if count > 0:
+                self._pins[name] = count
+            else:
+                self._pins.pop(name, None)
+                try:
+                    self._pin_marker(job_dir).unlink()
+                except OSError:
+                    pass
+        self.touch(job_dir)
+
+    def is_pinned(self, job_dir: Path) -> bool:
+        """Check whether a job directory is currently in use by this or another process"""
+        with self._lock:
+            if Path(job_dir).name in self._pins:
+                return True
+        return self._pinned_elsewhere(job_dir)
+
+    def _pinned_elsewhere(self, job_dir: Path) -> bool:
+        """Live pin markers of other processes; markers of dead local processes are removed"""
+        host = socket.gethostname()
+        try:
+            markers = list(Path(job_dir).glob(f'{PIN_PREFIX}*'))
+        except OSError:
+            return False
+        for marker in markers:
+            owner, _, pid = marker.name[len(PIN_PREFIX):].rpartition('-')
+            # Pins from other hosts sharing the storage cannot be checked, so they are honoured
+            if owner != host or not pid.isdigit():
+                return True
+            if int(pid) != os.getpid() and _process_alive(int(pid)):
+                return True
+            # Left behind by a process that exited without unpinning (or by this one, which holds no pin)
+            try:
+                marker.unlink()
+            except OSError:
+                pass
+        return False
+
+    def protect(self, job_dir: Path):
+        """Exempt a job directory from eviction (e.g. cached results)"""
+        (Path(job_dir) / KEEP_MARKER).touch(exist_ok=True)
+
+    def unprotect(self, job_dir: Path):
+        """Make a protected job directory eligible for eviction again"""
+        try:
+            (Path(job_dir) / KEEP_MARKER).unlink()
+        except FileNotFoundError:
+            pass
+
+    def is_protected(self, job_dir: Path) -> bool:
+        """Check whether a job directory carries the keep marker"""
+        return (Path(job_dir) / KEEP_MARKER).exists()
+
+    def last_access(self, job_dir: Path) -> float:
+        """Last recorded access time, falling back to the directory mtime"""
+        job_dir = Path(job_dir)
+        try:
+            return (job_dir / ACCESS_MARKER).stat().st_mtime
+        except OSError:
+            pass
+        try:
+            return job_dir.stat().st_mtime
+        except OSError:
+            return 0.0
+
+    # ------------------------------------------------------------------
+    # Disk usage accounting
+    # ------------------------------------------------------------------
+
+    def job_usage(self, job_dir: Path) -> Dict:
+        """Return bytes and file count used by a single job directory"""
+        job_dir = Path(job_dir)
+        total_bytes = 0
+        file_count = 0
+        for dirpath, _, filenames in os.walk(job_dir):
+            for filename in filenames:
+                try:
+                    st = os.stat(os.path.join(dirpath, filename))
+                except OSError:
+                    continue
+                # Count allocated blocks where available (Windows has no st_blocks)
+                blocks = getattr(st, 'st_blocks', None)
+                total_bytes += blocks * 512 if blocks is not None else st.st_size
+                file_count += 1
+        return {'bytes': total_bytes, 'files': file_count}
+
+    def _cached_usage(self, job_dir: Path) -> Dict:
+        """Job usage, recomputed only when the directory or its access marker changed"""
+        try:
+            stamp = (job_dir.stat().st_mtime, self.last_access(job_dir))
+        except OSError:
+            return {'bytes': 0, 'files': 0}
+        cached = self._usage_cache.get(job_dir.name)
+        # Pinned jobs are still being written, so never trust the cache for them
+        if cached and cached[0] == stamp and not self.is_pinned(job_dir):
+            return cached[1]
+        usage = self.job_usage(job_dir)
+        self._usage_cache[job_dir.name] = (stamp, usage)
+        return usage
+
+    def list_jobs(self) -> List[Path]:
+        """List job directories under the output root"""
+        if not self.root.exists():
+            return []
+        return [p for p in self.root.iterdir() if p.is_dir() and not p.name.startswith('.')]
+
+    def usage_report(self) -> Dict:
+        """Per-job and total disk usage for the output root"""
+        jobs = []
+        total_bytes = 0
+        for job_dir in self.list_jobs():
+            usage = self._cached_usage(job_dir)
+            total_bytes += usage['bytes']
+            jobs.append({
+                'jobId': job_dir.name,
+                'bytes': usage['bytes'],
+                'files': usage['files'],
+                'lastAccess': self.last_access(job_dir),
+                'pinned': self.is_pinned(job_dir),
+                'protected': self.is_protected(job_dir),
+            })
+        jobs.sort(key=lambda j: j['lastAccess'], reverse=True)
+        return {
+            'root': str(self.root),
+            'totalBytes': total_bytes,
+            'maxBytes': self.max_bytes,
+            'maxAgeSeconds': self.max_age_seconds,
+            'jobs': jobs,
+        }
+
+    # ------------------------------------------------------------------
+    # Eviction
+    # ------------------------------------------------------------------
+
+    def _evictable(self, job_dir: Path, now: float) -> bool:
+        """A job may be deleted if it is not pinned, protected or brand new"""
+        if self.is_pinned(job_dir) or self.is_protected(job_dir):
+            return False
+        return now - self.last_access(job_dir) >= self.grace_seconds
+
+    def _delete(self, job_dir: Path) -> bool:
+        """Remove a job directory, re-checking local and cross-process pins under the lock
+
+        The directory is renamed to a tombstone while the lock is held, so a pin()
+        that follows finds no directory instead of one that is half deleted.
+        """
+        tombstone = self.root / f'{TOMBSTONE_PREFIX}{job_dir.name}-{uuid.uuid4().hex[:8]}'
+        with self._lock:
+            if job_dir.name in self._pins or self._pinned_elsewhere(job_dir):
+                return False
+            try:
+                os.rename(job_dir, tombstone)
+            except OSError:
+                return False
+            # Another process pinned it between the check and the rename
+            if self._pinned_elsewhere(tombstone):
+                os.rename(tombstone, job_dir)
+                return False
+        self._usage_cache.pop(job_dir.name, None)
+        shutil.rmtree(tombstone, ignore_errors=True)
+        return True
+
+    def sweep(self) -> List[str]:
+        """Delete expired jobs, then LRU jobs until the size quota is met"""
+        now = time.time()
+        removed = []
+        entries = []
+        total_bytes = 0
+
+        for job_dir in self.list_jobs():
+            usage = self._cached_usage(job_dir)
+            total_bytes += usage['bytes']
+            entries.append((self.last_access(job_dir), job_dir, usage['bytes']))
+
+        # Oldest access first
+        entries.sort(key=lambda e: e[0])
+
+        remaining = []
+        for accessed, job_dir, size in entries:
+            expired = self.max_age_seconds is not None and now - accessed > self.max_age_seconds
+            if expired and self._evictable(job_dir, now) and self._delete(job_dir):
+                removed.append(job_dir.name)
+                total_bytes -= size
+            else:
+                remaining.append((accessed, job_dir, size))
+
+        if self.max_bytes is not None:
+            for accessed, job_dir, size in remaining:
+                if total_bytes <= self.max_bytes:
+                    break
+                if self._evictable(job_dir, now) and self._delete(job_dir):
+                    removed.append(job_dir.name)
+                    total_bytes -= size
+
+        self._sweep_stale_uploads(now)
+
+        if removed:
+            print(f"[Retention] Removed {len(removed)} job directories, {total_bytes / 1024 / 1024:.1f} MB remaining")
+        return removed
+
+    def _sweep_stale_uploads(self, now: float):
+        """Remove orphaned *.part spool files and tombstones left by interrupted deletes"""
+        if not self.root.exists():
+            return
+        for hidden in self.root.iterdir():
+            if not hidden.is_dir() or not hidden.name.startswith('.'):
+                continue
+            if hidden.name.startswith(TOMBSTONE_PREFIX):
+                shutil.rmtree(hidden, ignore_errors=True)
+                continue
+            for part in hidden.glob('*.part'):
+                try:
+                    if now - part.stat().st_mtime > STALE_UPLOAD_SECONDS:
+                        part.unlink()
+                except OSError:
+                    continue
+
+    def _run(self):
+        """Sweeper thread body"""
+        while not self._stop_event.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"[Retention] Sweep failed: {e}")
+
+    def start(self, exclusive: bool = False):
+        """Start the background sweeper thread
+
+        With exclusive=True only the first process to take SWEEPER_LOCK in root
+        starts a sweeper; it still honours the pin markers of every other process.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        if self.max_age_seconds is None and self.max_bytes is None:
+            return
+        if exclusive and not self._acquire_sweeper_lock():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='output-retention', daemon=True)
+        self._thread.start()
+
+    def _acquire_sweeper_lock(self) -> bool:
+        try:
+            import fcntl
+        except ImportError:
+            return True  # No flock (Windows): every process sweeps
+        self.root.mkdir(parents=True, exist_ok=True)
+        lock_file = open(self.root / SWEEPER_LOCK, 'a')
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        # Held (and released by the OS) for the lifetime of the process
+        self._lock_file = lock_file
+        return True
+
+    def stop(self):
+        """Stop the background sweeper thread"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+            self._thread = None
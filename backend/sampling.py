@@ -0,0 +1,91 @@
+"""
+Adaptive frame sampling: skip inference on frames that barely differ from the last inferred one
+"""
+
+from typing import Dict
+
+import cv2
+import numpy as np
+
+
+class FrameChangeDetector:
+    """Cheap frame signatures used to decide when a frame needs fresh inference
+
+    'diff' compares a downscaled grayscale thumbnail (mean absolute difference, 0-1),
+    'hash' compares 64-bit difference hashes (Hamming distance in bits). Frames are
+    compared against the last *inferred* frame, so slow drift still triggers a refresh.
+    """
+
+    DEFAULT_THRESHOLDS = {'diff': 0.02, 'hash': 4}
+
+    def __init__(self, method: str = 'diff', threshold: float = None, max_reuse: int = 30, thumb_size: int = 64):
+        if method not in self.DEFAULT_THRESHOLDS:
+            raise ValueError(f"Unknown scene change method: {method}")
+        self.method = method
+        self.threshold = threshold if threshold is not None else self.DEFAULT_THRESHOLDS[method]
+        self.max_reuse = max_reuse
+        self.thumb_size = thumb_size
+
+        self._reference = None
+        self._reuse_run = 0
+        self.inferred = 0
+        self.reused = 0
+
+    @classmethod
+    def from_settings(cls, settings: Dict) -> 'FrameChangeDetector':
+        return cls(
+            method=settings.get('sceneChangeMethod', 'diff'),
+            threshold=settings.get('sceneChangeThreshold'),
+            max_reuse=int(settings.get('maxReusedFrames', 30)),
+        )
+
+    def signature(self, frame_rgb: np.ndarray) -> np.ndarray:
+        """Downscale first, then convert: the colour conversion runs on a thumbnail"""
+        if self.method == 'hash':
+            thumb = cv2.resize(frame_rgb, (9, 8), interpolation=cv2.INTER_AREA)
+            gray = cv2.cvtColor(thumb, cv2.COLOR_RGB2GRAY)
+            return np.packbits(gray[:, 1:] > gray[:, :-1])
+        height, width = frame_rgb.shape[:2]
+        thumb_height = max(1, int(self.thumb_size * height / max(width, 1)))
+        thumb = cv2.resize(frame_rgb, (self.thumb_size, thumb_height), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(thumb, cv2.COLOR_RGB2GRAY)
+
+    def change(self, signature: np.ndarray) -> float:
+        """Distance between a signature and the reference (inf when there is no reference)"""
+        if self._reference is None or self._reference.shape != signature.shape:
+            return float('inf')
+        if self.method == 'hash':
+            return float(np.unpackbits(np.bitwise_xor(signature, self._reference)).sum())
+        return float(cv2.absdiff(signature, self._reference).mean()) / 255.0
+
+    def should_infer(self, frame_rgb: np.ndarray) -> bool:
+        """True when the frame changed enough (or results were reused for too long)"""
+        signature = self.signature(frame_rgb)
+        if self.change(signature) > self.threshold or self._reuse_run >= self.max_reuse:
+            self._reference = signature
+            self._reuse_run = 0
+            self.inferred += 1
+            return True
+        self._reuse_run += 1
+        self.reused += 1
+        return False
+
+    def snapshot(self) -> Dict:
+        """Reference signature and counters for a checkpoint"""
+        return {'reference': self._reference, 'reuseRun': self._reuse_run, 'inferred': self.inferred, 'reused': self.reused}
+
+    def restore(self, state: Dict):
+        self._reference = state['reference']
+        self._reuse_run = state['reuseRun']
+        self.inferred = state['inferred']
+        self.reused = state['reused']
+
+    def stats(self) -> Dict:
+        total = self.inferred + self.reused
+        return {
+            'method': self.method,
+            'threshold': self.threshold,
+            'inferredFrames': self.inferred,
+            'reusedFrames': self.reused,
+            'reuseRatio': self.reused / total if total else 0.0,
+        }
@@ -0,0 +1,159 @@
+"""
+Result serialization: fast JSON, columnar per-frame series, MessagePack/Arrow encodings and response compression
+"""
+
+import gzip
+import json
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+
+# Final result of an SSE analysis, kept in its job directory for /api/results/<job_id>
+RESULT_FILENAME = 'result.json'
+
+# Latest provisional aggregates of a progressive analysis run by a broker worker
+PARTIAL_FILENAME = 'partial.json'
+
+# Annotated output video (annotatedVideo) by container; a resumed run adds an annotated_from_<frame> segment
+ANNOTATED_VIDEO_BASENAME = 'annotated'
+VIDEO_MIMETYPES = {'mp4': 'video/mp4', 'webm': 'video/webm'}
+
+# Per-frame series in the columnar schema (one parallel array each)
+PER_FRAME_COLUMNS = (
+    'frame_number',
+    'vehicle_count',
+    'human_count',
+    'weather_primary',
+    'brightness',
+    'contrast',
+    'brightness_luminance_cd_per_m2',
+    'contrast_ratio',
+    'congestion_level',
+    'inferred',
+)
+
+# Base64 payloads left out of the binary encodings (fetch them from the JSON result if needed)
+BINARY_EXCLUDED_FIELDS = ('images', 'frames', 'chartImages', 'annotatedImage')
+
+
+def _default(value):
+    """json.dumps fallback for NumPy scalars/arrays and paths"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+
+try:
+    import orjson
+
+    def dumps_bytes(obj) -> bytes:
+        """Compact JSON as UTF-8 bytes (orjson when installed)"""
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+except ImportError:
+    orjson = None
+
+    def dumps_bytes(obj) -> bytes:
+        """Compact JSON as UTF-8 bytes (orjson when installed)"""
+        return json.dumps(obj, default=_default, separators=(',', ':')).encode('utf-8')
+
+
+def dumps(obj) -> str:
+    return dumps_bytes(obj).decode('utf-8')
+
+
+def loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def per_frame_rows(columns: Dict[str, List]) -> List[Dict]:
+    """Expand columnar per-frame series into the legacy perFrameData rows"""
+    rows = []
+    for i in range(len(columns.get('frame_number', []))):
+        row = {name: columns[name][i] for name in PER_FRAME_COLUMNS if name in columns}
+        row['image_quality'] = {
+            'brightness': row.pop('brightness', 0),
+            'contrast': row.pop('contrast', 0),
+            'brightness_luminance_cd_per_m2': row['brightness_luminance_cd_per_m2'],
+            'contrast_ratio': row['contrast_ratio'],
+        }
+        rows.append(row)
+    return rows
+
+
+def _strip_heavy(result: Dict) -> Dict:
+    return {k: v for k, v in result.items() if k not in BINARY_EXCLUDED_FIELDS}
+
+
+def encode_msgpack(result: Dict) -> bytes:
+    """MessagePack encoding of a result without its base64 images (requires msgpack)"""
+    import msgpack
+
+    return msgpack.packb(_strip_heavy(result), default=_default, use_bin_type=True)
+
+
+def encode_arrow(result: Dict) -> bytes:
+    """Arrow IPC stream: one row per frame, everything else as JSON in the schema metadata (requires pyarrow)"""
+    import pyarrow as pa
+
+    columns = result.get('perFrameColumns') or {}
+    table = pa.table({name: columns[name] for name in PER_FRAME_COLUMNS if name in columns})
+    rest = {k: v for k, v in _strip_heavy(result).items() if k not in ('perFrameColumns', 'perFrameData')}
+    table = table.replace_schema_metadata({b'result': dumps_bytes(rest)})
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+RESULT_ENCODINGS = {
+    'msgpack': ('application/msgpack', encode_msgpack),
+    'arrow': ('application/vnd.apache.arrow.stream', encode_arrow),
+}
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """'br' (if brotli is installed) or 'gzip' when the client accepts it"""
+    accepted = {part.split(';')[0].strip().lower() for part in (accept_encoding or '').split(',')}
+    if 'br' in accepted:
+        try:
+            import brotli  # noqa: F401
+            return 'br'
+        except ImportError:
+            pass
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        import brotli
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+
+def compress_stream(chunks: Iterable, encoding: str) -> Iterator[bytes]:
+    """Compress a streamed response, flushing after every chunk so SSE events are not held back"""
+    try:
+        if encoding == 'br':
+            import brotli
+            compressor = brotli.Compressor(quality=5)
+            for chunk in chunks:
+                data = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+                yield compressor.process(data) + compressor.flush()
+            yield compressor.finish()
+        else:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+            for chunk in chunks:
+                data = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+                yield compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            yield compressor.flush()
+    finally:
+        # Propagate client disconnects to the wrapped generator
+        if hasattr(chunks, 'close'):
+            chunks.close()
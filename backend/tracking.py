@@ -0,0 +1,284 @@
+"""
+Lightweight multi-object tracking (SORT-style: constant-velocity Kalman filter + IoU matching)
+"""
+
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+# Constant-velocity model over [cx, cy, area, aspect, vcx, vcy, varea]
+_STATE_DIM = 7
+_MEAS_DIM = 4
+_R = np.diag([1.0, 1.0, 10.0, 10.0])
+_P0 = np.diag([10.0, 10.0, 10.0, 10.0, 1e4, 1e4, 1e4])
+_Q = np.diag([1.0, 1.0, 1.0, 1e-2, 1e-2, 1e-2, 1e-4])
+
+
+def iou_matrix(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """Pairwise IoU between (N, 4) and (M, 4) xyxy boxes"""
+    if len(boxes_a) == 0 or len(boxes_b) == 0:
+        return np.zeros((len(boxes_a), len(boxes_b)))
+    a = boxes_a[:, None, :]
+    b = boxes_b[None, :, :]
+    inter_w = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    inter_h = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = inter_w * inter_h
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return inter / np.maximum(area_a + area_b - inter, 1e-9)
+
+
+def _boxes_to_measurements(boxes: np.ndarray) -> np.ndarray:
+    widths = np.maximum(boxes[:, 2] - boxes[:, 0], 1e-3)
+    heights = np.maximum(boxes[:, 3] - boxes[:, 1], 1e-3)
+    return np.stack([
+        boxes[:, 0] + widths / 2,
+        boxes[:, 1] + heights / 2,
+        widths * heights,
+        widths / heights,
+    ], axis=1)
+
+
+def _states_to_boxes(states: np.ndarray) -> np.ndarray:
+    areas = np.maximum(states[:, 2], 1e-3)
+    aspects = np.maximum(states[:, 3], 1e-3)
+    widths = np.sqrt(areas * aspects)
+    heights = areas / widths
+    return np.stack([
+        states[:, 0] - widths / 2,
+        states[:, 1] - heights / 2,
+        states[:, 0] + widths / 2,
+        states[:, 1] + heights / 2,
+    ], axis=1)
+
+
+def _greedy_match(affinity: np.ndarray, min_affinity: float):
+    """Greedy one-to-one matching on an affinity matrix, highest affinity first"""
+    rows, cols = np.nonzero(affinity >= min_affinity)
+    order = np.argsort(-affinity[rows, cols], kind='stable')
+    used_rows, used_cols, matches = set(), set(), []
+    for k in order:
+        r, c = int(rows[k]), int(cols[k])
+        if r in used_rows or c in used_cols:
+            continue
+        used_rows.add(r)
+        used_cols.add(c)
+        matches.append((r, c))
+    return matches
+
+
+class MultiObjectTracker:
+    """Track detections across sampled frames, all tracks predicted/updated as NumPy batches
+
+    Matching is done per category (e.g. 'vehicle', 'person') in two stages: IoU against the
+    Kalman-predicted boxes, then normalised centre distance for what is left, which keeps
+    identities across the large jumps produced by sparse sampling.
+    """
+
+    def __init__(
+        self,
+        iou_threshold: float = 0.3,
+        distance_gate: float = 2.0,
+        max_age_seconds: float = 3.0,
+        min_hits: int = 2
+    ):
+        self.iou_threshold = iou_threshold
+        self.distance_gate = distance_gate
+        self.max_age_seconds = max_age_seconds
+        self.min_hits = min_hits
+
+        self._states = np.zeros((0, _STATE_DIM))
+        self._covariances = np.zeros((0, _STATE_DIM, _STATE_DIM))
+        self._tracks: List[Dict] = []
+        self._finished: List[Dict] = []
+        self._next_id = 1
+        self._last_time: Optional[float] = None
+
+    @classmethod
+    def from_settings(cls, settings: Dict, sample_period: float) -> Optional['MultiObjectTracker']:
+        """Tracker for trackObjects (None when off); tracks survive at least a couple of sample gaps"""
+        if not settings.get('trackObjects', True):
+            return None
+        return cls(
+            iou_threshold=float(settings.get('trackIouThreshold', 0.3)),
+            max_age_seconds=max(float(settings.get('trackMaxAgeSeconds', 3.0)), 2.5 * sample_period),
+            min_hits=int(settings.get('trackMinHits', 2)),
+        )
+
+    def _predict(self, timestamp: float):
+        if self._last_time is None or not self._tracks:
+            self._last_time = timestamp
+            return
+        dt = max(timestamp - self._last_time, 0.0)
+        self._last_time = timestamp
+
+        transition = np.eye(_STATE_DIM)
+        transition[0, 4] = transition[1, 5] = transition[2, 6] = dt
+        # Keep the predicted area positive
+        shrinking = self._states[:, 2] + self._states[:, 6] * dt <= 0
+        self._states[shrinking, 6] = 0.0
+        self._states = self._states @ transition.T
+        self._covariances = transition @ self._covariances @ transition.T + _Q * max(dt, 1e-3)
+
+    def _update(self, track_idx: np.ndarray, measurements: np.ndarray):
+        states = self._states[track_idx]
+        covariances = self._covariances[track_idx]
+        residual = measurements - states[:, :_MEAS_DIM]
+        innovation = covariances[:, :_MEAS_DIM, :_MEAS_DIM] + _R
+        gain = covariances[:, :, :_MEAS_DIM] @ np.linalg.inv(innovation)
+        self._states[track_idx] = states + (gain @ residual[..., None])[..., 0]
+        self._covariances[track_idx] = covariances - gain @ covariances[:, :_MEAS_DIM, :]
+
+    def update(self, boxes, labels: List[str], categories: List[str], scores, timestamp: float) -> List[int]:
+        """Feed one frame of detections; returns the track id assigned to each detection"""
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+        categories = np.asarray(categories, dtype=object)
+        self._predict(timestamp)
+
+        assigned = [0] * len(boxes)
+        matched_tracks, matched_dets = [], []
+        if self._tracks and len(boxes):
+            predicted = _states_to_boxes(self._states)
+            track_categories = np.array([t['category'] for t in self._tracks], dtype=object)
+            same_category = track_categories[:, None] == categories[None, :]
+
+            # Stage 1: IoU against predicted boxes
+            iou = np.where(same_category, iou_matrix(predicted, boxes), 0.0)
+            matches = _greedy_match(iou, self.iou_threshold)
+
+            # Stage 2: normalised centre distance for the leftovers
+            used_t = {t for t, _ in matches}
+            used_d = {d for _, d in matches}
+            centres_t = (predicted[:, :2] + predicted[:, 2:]) / 2
+            centres_d = (boxes[:, :2] + boxes[:, 2:]) / 2
+            scale = np.sqrt(np.maximum(self._states[:, 2], 1.0))[:, None]
+            distance = np.linalg.norm(centres_t[:, None, :] - centres_d[None, :, :], axis=2) / scale
+            closeness = np.where(same_category, 1.0 - distance / self.distance_gate, -1.0)
+            if used_t:
+                closeness[list(used_t), :] = -1.0
+            if used_d:
+                closeness[:, list(used_d)] = -1.0
+            matches += _greedy_match(closeness, 0.0)
+
+            matched_tracks = [t for t, _ in matches]
+            matched_dets = [d for _, d in matches]
+
+        if matched_tracks:
+            self._update(np.array(matched_tracks), _boxes_to_measurements(boxes[matched_dets]))
+            for t, d in zip(matched_tracks, matched_dets):
+                track = self._tracks[t]
+                self._record(track, boxes[d], labels[d], scores[d], timestamp)
+                assigned[d] = track['id']
+
+        # Unmatched detections start new tracks
+        matched_set = set(matched_dets)
+        new_dets = [d for d in range(len(boxes)) if d not in matched_set]
+        if new_dets:
+            measurements = _boxes_to_measurements(boxes[new_dets])
+            new_states = np.zeros((len(new_dets), _STATE_DIM))
+            new_states[:, :_MEAS_DIM] = measurements
+            self._states = np.concatenate([self._states, new_states])
+            self._covariances = np.concatenate([self._covariances, np.repeat(_P0[None], len(new_dets), axis=0)])
+            for d in new_dets:
+                track = {
+                    'id': self._next_id,
+                    'category': categories[d],
+                    'labels': {},
+                    'firstSeen': timestamp,
+                    'lastSeen': timestamp,
+                    'hits': 0,
+                    'scoreSum': 0.0,
+                    'trajectory': [],
+                }
+                self._next_id += 1
+                self._record(track, boxes[d], labels[d], scores[d], timestamp)
+                self._tracks.append(track)
+                assigned[d] = track['id']
+
+        self._expire(timestamp)
+        return assigned
+
+    def _record(self, track: Dict, box: np.ndarray, label: str, score: float, timestamp: float):
+        track['lastSeen'] = timestamp
+        track['hits'] += 1
+        track['scoreSum'] += float(score)
+        track['labels'][label] = track['labels'].get(label, 0) + 1
+        track['trajectory'].append([
+            round(float(timestamp), 3),
+            round(float((box[0] + box[2]) / 2), 1),
+            round(float((box[1] + box[3]) / 2), 1),
+        ])
+
+    def _expire(self, timestamp: float):
+        keep = [i for i, t in enumerate(self._tracks) if timestamp - t['lastSeen'] <= self.max_age_seconds]
+        if len(keep) == len(self._tracks):
+            return
+        keep_set = set(keep)
+        self._finished.extend(t for i, t in enumerate(self._tracks) if i not in keep_set)
+        self._tracks = [self._tracks[i] for i in keep]
+        self._states = self._states[keep]
+        self._covariances = self._covariances[keep]
+
+    def snapshot(self) -> Dict:
+        """Filter and track state for a checkpoint (restore() it into a tracker with the same settings)"""
+        return {
+            'states': self._states,
+            'covariances': self._covariances,
+            'tracks': [dict(track) for track in self._tracks],
+            'finished': [dict(track) for track in self._finished],
+            'nextId': self._next_id,
+            'lastTime': self._last_time,
+        }
+
+    def restore(self, state: Dict):
+        self._states = np.asarray(state['states'], dtype=np.float64).reshape(-1, _STATE_DIM)
+        self._covariances = np.asarray(state['covariances'], dtype=np.float64).reshape(-1, _STATE_DIM, _STATE_DIM)
+        self._tracks = [dict(track) for track in state['tracks']]
+        self._finished = [dict(track) for track in state['finished']]
+        self._next_id = state['nextId']
+        self._last_time = state['lastTime']
+
+    def confirmed_tracks(self) -> List[Dict]:
+        """All tracks (finished and live) seen in at least min_hits frames"""
+        tracks = []
+        for track in self._finished + self._tracks:
+            if track['hits'] < self.min_hits:
+                continue
+            tracks.append({
+                'id': track['id'],
+                'category': track['category'],
+                'label': max(track['labels'], key=track['labels'].get),
+                'firstSeen': track['firstSeen'],
+                'lastSeen': track['lastSeen'],
+                'dwellSeconds': track['lastSeen'] - track['firstSeen'],
+                'hits': track['hits'],
+                'meanScore': track['scoreSum'] / track['hits'],
+                'trajectory': track['trajectory'],
+            })
+        tracks.sort(key=lambda t: t['id'])
+        return tracks
+
+    def summary(self) -> Dict:
+        """Unique counts, dwell times and trajectories per category"""
+        tracks = self.confirmed_tracks()
+        by_category = {}
+        for track in tracks:
+            by_category.setdefault(track['category'], []).append(track)
+
+        categories = {}
+        for category, items in by_category.items():
+            dwell = [t['dwellSeconds'] for t in items]
+            categories[category] = {
+                'uniqueCount': len(items),
+                'meanDwellSeconds': float(np.mean(dwell)),
+                'maxDwellSeconds': float(np.max(dwell)),
+            }
+
+        return {
+            'minHits': self.min_hits,
+            'maxAgeSeconds': self.max_age_seconds,
+            'categories': categories,
+            'tracks': tracks,
+        }
@@ -0,0 +1,297 @@
+"""
+Training-data export for saveForTraining: frames plus detections written as sharded datasets in one streaming pass
+"""
+
+import json
+import os
+import tarfile
+import time
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+from PIL import Image
+
+
+TRAINING_FORMATS = ('webdataset', 'coco')
+
+# Subdirectory of the job directory the export is written to
+TRAINING_DIRNAME = 'training'
+
+
+class _TarShards:
+    """Rolling tar shards: a new shard starts every shard_size samples or max_shard_bytes
+
+    Shards are written as <name>.tar.part and renamed when complete, so readers
+    only ever see whole shards.
+    """
+
+    def __init__(self, output_dir: Path, prefix: str, shard_size: int, max_shard_bytes: Optional[int]):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.prefix = prefix
+        self.shard_size = max(1, shard_size)
+        self.max_shard_bytes = max_shard_bytes
+        self.shards = []
+        self._tar = None
+        self._file = None
+        self._path = None
+        self._samples = 0
+        self._bytes = 0
+
+    @property
+    def current_name(self) -> str:
+        return f'{self.prefix}-{len(self.shards):06d}.tar'
+
+    def add(self, files: Dict[str, bytes]) -> str:
+        """Add one sample's files; returns the shard name they went into"""
+        size = sum(len(data) for data in files.values())
+        if self._tar is not None and (
+            self._samples >= self.shard_size
+            or (self.max_shard_bytes and self._bytes + size > self.max_shard_bytes)
+        ):
+            self._finish_shard()
+        if self._tar is None:
+            self._path = self.output_dir / f'{self.current_name}.part'
+            self._open(open(self._path, 'wb'))
+
+        now = time.time()
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = now
+            self._tar.addfile(info, BytesIO(data))
+        self._samples += 1
+        self._bytes += size
+        return self.current_name
+
+    def _open(self, file):
+        # The tar writes at the file's current position, so a reopened shard continues where it was cut
+        self._file = file
+        self._tar = tarfile.open(fileobj=file, mode='w')
+
+    def _finish_shard(self):
+        self._tar.close()
+        self._file.close()
+        name = self.current_name
+        os.replace(self._path, self.output_dir / name)
+        self.shards.append({'name': name, 'samples': self._samples, 'bytes': self._bytes})
+        self._tar, self._file, self._path, self._samples, self._bytes = None, None, None, 0, 0
+
+    def close(self):
+        if self._tar is not None:
+            self._finish_shard()
+
+    def checkpoint(self) -> Dict:
+        """Flush the open shard without finishing it; returns the finished shards and the open one's size"""
+        state = {'shards': [dict(shard) for shard in self.shards], 'open': None}
+        if self._tar is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            state['open'] = {'samples': self._samples, 'bytes': self._bytes, 'offset': self._tar.offset}
+        return state
+
+    def restore(self, state: Dict):
+        """Continue after a checkpoint: keep its shards, cut the open one back and drop anything newer"""
+        self.shards = [dict(shard) for shard in state['shards']]
+        kept = {shard['name'] for shard in self.shards}
+        open_shard = state['open']
+        if open_shard is not None:
+            kept.add(f'{self.current_name}.part')
+            finished = self.output_dir / self.current_name
+            # The open shard may have been finished (renamed) after the checkpoint
+            if finished.exists():
+                os.replace(finished, self.output_dir / f'{self.current_name}.part')
+        for path in self.output_dir.glob(f'{self.prefix}-*.tar*'):
+            if path.name not in kept:
+                path.unlink()
+        if open_shard is not None:
+            self._path = self.output_dir / f'{self.current_name}.part'
+            os.truncate(self._path, open_shard['offset'])
+            file = open(self._path, 'r+b')
+            file.seek(open_shard['offset'])
+            self._open(file)
+            self._samples, self._bytes = open_shard['samples'], open_shard['bytes']
+
+
+def _encode_jpeg(image: Image.Image, quality: int) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+class TrainingExporter:
+    """Append frames and their detections to a sharded training dataset as they are analysed
+
+    webdataset: shard-NNNNNN.tar with <key>.jpg + <key>.json per sample.
+    coco: images packed into images-NNNNNN.tar shards plus one COCO annotations.json,
+    whose image/annotation entries are spooled to JSON-lines files and assembled
+    line by line on close, so memory use stays flat however long the source is.
+    """
+
+    def __init__(
+        self,
+        output_dir: Path,
+        id2label: Dict[int, str],
+        source: str,
+        fmt: str = 'webdataset',
+        shard_size: int = 1000,
+        max_shard_mb: Optional[float] = None,
+        jpeg_quality: int = 95,
+        min_score: float = 0.0,
+        resume: Optional[Dict] = None
+    ):
+        if fmt not in TRAINING_FORMATS:
+            raise ValueError(f"Unknown training export format '{fmt}' ({', '.join(TRAINING_FORMATS)})")
+        self.output_dir = Path(output_dir)
+        self.id2label = id2label
+        self.source = source
+        self.format = fmt
+        self.jpeg_quality = jpeg_quality
+        self.min_score = min_score
+        max_shard_bytes = int(max_shard_mb * 1024 ** 2) if max_shard_mb else None
+        self.shards = _TarShards(self.output_dir, 'shard' if fmt == 'webdataset' else 'images', shard_size, max_shard_bytes)
+        self.samples = 0
+        self.boxes = 0
+        self.closed = False
+
+        self._images_file = self._annotations_file = None
+        if resume:
+            self.samples, self.boxes = resume['samples'], resume['boxes']
+            self.shards.restore(resume['shards'])
+        if fmt == 'coco':
+            images_path = self.output_dir / 'images.jsonl.part'
+            annotations_path = self.output_dir / 'annotations.jsonl.part'
+            if resume:
+                # Cut the spooled entries back to the checkpoint and append from there
+                os.truncate(images_path, resume['imagesOffset'])
+                os.truncate(annotations_path, resume['annotationsOffset'])
+            mode = 'a' if resume else 'w'
+            self._images_file = open(images_path, mode, encoding='utf-8')
+            self._annotations_file = open(annotations_path, mode, encoding='utf-8')
+
+    @classmethod
+    def from_settings(
+        cls,
+        settings: Dict,
+        output_dir: Path,
+        id2label: Dict[int, str],
+        source: str,
+        resume: Optional[Dict] = None
+    ) -> Optional['TrainingExporter']:
+        """Exporter for saveForTraining (None when it is off); resume is a checkpoint() state"""
+        if not settings.get('saveForTraining', False):
+            return None
+        max_shard_mb = settings.get('trainingShardMaxMB')
+        return cls(
+            Path(output_dir) / TRAINING_DIRNAME,
+            id2label,
+            source,
+            fmt=settings.get('trainingFormat', 'webdataset'),
+            shard_size=int(settings.get('trainingShardSize', 1000)),
+            max_shard_mb=float(max_shard_mb) if max_shard_mb else None,
+            jpeg_quality=int(settings.get('trainingJpegQuality', 95)),
+            min_score=float(settings.get('trainingMinScore', 0.0)),
+            resume=resume,
+        )
+
+    def add(self, image: Image.Image, detections, frame_number: int = 0, timestamp: Optional[float] = None):
+        """Write one image and its Detections (boxes in pixel xyxy)"""
+        keep = detections.scores >= self.min_score
+        boxes = detections.boxes[keep].astype(np.float64)
+        scores = detections.scores[keep].astype(np.float64)
+        label_ids = detections.label_ids[keep]
+        key = f'{Path(self.source).stem}_{frame_number:08d}'
+        jpeg = _encode_jpeg(image, self.jpeg_quality)
+
+        if self.format == 'webdataset':
+            annotation = {
+                'source': self.source,
+                'frame': frame_number,
+                'timestamp': timestamp,
+                'width': image.width,
+                'height': image.height,
+                'boxes': np.round(boxes, 2).tolist(),
+                'labels': [self.id2label.get(label_id, str(label_id)) for label_id in label_ids.tolist()],
+                'label_ids': label_ids.tolist(),
+                'scores': np.round(scores, 4).tolist(),
+            }
+            self.shards.add({f'{key}.jpg': jpeg, f'{key}.json': json.dumps(annotation).encode('utf-8')})
+        else:
+            shard = self.shards.add({f'{key}.jpg': jpeg})
+            image_id = self.samples + 1
+            self._images_file.write(json.dumps({
+                'id': image_id,
+                'file_name': f'{shard}/{key}.jpg',
+                'width': image.width,
+                'height': image.height,
+                'frame': frame_number,
+                'timestamp': timestamp,
+            }) + '\n')
+            xywh = np.concatenate([boxes[:, :2], boxes[:, 2:] - boxes[:, :2]], axis=1) if len(boxes) else boxes
+            for offset, (box, score, label_id) in enumerate(zip(np.round(xywh, 2).tolist(), scores.tolist(), label_ids.tolist()), 1):
+                self._annotations_file.write(json.dumps({
+                    'id': self.boxes + offset,
+                    'image_id': image_id,
+                    'category_id': label_id,
+                    'bbox': box,
+                    'area': box[2] * box[3],
+                    'iscrowd': 0,
+                    'score': round(score, 4),
+                }) + '\n')
+
+        self.samples += 1
+        self.boxes += len(boxes)
+
+    def checkpoint(self) -> Dict:
+        """Flush the open shard and spooled entries (shard sizes are unaffected); returns the state to resume from"""
+        state = {'samples': self.samples, 'boxes': self.boxes, 'shards': self.shards.checkpoint()}
+        if self.format == 'coco':
+            for spool in (self._images_file, self._annotations_file):
+                spool.flush()
+                os.fsync(spool.fileno())
+            state['imagesOffset'] = self._images_file.tell()
+            state['annotationsOffset'] = self._annotations_file.tell()
+        return state
+
+    def _write_coco(self):
+        """Assemble annotations.json from the spooled JSON-lines files without loading them"""
+        self._images_file.close()
+        self._annotations_file.close()
+        images_path = self.output_dir / 'images.jsonl.part'
+        annotations_path = self.output_dir / 'annotations.jsonl.part'
+        categories = [{'id': label_id, 'name': name} for label_id, name in sorted(self.id2label.items())]
+        target = self.output_dir / 'annotations.json'
+
+        with open(f'{target}.part', 'w', encoding='utf-8') as out:
+            out.write('{"info": ' + json.dumps({'source': self.source, 'description': 'Detections exported by tilda-tesla'}))
+            out.write(', "categories": ' + json.dumps(categories))
+            for key, path in (('images', images_path), ('annotations', annotations_path)):
+                out.write(f', "{key}": [')
+                with open(path, encoding='utf-8') as entries:
+                    for i, line in enumerate(entries):
+                        out.write((',' if i else '') + line.rstrip('\n'))
+                out.write(']')
+            out.write('}')
+        os.replace(f'{target}.part', target)
+        images_path.unlink()
+        annotations_path.unlink()
+
+    def close(self) -> Dict:
+        """Finish the last shard (and annotations.json for COCO) and return the export stats"""
+        if not self.closed:
+            self.closed = True
+            self.shards.close()
+            if self.format == 'coco':
+                self._write_coco()
+        return self.stats()
+
+    def stats(self) -> Dict:
+        return {
+            'format': self.format,
+            'directory': str(self.output_dir),
+            'samples': self.samples,
+            'boxes': self.boxes,
+            'shards': list(self.shards.shards),
+        }
@@ -0,0 +1,146 @@
+"""
+Job directories and streamed uploads written straight to disk
+"""
+
+import hashlib
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Optional
+
+from flask import Request
+from werkzeug.utils import secure_filename
+
+
+# Size of the chunks used when an upload has to be copied rather than moved
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Spool directory for uploads still being received (inside OUTPUT_DIR so the final move is a rename)
+INCOMING_DIRNAME = '.incoming'
+
+# Uploads are stored as source<ext>: the client's filename never becomes a path in the job directory,
+# so it cannot collide with files the server keeps there (job.json, result.json, checkpoints)
+SOURCE_BASENAME = 'source'
+
+
+def new_job_id(kind: str) -> str:
+    """Create a unique, time-sortable job id such as analysis_1766975100_3f2a9c1b7d4e"""
+    return f'{kind}_{int(time.time())}_{uuid.uuid4().hex[:12]}'
+
+
+def create_job_dir(root: Path, kind: str) -> Path:
+    """Create a fresh job directory; never reuses an existing one"""
+    while True:
+        job_dir = Path(root) / new_job_id(kind)
+        try:
+            job_dir.mkdir(parents=True, exist_ok=False)
+            return job_dir
+        except FileExistsError:
+            continue
+
+
+def safe_filename(filename: Optional[str], default: str = 'upload') -> str:
+    """Sanitise a client supplied filename, keeping its extension where possible"""
+    name = secure_filename(filename or '')
+    if name:
+        return name
+    suffix = secure_filename(Path(filename or '').suffix.lstrip('.'))
+    return f'{default}.{suffix}' if suffix else default
+
+
+class HashingSpoolFile:
+    """Disk-backed file that hashes bytes as Werkzeug writes the upload into it"""
+
+    def __init__(self, directory: Path):
+        directory.mkdir(parents=True, exist_ok=True)
+        self.path = directory / f'{uuid.uuid4().hex}.part'
+        self._file = open(self.path, 'w+b', buffering=UPLOAD_CHUNK_SIZE)
+        self._hash = hashlib.sha256()
+        self.bytes_written = 0
+        self.committed = False
+
+    def write(self, data) -> int:
+        self._hash.update(data)
+        self.bytes_written += len(data)
+        return self._file.write(data)
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+    def commit(self, destination: Path) -> Path:
+        """Move the spooled upload to its final location without copying"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.path, destination)
+        self.path = destination
+        self.committed = True
+        return destination
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        # Uploads that were never committed are discarded with the request
+        if not self.committed:
+            try:
+                self.path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+def make_request_class(incoming_dir: Path):
+    """Flask request class that spools file uploads to disk instead of memory/tempfiles"""
+
+    class StreamingRequest(Request):
+        def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+            return HashingSpoolFile(incoming_dir)
+
+    return StreamingRequest
+
+
+def source_path(job_dir: Path, filename: str) -> Path:
+    """Where a job keeps its input: source<ext>, so no client name can clash with the job's own files"""
+    return Path(job_dir) / f'{SOURCE_BASENAME}{Path(filename).suffix.lower()}'
+
+
+def save_upload(file_storage, job_dir: Path, default_name: str = 'upload') -> Dict:
+    """Place an uploaded file in job_dir as source<ext> and return its path, size and sha256
+
+    `filename` (the sanitised client name) is only reported, never used as a path.
+    """
+    filename = safe_filename(file_storage.filename, default_name)
+    destination = source_path(job_dir, filename)
+    stream = file_storage.stream
+
+    if isinstance(stream, HashingSpoolFile):
+        stream.commit(destination)
+        digest = stream.hexdigest()
+        size = stream.bytes_written
+    else:
+        # Fallback for streams not created by StreamingRequest: copy in chunks, hashing as we go
+        digest_obj = hashlib.sha256()
+        size = 0
+        with open(destination, 'wb') as out:
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest_obj.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        digest = digest_obj.hexdigest()
+
+    return {
+        'path': destination,
+        'filename': filename,
+        'originalFilename': file_storage.filename,
+        'bytes': size,
+        'sha256': digest,
+    }
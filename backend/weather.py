@@ -0,0 +1,191 @@
+"""
+Weather sampling for videos: classify at a lower rate than detection, in batches, with temporal smoothing
+"""
+
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+WEATHER_CLASSES = ('Clear', 'Cloudy', 'Rainy', 'Foggy', 'Snowy')
+
+
+def map_weather_label(label: str) -> Optional[str]:
+    """Map a weather model label onto WEATHER_CLASSES (None for unrelated labels like 'car mirror')"""
+    label_lower = label.lower()
+    if "clear" in label_lower or "sunny" in label_lower or "day" in label_lower:
+        return "Clear"
+    elif "cloud" in label_lower or "overcast" in label_lower:
+        return "Cloudy"
+    elif "rain" in label_lower or "wet" in label_lower or "water" in label_lower:
+        return "Rainy"
+    elif "fog" in label_lower or "mist" in label_lower:
+        return "Foggy"
+    elif "snow" in label_lower:
+        return "Snowy"
+    return None
+
+
+def weather_thumbnail(frame_rgb: np.ndarray, max_side: Optional[int]) -> Image.Image:
+    """Downscale a frame for the weather model (its processor resizes to ~224px anyway)"""
+    height, width = frame_rgb.shape[:2]
+    scale = max_side / max(height, width) if max_side else 1.0
+    if scale >= 1.0:
+        return Image.fromarray(frame_rgb)
+    size = (max(1, int(width * scale)), max(1, int(height * scale)))
+    return Image.fromarray(cv2.resize(frame_rgb, size, interpolation=cv2.INTER_AREA))
+
+
+def smooth_labels(labels: List[str], window: int = 1, min_dwell: int = 1) -> List[str]:
+    """Centred majority filter over `window` samples, then drop runs shorter than `min_dwell`
+
+    Runs offline on the full label sequence, so there is no lag at real transitions.
+    """
+    if not labels:
+        return []
+    smoothed = list(labels)
+    if window > 1:
+        half = window // 2
+        for i in range(len(labels)):
+            counts = Counter(labels[max(0, i - half):i + half + 1])
+            best = max(counts.values())
+            # Ties keep the raw label so a balanced window does not flip
+            smoothed[i] = labels[i] if counts[labels[i]] == best else counts.most_common(1)[0][0]
+
+    if min_dwell > 1:
+        # Hysteresis: runs shorter than min_dwell samples keep the previous label
+        runs = []
+        for label in smoothed:
+            if runs and runs[-1][0] == label:
+                runs[-1][1] += 1
+            else:
+                runs.append([label, 1])
+        state, smoothed = runs[0][0], []
+        for label, length in runs:
+            if length >= min_dwell:
+                state = label
+            smoothed.extend([state] * length)
+    return smoothed
+
+
+class WeatherTimeline:
+    """Schedule, batch and smooth weather classification over a video's sampled frames
+
+    Frames are registered in order with add_frame(); only frames at least
+    1/weather_fps seconds after the previous weather sample are classified, in
+    batches of batch_size. Every frame takes the (smoothed) label of the latest
+    sample at or before it.
+    """
+
+    def __init__(
+        self,
+        classify_batch: Callable[[List[Image.Image]], List[str]],
+        weather_fps: Optional[float] = None,
+        batch_size: int = 8,
+        smoothing_window: int = 1,
+        min_dwell: int = 1,
+        thumb_size: Optional[int] = 384
+    ):
+        self.classify_batch = classify_batch
+        self.interval = 1.0 / weather_fps if weather_fps else 0.0
+        self.base_interval = self.interval
+        self.weather_fps = weather_fps
+        self.batch_size = max(1, batch_size)
+        self.smoothing_window = max(1, smoothing_window)
+        self.min_dwell = max(1, min_dwell)
+        self.thumb_size = thumb_size
+
+        self._samples: List[str] = []
+        self._pending: List[Image.Image] = []
+        self._frame_samples: List[int] = []
+        self._last_sample_time: Optional[float] = None
+
+    @classmethod
+    def from_settings(
+        cls,
+        settings: Dict,
+        classify_batch: Callable[[List[Image.Image]], List[str]],
+        thumb_size: Optional[int] = 384
+    ) -> 'WeatherTimeline':
+        weather_fps = settings.get('weatherFps')
+        return cls(
+            classify_batch,
+            weather_fps=float(weather_fps) if weather_fps else None,
+            batch_size=int(settings.get('weatherBatchSize', 8)),
+            smoothing_window=int(settings.get('weatherSmoothing', 1)),
+            min_dwell=int(settings.get('weatherMinDwell', 1)),
+            thumb_size=thumb_size,
+        )
+
+    @property
+    def sample_count(self) -> int:
+        return len(self._samples) + len(self._pending)
+
+    def add_frame(self, frame_rgb: np.ndarray, timestamp: float, may_sample: bool = True):
+        """Register the next sampled frame; classify it if a weather sample is due
+
+        may_sample=False (e.g. a static frame reusing detections) only defers the
+        sample when no weatherFps is set; the very first frame is always sampled.
+        """
+        due = (
+            self._last_sample_time is None
+            or (self.interval and timestamp - self._last_sample_time >= self.interval - 1e-6)
+            or (not self.interval and may_sample)
+        )
+        if due:
+            self._last_sample_time = timestamp
+            self._pending.append(weather_thumbnail(frame_rgb, self.thumb_size))
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+        self._frame_samples.append(self.sample_count - 1)
+
+    def set_cadence(self, every: int, sample_period: float):
+        """Sample weather every `every` times less often (adaptive quality); 1 restores the configured cadence"""
+        if every > 1:
+            self.interval = max(self.base_interval, sample_period) * every
+        else:
+            self.interval = self.base_interval
+
+    def flush(self):
+        if self._pending:
+            self._samples.extend(self.classify_batch(self._pending))
+            self._pending = []
+
+    def snapshot(self) -> Dict:
+        """Sampling state for a checkpoint (classifies any pending thumbnails first)"""
+        self.flush()
+        return {
+            'samples': list(self._samples),
+            'frameSamples': list(self._frame_samples),
+            'lastSampleTime': self._last_sample_time,
+        }
+
+    def restore(self, state: Dict):
+        self._samples = list(state['samples'])
+        self._frame_samples = list(state['frameSamples'])
+        self._last_sample_time = state['lastSampleTime']
+        self._pending = []
+
+    def labels(self) -> List[str]:
+        """Smoothed weather label for every registered frame"""
+        self.flush()
+        smoothed = smooth_labels(self._samples, self.smoothing_window, self.min_dwell)
+        return [smoothed[i] for i in self._frame_samples]
+
+    def stats(self) -> Dict:
+        self.flush()
+        smoothed = smooth_labels(self._samples, self.smoothing_window, self.min_dwell)
+        changes = lambda seq: sum(1 for a, b in zip(seq, seq[1:]) if a != b)
+        return {
+            'weatherFps': self.weather_fps,
+            'samples': len(self._samples),
+            'frames': len(self._frame_samples),
+            'batchSize': self.batch_size,
+            'smoothingWindow': self.smoothing_window,
+            'minDwell': self.min_dwell,
+            'rawChanges': changes(self._samples),
+            'smoothedChanges': changes(smoothed),
+        }
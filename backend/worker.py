@@ -0,0 +1,197 @@
+"""
+Analysis worker: pulls jobs from the broker, runs VideoAnalyzer and stores the result in the job directory
+"""
+
+import signal
+import threading
+import time
+import traceback
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from broker import JobBroker, LeaseLost, new_worker_id
+from resources import ResourceConfig
+from retention import ACCESS_MARKER
+from serialization import PARTIAL_FILENAME, RESULT_FILENAME, dumps
+
+
+def finalise_result(result: Dict, kind: str, upload: Dict, job_id: str) -> Dict:
+    """Fill in the fields the frontend expects (same as the in-process API path)"""
+    if 'summary' not in result:
+        result['summary'] = 'Video analysis complete' if kind == 'video' else 'Image analysis complete'
+    if 'metadata' not in result:
+        result['metadata'] = {}
+    if upload.get('filename'):
+        result['metadata']['filename'] = upload['filename']
+    result['metadata']['originalFilename'] = upload.get('originalFilename')
+    result['metadata']['sha256'] = upload.get('sha256')
+    result['jobId'] = job_id
+    if kind == 'video' and 'frames' not in result:
+        result['frames'] = []
+    if kind == 'image' and 'annotatedImage' not in result:
+        result['annotatedImage'] = ''
+    if 'images' not in result:
+        result['images'] = []
+    return result
+
+
+def _touch(job_dir: Path):
+    """Mark the job directory as recently used so output retention leaves it alone while it runs"""
+    try:
+        (job_dir / ACCESS_MARKER).touch()
+    except OSError:
+        pass
+
+
+class Worker:
+    """Claim jobs one at a time and run them, heartbeating while they run
+
+    Progress updates are forwarded to the broker (at most every progress_interval
+    seconds) and a background thread renews the lease every lease/3 seconds, so
+    long gaps between progress updates do not lose the job. If the lease is lost
+    anyway, the next progress update aborts the analysis.
+    """
+
+    def __init__(
+        self,
+        broker: JobBroker,
+        kinds: Optional[List[str]] = None,
+        poll_interval: float = 1.0,
+        progress_interval: float = 2.0,
+        resources: Optional[ResourceConfig] = None
+    ):
+        self.broker = broker
+        self.kinds = kinds
+        self.poll_interval = poll_interval
+        self.progress_interval = progress_interval
+        self.resources = resources or ResourceConfig.from_env()
+        self.worker_id = new_worker_id()
+        self.analyzer = None
+        self._stop = threading.Event()
+
+    def stop(self, *_):
+        """Finish the current job, then exit"""
+        print(f"[Worker] {self.worker_id} stopping after the current job")
+        self._stop.set()
+
+    def _get_analyzer(self, settings: Dict):
+        from analysis import VideoAnalyzer
+
+        if self.analyzer is None or self.analyzer.key != VideoAnalyzer.model_key(settings):
+            self.analyzer = VideoAnalyzer.from_settings(settings)
+        return self.analyzer
+
+    def run(self, once: bool = False) -> int:
+        """Main loop; with once=True return as soon as the queue is empty. Returns jobs processed."""
+        effective = self.resources.apply()
+        self.broker.register_worker(self.worker_id, self.kinds)
+        print(f"[Worker] {self.worker_id} polling {self.broker.path} ({effective['torchThreads']} torch threads)")
+        processed = 0
+        try:
+            while not self._stop.is_set():
+                job = self.broker.claim(self.worker_id, self.kinds)
+                if job is None:
+                    if once:
+                        break
+                    self.broker.heartbeat(None, self.worker_id)
+                    self._stop.wait(self.poll_interval)
+                    continue
+                self.process(job)
+                processed += 1
+        finally:
+            self.broker.unregister_worker(self.worker_id)
+        return processed
+
+    def process(self, job: Dict):
+        job_id, kind, payload = job['id'], job['kind'], job['payload']
+        print(f"[Worker] {self.worker_id} running {kind} job {job_id} (attempt {job['attempts']})")
+        lost = threading.Event()
+        done = threading.Event()
+
+        output_dir = Path(payload['outputDir'])
+
+        def keep_alive():
+            while not done.wait(self.broker.lease_seconds / 3):
+                _touch(output_dir)
+                try:
+                    self.broker.heartbeat(job_id, self.worker_id)
+                except LeaseLost:
+                    lost.set()
+                    return
+                except Exception as e:
+                    print(f"[Worker] Heartbeat failed for {job_id}: {e}")
+
+        last_report = [0.0]
+
+        def progress_callback(progress, step):
+            if lost.is_set():
+                raise LeaseLost(f'Lease on job {job_id} was lost')
+            now = time.time()
+            if now - last_report[0] >= self.progress_interval:
+                last_report[0] = now
+                self.broker.heartbeat(job_id, self.worker_id, progress, step)
+
+        def partial_callback(partial):
+            # The API relays this file's latest version on the job's SSE stream
+            tmp_path = output_dir / f'{PARTIAL_FILENAME}.part'
+            tmp_path.write_text(dumps(partial), encoding='utf-8')
+            tmp_path.replace(output_dir / PARTIAL_FILENAME)
+
+        heartbeat_thread = threading.Thread(target=keep_alive, name=f'heartbeat-{job_id}', daemon=True)
+        heartbeat_thread.start()
+        try:
+            settings = payload.get('settings', {})
+            analyzer = self._get_analyzer(settings)
+            guarded = self.resources.memory_guard().wrap(progress_callback)
+
+            start_time = time.time()
+            if kind == 'video':
+                result = analyzer.analyze_video(payload['path'], settings, output_dir,
+                                                progress_callback=guarded, partial_callback=partial_callback)
+            elif kind == 'image':
+                result = analyzer.analyze_image(payload['path'], settings, output_dir, progress_callback=guarded)
+            else:
+                raise ValueError(f"Unknown job kind '{kind}'")
+            result['processingTime'] = time.time() - start_time
+            result = finalise_result(result, kind, payload.get('upload', {}), payload.get('jobId', job_id))
+
+            # Write then rename so the API never reads a half-written result
+            tmp_path = output_dir / f'{RESULT_FILENAME}.part'
+            tmp_path.write_text(dumps(result), encoding='utf-8')
+            tmp_path.replace(output_dir / RESULT_FILENAME)
+            self.broker.complete(job_id, self.worker_id)
+            print(f"[Worker] Finished {job_id} in {result['processingTime']:.1f}s")
+        except LeaseLost as e:
+            # Someone else owns the job now; leave its state alone
+            print(f"[Worker] {e}; abandoning {job_id}")
+        except Exception as e:
+            print(f"[Worker] Job {job_id} failed: {traceback.format_exc()}")
+            self.broker.fail(job_id, self.worker_id, str(e))
+        finally:
+            done.set()
+            heartbeat_thread.join()
+
+
+def _run_worker_command(args) -> int:
+    """Handler for `python -m analysis worker`"""
+    broker = JobBroker(Path(args.broker), lease_seconds=args.lease_seconds, max_attempts=args.max_attempts) if args.broker else JobBroker.from_env()
+    if broker is None:
+        print("[Worker] No broker configured: pass --broker or set JOB_BROKER_DB")
+        return 2
+    worker = Worker(broker, kinds=args.kinds.split(',') if args.kinds else None, poll_interval=args.poll_interval)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    processed = worker.run(once=args.once)
+    print(f"[Worker] Processed {processed} job(s)")
+    return 0
+
+
+def add_worker_arguments(parser):
+    """Register the `worker` subcommand arguments"""
+    parser.add_argument('--broker', help='Broker SQLite file (default: JOB_BROKER_DB)')
+    parser.add_argument('--kinds', help='Comma-separated job kinds to take (video,image); default: all')
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between polls when the queue is empty')
+    parser.add_argument('--lease-seconds', type=float, default=60.0, help='Lease length with --broker (default: 60)')
+    parser.add_argument('--max-attempts', type=int, default=3, help='Claims per job before it fails with --broker (default: 3)')
+    parser.add_argument('--once', action='store_true', help='Exit when the queue is empty instead of polling')
+    parser.set_defaults(handler=_run_worker_command)
@@ -0,0 +1,24 @@
+"""
+Production WSGI entry point: gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+import os
+
+from app import app, get_analyzer, retention
+
+
+def warm_up():
+    """Load the default models now, so the first request of each worker does not pay for it"""
+    if os.environ.get('PRELOAD_MODELS', '1').lower() in ('0', 'false', 'no'):
+        return
+    analyzer = get_analyzer({})
+    if analyzer is not None:
+        print(f"[WSGI] Worker {os.getpid()} loaded models: {analyzer.key}")
+
+
+# Imported in the worker process (preload_app is off), which owns the model set.
+# Only one process per output directory runs the retention sweeper; it honours every process's pins.
+retention.start(exclusive=True)
+warm_up()
+
+__all__ = ['app']
@@ -14,12 +14,45 @@ if (import.meta.env.DEV) {
   console.log('[API Config] Test backend from console: window.testBackend()');
 }
 
+export interface SystemCapacity {
+  host: {
+    cpuCores: number;
+    usableCores: number;
+    loadAverage: number[] | null;
+    loadPerCore: number | null;
+    memoryTotalBytes: number | null;
+    memoryAvailableBytes: number | null;
+    processRssBytes: number | null;
+  };
+  gpu: {
+    name: string;
+    memoryTotalBytes: number;
+    memoryFreeBytes: number;
+    memoryAllocatedBytes: number;
+  } | null;
+  models: Record<string, {
+    name: string;
+    backend?: string;
+    quantization: string;
+    device: string;
+    memoryBytes: number | null;
+  }>;
+  activeJobs: number;
+  activeJobsByKind: Record<string, number>;
+  queueDepth: { inference: number; batchItems: number };
+  framesPerSecond: number;
+  framesWindowSeconds: number;
+  framesTotal: number;
+  executionModes: Record<'fp16' | 'bf16' | 'int8' | 'compile' | 'onnx', boolean>;
+}
+
 export interface SystemInfo {
   hasGPU: boolean;
   gpuName?: string;
   cudaAvailable: boolean;
   device: 'cuda' | 'cpu';
   torchVersion?: string;
+  capacity?: SystemCapacity;
 }
 
 export interface AnalysisSettings {
@@ -31,30 +64,50 @@ export interface AnalysisSettings {
   fps?: number;
   saveFrames?: boolean;
   saveForTraining?: boolean;
+  trainingFormat?: 'webdataset' | 'coco';
+  trainingShardSize?: number;
+  trainingShardMaxMB?: number;
   saveAnnotated?: boolean;
   detectionModel?: string;
   weatherModel?: string;
+  resultSchema?: 'rows' | 'columnar';
+  progressive?: boolean;
+  progressiveStride?: number;
+  previewImageSize?: string;
+  deadlineSeconds?: number;
+  processingFps?: number;
+  annotatedVideo?: boolean | 'mp4' | 'webm';
+  annotatedVideoCodec?: 'h264' | 'h265' | 'mpeg4' | 'vp8' | 'vp9' | 'av1';
+  annotatedVideoBitrate?: number | string;
+}
+
+/** Provisional aggregates streamed by a progressive video analysis */
+export interface ProgressivePartial {
+  pass: number;
+  passes: number;
+  passKind: 'preview' | 'upgrade' | 'fill';
+  coverage: number;
+  elapsed: number;
+  totalFrames: number;
+  vehicleCount: number;
+  humanCount: number;
+  vehicleStats: Record<string, number>;
+  humanStats: Record<string, number>;
+  avgConfidence: number;
+  weatherDistribution: Record<string, number>;
+  congestionDistribution: Record<string, number>;
+  perFrameColumns: Record<string, any[]>;
+  chartImages?: Record<string, string>;
 }
 
 /**
  * Check system capabilities (GPU/CPU detection)
- * Queries the backend to check what device (GPU/CPU) is actually available
- * Tries common route patterns
+ * Queries the backend to check what device (GPU/CPU) is actually available,
+ * along with its live capacity report
  */
 export async function checkSystemCapabilities(): Promise<SystemInfo> {
-  // Try different route patterns
-  const routes = [
-    '/api/system-info',
-    '/api/systeminfo',
-    '/api/device-info',
-    '/api/device',
-    '/system-info',
-    '/systeminfo',
-    '/device-info',
-    '/device',
-    '/api/gpu-info',
-    '/gpu-info',
-  ];
+  // /health embeds the same report under `system` (older backends only have /health)
+  const routes = ['/api/system-info', '/health'];
 
   for (const route of routes) {
     try {
@@ -67,14 +120,14 @@ export async function checkSystemCapabilities(): Promise<SystemInfo> {
       });
 
       if (response.ok) {
-        const info = await response.json();
+        const body = await response.json();
+        const info = route === '/health' ? body.system : body;
         
         // Validate the response structure
-        if (typeof info.hasGPU === 'boolean' && typeof info.device === 'string') {
+        if (info && typeof info.hasGPU === 'boolean' && typeof info.device === 'string') {
           console.log(`[GPU Detection] Successfully connected via ${route}`);
           return info;
         }
-        // If response is OK but wrong format, try next route
       }
     } catch (error) {
       // Try next route
@@ -82,8 +135,44 @@ export async function checkSystemCapabilities(): Promise<SystemInfo> {
     }
   }
 
-  // All routes failed
-  throw new Error(`Cannot reach backend at ${API_BASE_URL}. Tried routes: ${routes.join(', ')}. Make sure backend exposes one of these endpoints.`);
+  throw new Error(`Cannot reach backend at ${API_BASE_URL}. Tried routes: ${routes.join(', ')}.`);
+}
+
+const PER_FRAME_COLUMNS = [
+  'frame_number',
+  'vehicle_count',
+  'human_count',
+  'weather_primary',
+  'brightness_luminance_cd_per_m2',
+  'contrast_ratio',
+  'congestion_level',
+  'inferred',
+] as const;
+
+/**
+ * Rebuild `perFrameData` rows from the columnar `perFrameColumns` series
+ */
+function withPerFrameRows(result: any): any {
+  const columns = result?.perFrameColumns;
+  if (!columns || Array.isArray(result.perFrameData)) {
+    return result;
+  }
+  const count = columns.frame_number?.length ?? 0;
+  const rows = [];
+  for (let i = 0; i < count; i++) {
+    const row: Record<string, any> = {};
+    for (const name of PER_FRAME_COLUMNS) {
+      row[name] = columns[name]?.[i];
+    }
+    row.image_quality = {
+      brightness: columns.brightness?.[i] ?? 0,
+      contrast: columns.contrast?.[i] ?? 0,
+      brightness_luminance_cd_per_m2: row.brightness_luminance_cd_per_m2 ?? 0,
+      contrast_ratio: row.contrast_ratio ?? 0,
+    };
+    rows.push(row);
+  }
+  return { ...result, perFrameData: rows };
 }
 
 /**
@@ -92,11 +181,13 @@ export async function checkSystemCapabilities(): Promise<SystemInfo> {
 export async function analyzeVideo(
   file: File,
   settings: AnalysisSettings = {},
-  onProgress?: (progress: number, step: string) => void
+  onProgress?: (progress: number, step: string, eta?: number | null) => void,
+  onPartial?: (partial: ProgressivePartial) => void
 ): Promise<any> {
   const formData = new FormData();
   formData.append('video', file);
-  formData.append('settings', JSON.stringify(settings));
+  // Per-frame series come back as parallel arrays (much smaller than row objects)
+  formData.append('settings', JSON.stringify({ resultSchema: 'columnar', ...settings }));
 
   try {
     const response = await fetch(`${API_BASE_URL}/api/analyze-video`, {
@@ -128,7 +219,10 @@ export async function analyzeVideo(
                 try {
                   const data = JSON.parse(line.slice(6));
                   if (data.progress !== undefined && onProgress) {
-                    onProgress(data.progress, data.step || '');
+                    onProgress(data.progress, data.step || '', data.eta);
+                  }
+                  if (data.partial && onPartial) {
+                    onPartial(data.partial);
                   }
                   // If this looks like a final result (has summary, metadata, etc.), save it
                   if (data.summary && data.metadata) {
@@ -159,7 +253,10 @@ export async function analyzeVideo(
               console.log('[API] Received data:', { hasProgress: data.progress !== undefined, hasStep: data.step !== undefined, hasSummary: !!data.summary, hasMetadata: !!data.metadata, hasFrames: !!data.frames, hasImages: !!data.images });
               
               if (data.progress !== undefined && onProgress) {
-                onProgress(data.progress, data.step || '');
+                onProgress(data.progress, data.step || '', data.eta);
+              }
+              if (data.partial && onPartial) {
+                onPartial(data.partial);
               }
               // If this looks like a final result (has summary, metadata, etc.), save it
               if (data.summary && data.metadata) {
@@ -181,7 +278,7 @@ export async function analyzeVideo(
     // Return final result if we got one from streaming
     if (finalResult) {
       console.log('[API] Received final result with summary and metadata');
-      return finalResult;
+      return withPerFrameRows(finalResult);
     }
     
     // Try the last data that looked like a result
@@ -205,6 +302,167 @@ export async function analyzeVideo(
   }
 }
 
+/**
+ * URL of a finished job's annotated video (annotatedVideo setting); usable directly as a <video> src,
+ * the server answers range requests so the player can seek
+ */
+export function annotatedVideoUrl(jobId: string): string {
+  return `${API_BASE_URL}/api/results/${encodeURIComponent(jobId)}/video`;
+}
+
+/** Predicted runtime and memory of a video analysis on this node */
+export interface VideoProbe {
+  video: { width: number; height: number; fps: number; frameCount: number; duration: number; fileSizeBytes: number; bitRate: number | null; [key: string]: any };
+  device: 'cpu' | 'cuda';
+  estimate: {
+    framesToAnalyse: number;
+    frameInterval: number;
+    analysisSize: string;
+    costs: { analysis: number; decode: number; source: 'default' | 'measured' | 'calibrated'; samples: number };
+    seconds: number;
+    breakdown: { analysisSeconds: number; decodeSeconds: number; fixedSeconds: number };
+    memoryBytes: number;
+  };
+  calibration: { frames: number; analysisSecondsPerFrame?: number; decodeSecondsPerSourceFrame?: number } | null;
+  memory: { jobBytes: number; modelBytes: number; availableBytes: number | null; jobLimitBytes: number | null; fits: boolean };
+  activeJobs: number;
+}
+
+/**
+ * Probe a video before analysing it: container metadata plus predicted runtime and memory
+ * With calibrate, a few frames are analysed first so the estimate uses measured costs
+ */
+export async function probeVideo(
+  file: File,
+  settings: AnalysisSettings = {},
+  calibrate = false
+): Promise<VideoProbe> {
+  const formData = new FormData();
+  formData.append('video', file);
+  formData.append('settings', JSON.stringify(settings));
+  formData.append('calibrate', String(calibrate));
+
+  const response = await fetch(`${API_BASE_URL}/api/probe`, {
+    method: 'POST',
+    body: formData,
+  });
+
+  if (!response.ok) {
+    const error = await response.json().catch(() => ({}));
+    throw new Error(error.error || `Video probe failed: ${response.statusText}`);
+  }
+  return response.json();
+}
+
+export interface ImageSyncResult {
+  vehicleCount: number;
+  humanCount: number;
+  confidence: number;
+  weather: string | null;
+  detections: { label: string; score: number; box: [number, number, number, number] }[] | null;
+  imageQuality: {
+    brightness: number;
+    contrast: number;
+    dynamicRange: number;
+    brightness_luminance_cd_per_m2: number;
+    contrast_ratio: number;
+  };
+  annotatedImage: string | null;
+  metadata: { dimensions: string; detector: string; quantization: string };
+  timings: Record<string, number>;
+  processingTime: number;
+  jobId?: string;
+}
+
+/**
+ * Analyze a single image inline (no progress stream)
+ * Sends the raw file as the request body so the backend can decode it in memory
+ */
+export async function analyzeImageSync(
+  file: File | Blob,
+  settings: AnalysisSettings & { includeImage?: boolean; includeDetections?: boolean; includeWeather?: boolean; saveResult?: boolean } = {}
+): Promise<ImageSyncResult> {
+  const query = encodeURIComponent(JSON.stringify(settings));
+  const response = await fetch(`${API_BASE_URL}/api/analyze-image-sync?settings=${query}`, {
+    method: 'POST',
+    headers: { 'Content-Type': file.type || 'application/octet-stream' },
+    body: file,
+  });
+
+  if (!response.ok) {
+    const error = await response.json().catch(() => ({}));
+    throw new Error(error.error || `Image analysis failed: ${response.statusText}`);
+  }
+  return response.json();
+}
+
+export type BulkEvent =
+  | ({ type: 'image'; index: number; name: string } & ImageSyncResult)
+  | { type: 'error'; index?: number; name?: string; error: string }
+  | {
+      type: 'summary';
+      images: number;
+      failed: number;
+      vehicleCount: number;
+      humanCount: number;
+      meanVehicleCount: number;
+      meanHumanCount: number;
+      meanConfidence: number;
+      weatherDistribution: Record<string, number>;
+      busiestImage: { name: string; vehicleCount: number } | null;
+      processingTime: number;
+      imagesPerSecond: number;
+    };
+
+/**
+ * Analyze many images in one request (a zip/tar archive or a list of files)
+ * Calls onEvent for every result as it arrives and resolves with the summary
+ */
+export async function analyzeBulk(
+  input: File | File[],
+  settings: AnalysisSettings & { bulkBatchSize?: number; includeImage?: boolean } = {},
+  onEvent?: (event: BulkEvent) => void
+): Promise<BulkEvent | null> {
+  const formData = new FormData();
+  if (Array.isArray(input)) {
+    input.forEach((file) => formData.append('images', file));
+  } else {
+    formData.append('archive', input);
+  }
+  formData.append('settings', JSON.stringify(settings));
+
+  const response = await fetch(`${API_BASE_URL}/api/analyze-bulk`, {
+    method: 'POST',
+    body: formData,
+  });
+  if (!response.ok || !response.body) {
+    throw new Error(`Bulk analysis failed: ${response.statusText}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let summary: BulkEvent | null = null;
+
+  const handleLine = (line: string) => {
+    if (!line.trim()) return;
+    const event = JSON.parse(line) as BulkEvent;
+    if (event.type === 'summary') summary = event;
+    onEvent?.(event);
+  };
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split('\n');
+    buffer = lines.pop() || '';
+    lines.forEach(handleLine);
+  }
+  handleLine(buffer);
+  return summary;
+}
+
 /**
  * Analyze image file
  */
@@ -296,7 +554,7 @@ export async function analyzeImage(
     // Return final result if we got one from streaming
     if (finalResult) {
       console.log('[API] Received final result with summary and metadata');
-      return finalResult;
+      return withPerFrameRows(finalResult);
     }
     
     // Try the last data that looked like a result